@@ -20,6 +20,7 @@ def parse_js_ts_file(file_path):
         sourceType: 'module', 
         ecmaFeatures: {{ jsx: true }},
         ecmaVersion: 'latest',
+        loc: true,
     }});
     console.log(JSON.stringify(ast));
     }} catch (error) {{
@@ -61,16 +62,23 @@ def resolve_import_path(base_path, import_source, file_paths):
 
     return None
 
-def analyze_directory(directory):
+def analyze_directory(directory, paths=None):
     """
     Analyze a directory of JS/TS files to find file import/export relationships.
+    Besides the imported files, every JS/TS file gets its symbol table (functions, classes, methods and
+    exported names with their line ranges) and the references from its symbols to imported symbols.
     Args:
         directory (str): Path to the directory to analyze.
+        paths (set): Relative paths of the files to analyze, all files if None. Their imports are still
+            resolved against the whole directory, but their "imported_by" lists only the given files.
     Returns:
-        list: A list of dictionaries, each representing a file with its imports and imported_by relationships.
+        list: A list of dictionaries, each representing a file with its imports and imported_by relationships,
+            its symbols and its references.
     """
     file_imports = defaultdict(set)
     file_imported_by = defaultdict(set)
+    file_symbols = {}
+    file_references = {}
     # file_mapping = {}
 
     file_paths = []
@@ -78,12 +86,19 @@ def analyze_directory(directory):
         for file in files:
             full_path = os.path.join(root, file)
             file_paths.append(full_path)
+    analyzed_paths = file_paths
+    if paths is not None:
+        selected = {os.path.normpath(path) for path in paths}
+        analyzed_paths = [path for path in file_paths if os.path.normpath(os.path.relpath(path, directory)) in selected]
 
     # Step 2: Parse each JS/TS file for imports
-    for path in tqdm(file_paths):
+    for path in tqdm(analyzed_paths):
         if path.endswith(".js") or path.endswith(".ts") or path.endswith(".jsx") or path.endswith(".tsx"):
             ast_data = parse_js_ts_file(path)
             base_path = os.path.dirname(path)
+            relative_path = os.path.relpath(path, directory)
+            # local name -> (imported file, imported name), '*' for namespace imports
+            import_bindings = {}
             # Walk through the AST nodes to find import declarations
             for node in ast_data.get('body', []):
                 if node['type'] == 'ImportDeclaration':
@@ -91,24 +106,171 @@ def analyze_directory(directory):
                     import_source = node['source']['value']
                     resolved_path = resolve_import_path(base_path, import_source, file_paths)
                     if resolved_path:
-                        resolved_path = os.path.relpath(resolve_import_path(base_path, import_source, file_paths),
-                                                        directory)
-                        relative_path = os.path.relpath(path, directory)
+                        resolved_path = os.path.relpath(resolved_path, directory)
                         file_imports[relative_path].add(resolved_path)
                         file_imported_by[resolved_path].add(relative_path)
+                        for specifier in node.get('specifiers', []):
+                            if specifier['type'] == 'ImportSpecifier':
+                                imported = specifier['imported']
+                                imported_name = imported.get('name', imported.get('value'))
+                            elif specifier['type'] == 'ImportDefaultSpecifier':
+                                imported_name = 'default'
+                            else:
+                                imported_name = '*'
+                            import_bindings[specifier['local']['name']] = (resolved_path, imported_name)
+
+            file_symbols[relative_path] = extract_symbols(ast_data)
+            file_references[relative_path] = extract_references(ast_data, import_bindings)
 
     # Create a structured list of file relationships
     result = []
-    for path in file_paths:
+    for path in analyzed_paths:
         relative_path = os.path.relpath(path, directory)
         result.append({
             "file": relative_path,
             "calls": list(file_imports[relative_path]),
-            "called_by": list(file_imported_by[relative_path])
+            "called_by": list(file_imported_by[relative_path]),
+            "symbols": file_symbols.get(relative_path, []),
+            "references": file_references.get(relative_path, [])
         })
 
     return result
 
+def get_declared_symbols(node):
+    """
+    Return the symbols declared by a top-level statement as (name, kind, node) tuples.
+    """
+    declaration = node
+    if node['type'] in ('ExportNamedDeclaration', 'ExportDefaultDeclaration'):
+        declaration = node.get('declaration')
+        if declaration is None:
+            return []
+
+    if declaration['type'] in ('FunctionDeclaration', 'TSDeclareFunction'):
+        name = declaration['id']['name'] if declaration.get('id') else 'default'
+        return [(name, 'function', node)]
+    if declaration['type'] == 'ClassDeclaration':
+        name = declaration['id']['name'] if declaration.get('id') else 'default'
+        symbols = [(name, 'class', node)]
+        for member in declaration['body']['body']:
+            if member['type'] in ('MethodDefinition', 'PropertyDefinition') \
+                    and not member.get('computed') and member['key']['type'] == 'Identifier':
+                symbols.append((f"{name}.{member['key']['name']}", 'method', member))
+        return symbols
+    if declaration['type'] == 'VariableDeclaration':
+        symbols = []
+        for declarator in declaration['declarations']:
+            if declarator['id']['type'] != 'Identifier':
+                continue
+            init_type = (declarator.get('init') or {}).get('type')
+            kind = 'function' if init_type in ('ArrowFunctionExpression', 'FunctionExpression') else 'variable'
+            if kind == 'variable' and node is declaration:
+                # plain variables are only interesting if other files can import them
+                continue
+            symbols.append((declarator['id']['name'], kind, declarator if node is declaration else node))
+        return symbols
+    if declaration['type'] in ('TSInterfaceDeclaration', 'TSTypeAliasDeclaration', 'TSEnumDeclaration'):
+        return [(declaration['id']['name'], 'type', node)]
+    return []
+
+
+def extract_symbols(ast_data):
+    """
+    Collect the functions, classes, methods and exported names declared at the top level of a module.
+    Returns:
+        list: Dictionaries with name, kind, start_line, end_line, exported and default_export.
+    """
+    symbols = {}
+    exported_names = set()
+    default_export = None
+    for node in ast_data.get('body', []):
+        exported = node['type'] in ('ExportNamedDeclaration', 'ExportDefaultDeclaration')
+        for name, kind, symbol_node in get_declared_symbols(node):
+            symbols[name] = {
+                "name": name,
+                "kind": kind,
+                "start_line": symbol_node['loc']['start']['line'],
+                "end_line": symbol_node['loc']['end']['line'],
+                "exported": exported and kind != 'method',
+                "default_export": False
+            }
+            if node['type'] == 'ExportDefaultDeclaration' and kind != 'method':
+                default_export = name
+        if node['type'] == 'ExportNamedDeclaration' and node.get('source') is None:
+            # `export { a, b as c }`
+            for specifier in node.get('specifiers', []):
+                exported_names.add(specifier['local'].get('name'))
+        elif node['type'] == 'ExportDefaultDeclaration' and node['declaration']['type'] == 'Identifier':
+            # `export default Component`
+            default_export = node['declaration']['name']
+
+    for name in exported_names | {default_export}:
+        if name in symbols:
+            symbols[name]["exported"] = True
+    if default_export in symbols:
+        symbols[default_export]["default_export"] = True
+    return list(symbols.values())
+
+
+def extract_references(ast_data, import_bindings):
+    """
+    Find uses of imported names and record them together with the enclosing top-level symbol.
+    Returns:
+        list: Dictionaries with the referenced file and symbol, the referencing symbol and the line.
+    """
+    references = {}
+
+    def add_reference(local_name, symbol, from_symbol, node):
+        file = import_bindings[local_name][0]
+        references.setdefault((file, symbol, from_symbol), node['loc']['start']['line'])
+
+    def walk(node, from_symbol, skip=frozenset()):
+        if isinstance(node, list):
+            for child in node:
+                walk(child, from_symbol, skip)
+            return
+        if not isinstance(node, dict) or 'type' not in node or id(node) in skip:
+            return
+
+        node_type = node['type']
+        if node_type in ('Identifier', 'JSXIdentifier') and node['name'] in import_bindings:
+            imported_name = import_bindings[node['name']][1]
+            if imported_name != '*':
+                add_reference(node['name'], imported_name, from_symbol, node)
+            return
+        if node_type in ('MemberExpression', 'JSXMemberExpression'):
+            namespace = node['object']
+            if namespace['type'] in ('Identifier', 'JSXIdentifier') \
+                    and import_bindings.get(namespace['name'], (None, None))[1] == '*' \
+                    and not node.get('computed') and 'name' in node['property']:
+                add_reference(namespace['name'], node['property']['name'], from_symbol, node)
+                return
+            walk(node['object'], from_symbol, skip)
+            if node.get('computed'):
+                walk(node['property'], from_symbol, skip)
+            return
+        if node_type == 'Property' and not node.get('computed') and not node.get('shorthand'):
+            walk(node['value'], from_symbol, skip)
+            return
+
+        for key, value in node.items():
+            if key not in ('loc', 'range', 'parent'):
+                walk(value, from_symbol, skip)
+
+    for statement in ast_data.get('body', []):
+        if statement['type'] == 'ImportDeclaration':
+            continue
+        symbols = get_declared_symbols(statement)
+        methods = [(name, symbol_node) for name, kind, symbol_node in symbols if kind == 'method']
+        # references inside a method belong to the method, the rest of the class to the class
+        for name, method in methods:
+            walk(method, name)
+        walk(statement, symbols[0][0] if symbols else None, {id(method) for _, method in methods})
+
+    return [{"file": file, "symbol": symbol, "from_symbol": from_symbol, "line": line}
+            for (file, symbol, from_symbol), line in references.items()]
+
+
 def main():
     directory = "/Users/lucas/Downloads/jitsi-meet-master"
     if not os.path.isdir(directory):
@@ -3,19 +3,28 @@ import ast
 from collections import defaultdict
 from re import match
 
-def analyze_directory(directory):
+def analyze_directory(directory, paths=None):
     """
     Analyze a directory of Python files to find file call relationships.
 
+    Besides the imported files, every Python file gets its symbol table (functions, classes and methods
+    with their line ranges) and the references from its symbols to symbols of imported files.
+
     Args:
         directory (str): Path to the directory to analyze.
+        paths (set): Relative paths of the files to analyze, all files if None. Their imports are still
+            resolved against the whole directory, but their "called_by" lists only the given files.
 
     Returns:
-        list: A list of dictionaries, each representing a file with its calls and called_by relationships.
+        list: A list of dictionaries, each representing a file with its calls and called_by relationships,
+            its symbols and its references.
     """
     file_calls = defaultdict(set)
     file_called_by = defaultdict(set)
+    file_symbols = {}
+    file_references = {}
     file_list = []
+    selected = None if paths is None else {os.path.normpath(path) for path in paths}
     
     blacklist = ['node_modules', '\.(.*)$', '__pycache__', '(.*)\.lock', 'package-lock.json']
     whitelist = ['(.*)\.py$']
@@ -29,6 +38,8 @@ def analyze_directory(directory):
             relative_path = os.path.join(os.path.relpath(root, directory), file)
             file_list.append(relative_path)
             full_path = os.path.join(root, file)
+    if selected is not None:
+        file_list = [rel_path for rel_path in file_list if os.path.normpath(rel_path) in selected]
 
     # Helper to resolve module to files
     def resolve_module_to_files(base_path, module_name):
@@ -91,20 +102,34 @@ def analyze_directory(directory):
             for module_file in module_files:
                 file_calls[file_path].add(module_file)
                 file_called_by[module_file].add(file_path)
-                
+            return module_files
+
+        # names bound by `from module import name` and modules bound by `import module`
+        imported_names = {}
+        imported_modules = {}
+
         # Analyze imports and function calls
         for node in ast.walk(tree):
             if isinstance(node, ast.Import):
                 # Handle `import module`
                 for alias in node.names:
                     module_name = alias.name
-                    add_imports(rel_path, module_name)
+                    module_files = add_imports(rel_path, module_name)
+                    imported_modules[alias.asname or module_name] = module_files
 
             elif isinstance(node, ast.ImportFrom):
                 # Handle `from module import something`
                 if node.module:
                     module_name = node.module
-                    add_imports(rel_path, module_name)
+                    module_files = add_imports(rel_path, module_name)
+                    for alias in node.names:
+                        if alias.name != '*':
+                            imported_names[alias.asname or alias.name] = (module_files, alias.name)
+
+        file_symbols[rel_path] = extract_symbols(tree)
+        reference_visitor = ReferenceVisitor(imported_names, imported_modules)
+        reference_visitor.visit(tree)
+        file_references[rel_path] = reference_visitor.get_references()
 
     # Create a structured list of file relationships
     result = []
@@ -113,12 +138,120 @@ def analyze_directory(directory):
         result.append({
             "file": rel_path,
             "calls": list(file_calls.get(rel_path, [])),
-            "called_by": list(file_called_by.get(rel_path, []))
+            "called_by": list(file_called_by.get(rel_path, [])),
+            "symbols": file_symbols.get(rel_path, []),
+            "references": file_references.get(rel_path, [])
         })
 
     return result
 
 
+def extract_symbols(tree):
+    """
+    Collect the functions, classes and methods defined at the top level of a module.
+
+    Returns:
+        list: Dictionaries with name, kind, start_line, end_line and exported.
+    """
+    exported_names = None
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and any(isinstance(target, ast.Name) and target.id == '__all__'
+                                                for target in node.targets):
+            try:
+                exported_names = set(ast.literal_eval(node.value))
+            except ValueError:
+                pass
+
+    symbols = []
+
+    def add_symbol(node, name, kind):
+        top_level_name = name.split('.')[0]
+        symbols.append({
+            "name": name,
+            "kind": kind,
+            "start_line": min([node.lineno] + [decorator.lineno for decorator in node.decorator_list]),
+            "end_line": node.end_lineno,
+            "exported": not top_level_name.startswith('_') and (exported_names is None
+                                                                or top_level_name in exported_names)
+        })
+
+    for node in tree.body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            add_symbol(node, node.name, "function")
+        elif isinstance(node, ast.ClassDef):
+            add_symbol(node, node.name, "class")
+            for child in node.body:
+                if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                    add_symbol(child, f"{node.name}.{child.name}", "method")
+    return symbols
+
+
+def dotted_name(node):
+    parts = []
+    while isinstance(node, ast.Attribute):
+        parts.append(node.attr)
+        node = node.value
+    if not isinstance(node, ast.Name):
+        return None
+    parts.append(node.id)
+    return ".".join(reversed(parts))
+
+
+class ReferenceVisitor(ast.NodeVisitor):
+    """Find uses of imported names and record them together with the enclosing symbol."""
+
+    def __init__(self, imported_names, imported_modules):
+        self.imported_names = imported_names
+        self.imported_modules = imported_modules
+        self.scope = []
+        self.references = {}
+
+    def enclosing_symbol(self):
+        if not self.scope:
+            return None
+        # symbols are top level functions and classes plus the methods of those classes
+        if self.scope[0][1] == "class" and len(self.scope) > 1:
+            return f"{self.scope[0][0]}.{self.scope[1][0]}"
+        return self.scope[0][0]
+
+    def add_reference(self, files, symbol, node):
+        from_symbol = self.enclosing_symbol()
+        for file in files:
+            self.references.setdefault((file, symbol, from_symbol), node.lineno)
+
+    def visit_scope(self, node, kind):
+        self.scope.append((node.name, kind))
+        self.generic_visit(node)
+        self.scope.pop()
+
+    def visit_FunctionDef(self, node):
+        self.visit_scope(node, "function")
+
+    def visit_AsyncFunctionDef(self, node):
+        self.visit_scope(node, "function")
+
+    def visit_ClassDef(self, node):
+        self.visit_scope(node, "class")
+
+    def visit_Name(self, node):
+        if isinstance(node.ctx, ast.Load) and node.id in self.imported_names:
+            files, symbol = self.imported_names[node.id]
+            self.add_reference(files, symbol, node)
+
+    def visit_Attribute(self, node):
+        name = dotted_name(node)
+        if name is not None:
+            for module, files in self.imported_modules.items():
+                if name.startswith(module + "."):
+                    self.add_reference(files, name[len(module) + 1:].split(".")[0], node)
+                    return
+        self.generic_visit(node)
+
+    def get_references(self):
+        return [{"file": file, "symbol": symbol, "from_symbol": from_symbol, "line": line}
+                for (file, symbol, from_symbol), line in self.references.items()]
+
+
 def main():
     # directory = "../data_repos/ftlr/datasets/frigate/code"
     directory = "../../NewsPolitics/newsscraper"
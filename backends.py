@@ -0,0 +1,251 @@
+import contextvars
+import hashlib
+import json
+import math
+import re
+import threading
+from collections import Counter
+
+from utils import get_openai_query_result, get_deepseek_query_result, get_local_llm_query_result, \
+    stream_openai_query_result, stream_deepseek_query_result, stream_local_llm_query_result, get_openai_embeddings, get_ollama_embeddings, get_input_tokens, set_input_tokens, get_output_tokens, \
+    set_output_tokens, get_model_encoding_string
+
+# Stages of the pipeline that query an LLM, each can use its own backend, model and concurrency
+LLM_STAGES = ("summary", "reformulate", "missing", "filter", "relevant", "final")
+EMBEDDING_STAGE = "embeddings"
+
+DEFAULT_STAGE_CONFIG = {
+    **{stage: {"backend": "openai", "model": "gpt-4o-mini", "concurrency": 10} for stage in LLM_STAGES},
+    EMBEDDING_STAGE: {"backend": "openai", "model": "text-embedding-3-small", "concurrency": 4},
+}
+
+FAKE_EMBEDDING_DIMENSIONS = 256
+
+llm_backends = {}
+llm_stream_backends = {}
+embedding_backends = {}
+
+_stage_config = {stage: dict(config) for stage, config in DEFAULT_STAGE_CONFIG.items()}
+# backend and model overrides of the project being processed, the concurrency limits stay shared
+_project_stage_config = contextvars.ContextVar("project_stage_config", default={})
+_stage_semaphores = {}
+_stage_semaphores_lock = threading.Lock()
+
+
+def register_llm_backend(name):
+    """Register ``fn(query, model)`` as LLM backend under the given name."""
+    def decorator(fn):
+        llm_backends[name] = fn
+        return fn
+    return decorator
+
+
+def register_llm_stream_backend(name):
+    """Register ``fn(query, model)``, yielding the completion text as it is generated, for an LLM backend."""
+    def decorator(fn):
+        llm_stream_backends[name] = fn
+        return fn
+    return decorator
+
+
+def register_embedding_backend(name):
+    """Register ``fn(model)``, returning a LangChain compatible embeddings object, under the given name."""
+    def decorator(fn):
+        embedding_backends[name] = fn
+        return fn
+    return decorator
+
+
+register_llm_backend("openai")(lambda query, model: get_openai_query_result(query, model=model))
+register_llm_backend("deepseek")(lambda query, model: get_deepseek_query_result(query, model=model))
+register_llm_backend("ollama")(lambda query, model: get_local_llm_query_result(query, model=model))
+register_llm_stream_backend("openai")(lambda query, model: stream_openai_query_result(query, model=model))
+register_llm_stream_backend("deepseek")(lambda query, model: stream_deepseek_query_result(query, model=model))
+register_llm_stream_backend("ollama")(lambda query, model: stream_local_llm_query_result(query, model=model))
+register_embedding_backend("openai")(lambda model: get_openai_embeddings(model=model))
+register_embedding_backend("ollama")(lambda model: get_ollama_embeddings(model=model))
+
+
+def _expand_stage_config(config):
+    expanded = {}
+    for stage, stage_config in config.items():
+        for name in LLM_STAGES if stage == "all" else (stage,):
+            if name not in _stage_config:
+                raise ValueError(f"Unknown stage '{name}', choose from {', '.join(_stage_config)}")
+            expanded.setdefault(name, {}).update(stage_config)
+            registry = embedding_backends if name == EMBEDDING_STAGE else llm_backends
+            backend = expanded[name].get("backend", _stage_config[name]["backend"])
+            if backend not in registry:
+                raise ValueError(f"Unknown backend '{backend}' for stage '{name}', choose from {', '.join(registry)}")
+    return expanded
+
+
+def configure_backends(config):
+    """
+    Override the backend of some stages for the whole process.
+
+    Args:
+        config (dict): Mapping of stage name (or "all" for every LLM stage) to a dict with any of
+            "backend", "model" and "concurrency".
+    """
+    for stage, stage_config in _expand_stage_config(config).items():
+        _stage_config[stage].update(stage_config)
+    with _stage_semaphores_lock:
+        _stage_semaphores.clear()
+
+
+def use_project_backends(*configs):
+    """
+    Override backend and model of some stages for the current context, i.e. the project being processed.
+
+    Later configs take precedence. Threads started from the context have to run in a copy of it
+    (``contextvars.copy_context().run``) to see the overrides.
+    """
+    project_config = {}
+    for config in configs:
+        for stage, stage_config in _expand_stage_config(config).items():
+            project_config.setdefault(stage, {}).update(
+                {key: value for key, value in stage_config.items() if key != "concurrency"})
+    _project_stage_config.set(project_config)
+
+
+def get_stage_config(stage):
+    return {**_stage_config[stage], **_project_stage_config.get().get(stage, {})}
+
+
+def parse_backend_option(option):
+    """
+    Parse a ``STAGE=BACKEND[:MODEL]`` command line option into a config for ``configure_backends``.
+    """
+    stage, _, backend = option.partition("=")
+    backend, _, model = backend.partition(":")
+    if not stage or not backend:
+        raise ValueError(f"Invalid backend option '{option}', expected STAGE=BACKEND[:MODEL]")
+    config = {"backend": backend}
+    if model:
+        config["model"] = model
+    return {stage: config}
+
+
+def get_stage_concurrency(stage):
+    return _stage_config[stage]["concurrency"]
+
+
+def get_stage_semaphore(stage):
+    with _stage_semaphores_lock:
+        if stage not in _stage_semaphores:
+            _stage_semaphores[stage] = threading.BoundedSemaphore(_stage_config[stage]["concurrency"])
+        return _stage_semaphores[stage]
+
+
+def get_llm_query_result(query, stage):
+    """
+    Query the LLM configured for the given pipeline stage.
+    """
+    config = get_stage_config(stage)
+    with get_stage_semaphore(stage):
+        return llm_backends[config["backend"]](query, config["model"])
+
+
+def stream_llm_query_result(query, stage):
+    """
+    Query the LLM configured for the given pipeline stage and yield the text as it is generated.
+
+    Backends without streaming support yield the whole completion at once.
+    """
+    config = get_stage_config(stage)
+    with get_stage_semaphore(stage):
+        if config["backend"] in llm_stream_backends:
+            yield from llm_stream_backends[config["backend"]](query, config["model"])
+        else:
+            yield llm_backends[config["backend"]](query, config["model"])
+
+
+class LimitedEmbeddings:
+    """Wraps an embeddings object so that all users share the concurrency limit of the embedding stage."""
+
+    def __init__(self, embeddings):
+        self.embeddings = embeddings
+
+    def embed_documents(self, texts):
+        with get_stage_semaphore(EMBEDDING_STAGE):
+            return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text):
+        with get_stage_semaphore(EMBEDDING_STAGE):
+            return self.embeddings.embed_query(text)
+
+
+def get_embeddings():
+    config = get_stage_config(EMBEDDING_STAGE)
+    return LimitedEmbeddings(embedding_backends[config["backend"]](config["model"]))
+
+
+def get_embedding_token_counter():
+    """
+    Return a function counting the tokens the embedding backend is billed for.
+    """
+    if get_stage_config(EMBEDDING_STAGE)["backend"] == "fake":
+        # tiktoken downloads its encodings, the offline backend must not need the network
+        return lambda text: len(text.split())
+
+    from tiktoken import get_encoding
+
+    encoding = get_encoding(get_model_encoding_string())
+    return lambda text: len(encoding.encode(text))
+
+
+# Deterministic offline stand-ins for tests and benchmarks, they never leave the process
+
+FILE_NAME_PATTERN = re.compile(r'^\s*(?:Filename )?([\w./@-]+\.\w+):', re.MULTILINE)
+WORD_PATTERN = re.compile(r'[A-Za-z_][A-Za-z0-9_]{2,}')
+
+
+@register_llm_backend("fake")
+def get_fake_query_result(query, model):
+    set_input_tokens(get_input_tokens() + len(query.split()))
+    if "JSON object" in query:
+        # packed prompts get back a summary of every file section
+        sections = FILE_NAME_PATTERN.split(query)[1:]
+        result = json.dumps({name: summarise_words(model, section) for name, section in zip(sections[::2],
+                                                                                              sections[1::2])})
+    elif "JSON" in query:
+        # list prompts get back every file name they mention
+        result = json.dumps(list(dict.fromkeys(FILE_NAME_PATTERN.findall(query))))
+    else:
+        result = summarise_words(model, query[-4000:])
+    set_output_tokens(get_output_tokens() + len(result.split()))
+    return result
+
+
+def summarise_words(model, text):
+    words = Counter(word.lower() for word in WORD_PATTERN.findall(text))
+    digest = hashlib.sha256(text.encode("utf-8")).hexdigest()[:8]
+    return f"{model} {digest}: " + " ".join(word for word, _ in words.most_common(20))
+
+
+@register_llm_stream_backend("fake")
+def stream_fake_query_result(query, model):
+    for word in re.split(r'(?<= )', get_fake_query_result(query, model)):
+        yield word
+
+
+class FakeEmbeddings:
+    """Hashed bag of words vectors, similar texts get similar vectors without calling any model."""
+
+    def __init__(self, model):
+        self.model = model
+
+    def embed_query(self, text):
+        vector = [0.0] * FAKE_EMBEDDING_DIMENSIONS
+        for word in WORD_PATTERN.findall(text):
+            digest = hashlib.md5(word.lower().encode("utf-8")).digest()
+            vector[int.from_bytes(digest[:4], "little") % FAKE_EMBEDDING_DIMENSIONS] += 1.0 if digest[4] & 1 else -1.0
+        norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+        return [value / norm for value in vector]
+
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+
+register_embedding_backend("fake")(FakeEmbeddings)
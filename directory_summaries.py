@@ -0,0 +1,245 @@
+import hashlib
+import os
+from contextvars import copy_context
+from concurrent.futures import ThreadPoolExecutor
+
+from backends import get_llm_query_result, get_embeddings, get_embedding_token_counter, get_stage_concurrency
+from utils import get_store_dir_from_repository, connect_summaries_db, get_embedding_tokens, set_embedding_tokens
+
+# characters of each child summary that go into the roll-up of its directory
+ROLLUP_CHILD_CHARS = 1500
+# characters of child summaries per roll-up prompt, the remaining children are only listed by name
+ROLLUP_MAX_INPUT_CHARS = 60000
+DEFAULT_TOP_DIRECTORIES = 3
+VECTORIZE_CHUNK_SIZE = 10
+
+ROLLUP_PROMPT = \
+    """
+    You are an expert software engineer who has been asked to generate a summary of a directory of a code base.
+    You are given the summaries of the files and subdirectories it contains.
+    Summarise what the directory as a whole is responsible for, its main components and how they are used,
+    including keywords at the end.
+    The summary will later be stored in a vector database to find the directories relevant to software requirements.
+    Be as concise as possible and do not repeat yourself.
+
+    The directory is called: {directory}
+
+    Its contents are:
+    {children}
+    """
+
+
+def create_directory_summary_table(conn):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS directory_summaries (
+        directory TEXT PRIMARY KEY,
+        summary TEXT NOT NULL,
+        children_hash TEXT NOT NULL
+    )
+    """)
+
+
+def get_parent_directory(path):
+    return os.path.dirname(os.path.normpath(path)) or "."
+
+
+def _load_directory_tree(conn):
+    # only the beginning of each file's first summary is kept, not the contents
+    children = {}
+    cursor = conn.execute("""
+        SELECT f.file, s.summary FROM summaries s
+        JOIN files f ON f.id = s.file_id
+        WHERE s.chunk_index = 0
+        ORDER BY f.file
+        """)
+    for file, summary in cursor:
+        child = os.path.normpath(file)
+        parent = get_parent_directory(child)
+        children.setdefault(parent, {})[child] = summary[:ROLLUP_CHILD_CHARS]
+        # register the directory with all of its ancestors
+        while parent != ".":
+            grandparent = get_parent_directory(parent)
+            children.setdefault(grandparent, {}).setdefault(parent, None)
+            parent = grandparent
+    return children
+
+
+def _summarise_directory(directory_name, children):
+    if len(children) == 1:
+        # a directory with a single child is described by the child, no need to ask the LLM
+        return next(iter(children.values()))
+
+    parts = []
+    length = 0
+    for child, summary in sorted(children.items()):
+        if length + len(summary) > ROLLUP_MAX_INPUT_CHARS:
+            parts.append(f"{child}: (not summarised)")
+            continue
+        parts.append(f"{child}: {summary}")
+        length += len(summary)
+    return get_llm_query_result(ROLLUP_PROMPT.format(directory=directory_name, children="\n\n".join(parts)),
+                                "summary")
+
+
+def build_directory_summaries(directory, workers=None):
+    """
+    Roll the file summaries up into a summary per directory, from the deepest directories to the root.
+
+    A directory is only summarised again when the summaries of its children changed. Directories at
+    the same depth are independent and summarised concurrently.
+
+    Returns:
+        int: The number of directories whose summary was generated.
+    """
+    conn = connect_summaries_db(directory)
+    create_directory_summary_table(conn)
+    tree = _load_directory_tree(conn)
+    stored = {name: (summary, children_hash) for name, summary, children_hash in conn.execute(
+        "SELECT directory, summary, children_hash FROM directory_summaries")}
+
+    depths = {}
+    for name in tree:
+        depths.setdefault(0 if name == "." else name.count(os.sep) + 1, []).append(name)
+
+    summaries = {}
+    generated = 0
+    workers = workers or get_stage_concurrency("summary")
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for depth in sorted(depths, reverse=True):
+            futures = {}
+            for name in depths[depth]:
+                children = {child: summary if summary is not None else summaries.get(child, "")
+                            for child, summary in tree[name].items()}
+                children_hash = hashlib.sha256(repr(sorted(children.items())).encode("utf-8")).hexdigest()
+                if name in stored and stored[name][1] == children_hash:
+                    summaries[name] = stored[name][0]
+                    continue
+                futures[name] = (children_hash, executor.submit(copy_context().run, _summarise_directory,
+                                                                name, children))
+
+            rows = []
+            for name, (children_hash, future) in futures.items():
+                try:
+                    summaries[name] = future.result()
+                except Exception as e:
+                    print(f"Error summarising directory {name}: {e}")
+                    summaries[name] = ""
+                    continue
+                rows.append((name, summaries[name], children_hash))
+            with conn:
+                conn.executemany("""
+                    INSERT INTO directory_summaries (directory, summary, children_hash) VALUES (?, ?, ?)
+                    ON CONFLICT(directory) DO UPDATE SET summary = excluded.summary,
+                        children_hash = excluded.children_hash
+                    """, rows)
+            generated += len(rows)
+
+    with conn:
+        conn.executemany("DELETE FROM directory_summaries WHERE directory = ?",
+                         [(name,) for name in stored if name not in tree])
+    conn.close()
+    return generated
+
+
+def initialize_directory_vector_db(directory):
+    """
+    Vectorize the directory roll-ups, only directories whose children changed are embedded again.
+
+    Each roll-up is stored under the name of its directory, with the hash of the children it was
+    generated from, the vectors of removed directories and of outdated roll-ups are deleted.
+
+    Returns:
+        int: The number of embedded roll-ups.
+    """
+    from langchain_chroma import Chroma
+    from langchain_core.documents import Document
+
+    store_dir = get_store_dir_from_repository(directory)
+    vector_store_directories = Chroma(embedding_function=get_embeddings(),
+                                      persist_directory=f"{store_dir}/directory_store")
+    conn = connect_summaries_db(directory)
+    create_directory_summary_table(conn)
+    rollups = {name: (summary, children_hash) for name, summary, children_hash in conn.execute(
+        "SELECT directory, summary, children_hash FROM directory_summaries WHERE summary != ''")}
+    conn.close()
+
+    stored = vector_store_directories.get(include=["metadatas"])
+    current = set()
+    outdated = []
+    for document_id, metadata in zip(stored["ids"], stored["metadatas"]):
+        rollup = rollups.get(metadata.get("directory"))
+        # vectors stored without the hash, or under another id, are replaced as well
+        if document_id == metadata.get("directory") and rollup is not None and \
+                metadata.get("children_hash") == rollup[1]:
+            current.add(document_id)
+        else:
+            outdated.append(document_id)
+    if outdated:
+        vector_store_directories.delete(ids=outdated)
+
+    count_tokens = get_embedding_token_counter()
+    chunk = []
+    embedded = 0
+    for name, (summary, children_hash) in sorted(rollups.items()):
+        if name in current:
+            continue
+        chunk.append(Document(page_content=f"Directory {name}: {summary}",
+                              metadata={"directory": name, "children_hash": children_hash}))
+        set_embedding_tokens(get_embedding_tokens() + count_tokens(chunk[-1].page_content))
+        if len(chunk) >= VECTORIZE_CHUNK_SIZE:
+            vector_store_directories.add_documents(chunk, ids=[document.metadata["directory"] for document in chunk])
+            embedded += len(chunk)
+            chunk = []
+    if chunk:
+        vector_store_directories.add_documents(chunk, ids=[document.metadata["directory"] for document in chunk])
+        embedded += len(chunk)
+    return embedded
+
+
+def find_relevant_directories(query, directory, k=DEFAULT_TOP_DIRECTORIES, embedding=None):
+    """
+    Search the directory roll-ups for the subtrees relevant to the query.
+
+    The query is embedded unless its ``embedding`` is given.
+
+    Returns:
+        list: Directory names relative to the repository root, best first, without directories that lie
+            inside another returned directory. Empty if no roll-ups were vectorized.
+    """
+    from langchain_chroma import Chroma
+
+    store_dir = get_store_dir_from_repository(directory)
+    if not os.path.isdir(f"{store_dir}/directory_store"):
+        return []
+    vector_store_directories = Chroma(embedding_function=get_embeddings(),
+                                      persist_directory=f"{store_dir}/directory_store")
+    if embedding is None:
+        embedding = get_embeddings().embed_query(query)
+        set_embedding_tokens(get_embedding_tokens() + get_embedding_token_counter()(query))
+    # the root covers everything, it never narrows the search
+    documents = vector_store_directories.similarity_search_by_vector(embedding, k=k + 1,
+                                                                     filter={"directory": {"$ne": "."}})
+
+    selected = []
+    for document in documents:
+        name = document.metadata["directory"]
+        if not any(is_in_directory(name, other) or is_in_directory(other, name) for other in selected):
+            selected.append(name)
+    return selected[:k]
+
+
+def is_in_directory(path, directory):
+    path = os.path.normpath(path)
+    return directory == "." or path == directory or path.startswith(directory + os.sep)
+
+
+def get_files_in_directories(directory, directories):
+    """
+    Returns:
+        list: The summarised files (as stored) inside any of the given directories.
+    """
+    conn = connect_summaries_db(directory)
+    files = [file for file, in conn.execute("SELECT file FROM files")
+             if any(is_in_directory(file, name) for name in directories)]
+    conn.close()
+    return files
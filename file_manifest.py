@@ -0,0 +1,228 @@
+import codecs
+import hashlib
+import os
+import sqlite3
+import time
+
+from near_duplicates import compute_simhash
+
+TEXT = "text"
+BINARY = "binary"
+TOO_LARGE = "too_large"
+MINIFIED = "minified"
+GENERATED = "generated"
+
+MAX_TEXT_FILE_SIZE = 1024 * 1024
+SNIFF_SIZE = 8192
+READ_BLOCK_SIZE = 1 << 16
+MINIFIED_MIN_SAMPLE = 2048
+MINIFIED_AVERAGE_LINE_LENGTH = 300
+MANIFEST_FLUSH_SIZE = 500
+# bump to re-inspect all files after the inspection changed
+MANIFEST_VERSION = 1
+# markers of generated code in the header of a file
+GENERATED_HEADER_SIZE = 1024
+GENERATED_MARKERS = (b'@generated', b'do not edit', b'auto-generated', b'autogenerated', b'code generated by')
+
+BINARY_EXTENSIONS = {
+    '.png', '.jpg', '.jpeg', '.gif', '.bmp', '.ico', '.icns', '.webp', '.avif', '.tif', '.tiff', '.psd', '.pdf',
+    '.zip', '.gz', '.tgz', '.bz2', '.xz', '.zst', '.7z', '.rar', '.tar', '.jar', '.war', '.whl', '.egg',
+    '.woff', '.woff2', '.ttf', '.otf', '.eot', '.mp3', '.mp4', '.m4a', '.wav', '.ogg', '.oga', '.opus', '.flac',
+    '.webm', '.mov', '.avi', '.mkv', '.so', '.dylib', '.dll', '.exe', '.bin', '.o', '.a', '.lib', '.pyc', '.pyo',
+    '.class', '.wasm', '.db', '.sqlite', '.sqlite3', '.pkl', '.pickle', '.npy', '.npz', '.onnx', '.pt', '.h5',
+    '.parquet', '.keystore', '.p12', '.der',
+}
+
+MINIFIED_SUFFIXES = ('.min.js', '.min.mjs', '.min.css', '.bundle.js', '.chunk.js', '.js.map', '.css.map')
+
+
+def classify_by_name(path, size):
+    """
+    Classify a file from its name and size alone.
+
+    Returns:
+        str: The verdict, or None if the content has to be sniffed.
+    """
+    name = os.path.basename(path).lower()
+    if name.endswith(MINIFIED_SUFFIXES):
+        return MINIFIED
+    extension = os.path.splitext(name)[1]
+    if extension in BINARY_EXTENSIONS:
+        return BINARY
+    if size > MAX_TEXT_FILE_SIZE:
+        return TOO_LARGE
+    return None
+
+
+def classify_sample(path, sample):
+    """
+    Classify a file from the first bytes of its content.
+
+    A null byte or invalid UTF-8 marks the file as binary, very long lines as minified and a
+    "do not edit" style marker in the header as generated.
+    """
+    if b'\0' in sample:
+        return BINARY
+    try:
+        # incremental, so a multi-byte character cut off at the end of the sample is fine
+        codecs.getincrementaldecoder("utf-8")().decode(sample, final=False)
+    except UnicodeDecodeError:
+        return BINARY
+    if os.path.splitext(path)[1].lower() in ('.js', '.mjs', '.cjs', '.css', '.json') \
+            and len(sample) >= MINIFIED_MIN_SAMPLE \
+            and len(sample) / (sample.count(b'\n') + 1) > MINIFIED_AVERAGE_LINE_LENGTH:
+        return MINIFIED
+    header = sample[:GENERATED_HEADER_SIZE].lower()
+    if any(marker in header for marker in GENERATED_MARKERS):
+        return GENERATED
+    return TEXT
+
+
+def classify_file(path):
+    """
+    Classify a single file, opening it at most once.
+
+    Returns:
+        str: One of TEXT, BINARY, TOO_LARGE, MINIFIED or GENERATED.
+    """
+    verdict, _, _ = inspect_file(path, os.path.getsize(path))
+    return verdict
+
+
+def inspect_file(path, size):
+    """
+    Classify a file, hash its bytes and fingerprint its text in the same pass.
+
+    Returns:
+        tuple: The verdict, the sha256 hex digest and the SimHash fingerprint, both None for files that
+            are not text. The fingerprint is also None for text too short to fingerprint.
+    """
+    verdict = classify_by_name(path, size)
+    if verdict is not None:
+        return verdict, None, None
+
+    file_hash = hashlib.sha256()
+    with open(path, "rb") as f:
+        sample = f.read(SNIFF_SIZE)
+        verdict = classify_sample(path, sample)
+        if verdict != TEXT:
+            return verdict, None, None
+        # text files are at most MAX_TEXT_FILE_SIZE, they fit in memory for the fingerprint
+        blocks = [sample]
+        for block in iter(lambda: f.read(READ_BLOCK_SIZE), b""):
+            blocks.append(block)
+    content = b"".join(blocks)
+    file_hash.update(content)
+    return verdict, file_hash.hexdigest(), compute_simhash(content.decode("utf-8", errors="ignore"))
+
+
+def connect_manifest_db(store_dir):
+    conn = sqlite3.connect(f"{store_dir}/manifest.db")
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS files (
+        file TEXT PRIMARY KEY,
+        size INTEGER NOT NULL,
+        mtime_ns INTEGER NOT NULL,
+        hash TEXT,
+        simhash INTEGER,
+        verdict TEXT NOT NULL,
+        last_seen REAL NOT NULL
+    )
+    """)
+    if conn.execute("PRAGMA user_version").fetchone()[0] < MANIFEST_VERSION:
+        # manifests of older versions lack the fingerprints and the generated verdict
+        if conn.execute("SELECT 1 FROM pragma_table_info('files') WHERE name = 'simhash'").fetchone() is None:
+            conn.execute("ALTER TABLE files ADD COLUMN simhash INTEGER")
+        conn.execute("DELETE FROM files")
+        conn.execute(f"PRAGMA user_version = {MANIFEST_VERSION}")
+    conn.commit()
+    return conn
+
+
+def _flush_manifest(conn, records):
+    conn.executemany(
+        """
+        INSERT INTO files (file, size, mtime_ns, hash, simhash, verdict, last_seen) VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(file) DO UPDATE SET size = excluded.size, mtime_ns = excluded.mtime_ns, hash = excluded.hash,
+            simhash = excluded.simhash, verdict = excluded.verdict, last_seen = excluded.last_seen
+        """,
+        records
+    )
+    conn.commit()
+
+
+def _connect_manifest_readonly(store_dir):
+    path = f"{store_dir}/manifest.db"
+    if not os.path.isfile(path):
+        return None
+    return sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+
+
+def iter_manifest(store_dir, directory, paths, prune=True, readonly=False):
+    """
+    Classify, hash and fingerprint the given files, reusing the verdicts cached in the project's manifest.db.
+
+    Files whose size and modification time did not change since the last run are not opened at all.
+    When ``paths`` is exhausted, files that were not seen anymore are dropped from the manifest, unless
+    ``prune`` is False because only some files of the directory are given. With ``readonly`` the
+    manifest is only read, e.g. to compare the index with the directory, and never written or pruned.
+
+    Args:
+        store_dir (str): The project's store directory.
+        directory (str): The repository root the paths are relative to.
+        paths (iterable): Relative paths of the files to classify.
+
+    Yields:
+        dict: A record with "file", "size", "hash", "simhash" and "verdict".
+    """
+    conn = _connect_manifest_readonly(store_dir) if readonly else connect_manifest_db(store_dir)
+    run_started = time.time()
+    pending = []
+    try:
+        for relative_path in paths:
+            full_path = os.path.join(directory, relative_path)
+            try:
+                stat = os.stat(full_path)
+            except OSError:
+                continue
+
+            cached = None if conn is None else conn.execute(
+                "SELECT hash, simhash, verdict FROM files WHERE file = ? AND size = ? AND mtime_ns = ?",
+                (relative_path, stat.st_size, stat.st_mtime_ns)
+            ).fetchone()
+            if cached is not None:
+                file_hash, simhash, verdict = cached
+            else:
+                try:
+                    verdict, file_hash, simhash = inspect_file(full_path, stat.st_size)
+                except OSError as e:
+                    print(f"An error occurred while reading the file {relative_path}: {e}")
+                    continue
+
+            if not readonly:
+                pending.append((relative_path, stat.st_size, stat.st_mtime_ns, file_hash, simhash, verdict,
+                                run_started))
+            if len(pending) >= MANIFEST_FLUSH_SIZE:
+                _flush_manifest(conn, pending)
+                pending = []
+
+            yield {"file": relative_path, "size": stat.st_size, "hash": file_hash, "simhash": simhash,
+                   "verdict": verdict}
+
+        if readonly:
+            return
+        _flush_manifest(conn, pending)
+        if prune:
+            conn.execute("DELETE FROM files WHERE last_seen < ?", (run_started,))
+            conn.commit()
+    finally:
+        if conn is not None:
+            conn.close()
+
+
+def remove_from_manifest(store_dir, files):
+    conn = connect_manifest_db(store_dir)
+    with conn:
+        conn.executemany("DELETE FROM files WHERE file = ?", [(file,) for file in files])
+    conn.close()
@@ -0,0 +1,210 @@
+import math
+import sqlite3
+
+from storage import get_read_connection, iter_batches, select_by_files
+from utils import get_store_dir_from_repository
+
+DEFAULT_HOPS = 2
+DEFAULT_DECAY = 0.5
+DEFAULT_MAX_NEIGHBOURS = 20
+
+PAGERANK_DAMPING = 0.85
+PAGERANK_ITERATIONS = 50
+PAGERANK_TOLERANCE = 1e-8
+
+
+def _connect(repo_dir):
+    store_dir = get_store_dir_from_repository(repo_dir)
+    return sqlite3.connect(f"{store_dir}/call_analysis.db")
+
+
+def _load_edges(cursor):
+    # calls and called_by are both stored, so every edge exists twice in file_relations
+    cursor.execute('SELECT DISTINCT caller_id, called_id FROM file_relations WHERE caller_id != called_id;')
+    return cursor.fetchall()
+
+
+def _pagerank(node_ids, edges):
+    out_links = {node_id: [] for node_id in node_ids}
+    for caller_id, called_id in edges:
+        out_links[caller_id].append(called_id)
+
+    n = len(node_ids)
+    if n == 0:
+        return {}
+    rank = {node_id: 1.0 / n for node_id in node_ids}
+    for _ in range(PAGERANK_ITERATIONS):
+        # rank of dangling nodes is spread evenly over the whole graph
+        dangling = sum(rank[node_id] for node_id, targets in out_links.items() if not targets)
+        base = (1.0 - PAGERANK_DAMPING) / n + PAGERANK_DAMPING * dangling / n
+        new_rank = {node_id: base for node_id in node_ids}
+        for node_id, targets in out_links.items():
+            if not targets:
+                continue
+            share = PAGERANK_DAMPING * rank[node_id] / len(targets)
+            for target in targets:
+                new_rank[target] += share
+        delta = sum(abs(new_rank[node_id] - rank[node_id]) for node_id in node_ids)
+        rank = new_rank
+        if delta < PAGERANK_TOLERANCE:
+            break
+    return rank
+
+
+def compute_file_centrality(repo_dir):
+    """
+    Precompute degree and PageRank for every file of the import graph and store them next to it.
+
+    Args:
+        repo_dir (str): Path to the analysed repository.
+
+    Returns:
+        int: The number of files the centrality was computed for.
+    """
+    conn = _connect(repo_dir)
+    cursor = conn.cursor()
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS file_centrality (
+        file_id INTEGER PRIMARY KEY,
+        degree INTEGER NOT NULL,
+        pagerank REAL NOT NULL,
+        FOREIGN KEY (file_id) REFERENCES files(id) ON DELETE CASCADE
+    );
+    ''')
+
+    cursor.execute('SELECT id FROM files;')
+    node_ids = [row[0] for row in cursor.fetchall()]
+    edges = _load_edges(cursor)
+
+    degree = {node_id: 0 for node_id in node_ids}
+    for caller_id, called_id in edges:
+        degree[caller_id] += 1
+        degree[called_id] += 1
+    rank = _pagerank(node_ids, edges)
+
+    cursor.execute('DELETE FROM file_centrality;')
+    cursor.executemany(
+        'INSERT INTO file_centrality (file_id, degree, pagerank) VALUES (?, ?, ?);',
+        [(node_id, degree[node_id], rank[node_id]) for node_id in node_ids]
+    )
+    conn.commit()
+    conn.close()
+
+    return len(node_ids)
+
+
+def load_file_centrality(repo_dir, files=None):
+    """
+    Load the precomputed centrality of the given files (or all files).
+
+    Returns:
+        dict: Mapping of file name to a dict with "degree" and "pagerank".
+    """
+    connection = _get_centrality_connection(repo_dir)
+
+    query = '''
+        SELECT f.file_name, c.degree, c.pagerank FROM file_centrality c
+        JOIN files f ON f.id = c.file_id
+        '''
+    if files is None:
+        rows = connection.execute(query)
+    else:
+        rows = select_by_files(connection, query + 'WHERE f.file_name IN ({files})', files)
+
+    return {file_name: {"degree": degree, "pagerank": pagerank} for file_name, degree, pagerank in rows}
+
+
+def _get_centrality_connection(repo_dir):
+    db_path = f"{get_store_dir_from_repository(repo_dir)}/call_analysis.db"
+    connection = get_read_connection(db_path)
+    if connection is None or not _has_centrality(connection):
+        compute_file_centrality(repo_dir)
+        connection = get_read_connection(db_path)
+    return connection
+
+
+def _has_centrality(connection):
+    if not connection.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='file_centrality';"):
+        return False
+    return bool(connection.execute('SELECT 1 FROM file_centrality LIMIT 1;'))
+
+
+def _hub_weight(degree):
+    return 1.0 / math.log2(2 + degree)
+
+
+def expand_adjacent_files(repo_dir, seed_files, hops=DEFAULT_HOPS, decay=DEFAULT_DECAY,
+                          max_neighbours=DEFAULT_MAX_NEIGHBOURS):
+    """
+    Expand the seed files along the import graph with a bounded, score-decayed k-hop traversal.
+
+    Every seed starts with a score of 1. Each hop multiplies the score by ``decay`` and damps it by the
+    degree of both ends of the edge, so index modules and other hubs neither spread nor collect much score.
+
+    Args:
+        repo_dir (str): Path to the analysed repository.
+        seed_files (iterable): Files found by the similarity search.
+        hops (int): Maximum distance from a seed file.
+        decay (float): Score factor applied per hop.
+        max_neighbours (int): Maximum number of neighbours returned.
+
+    Returns:
+        list: Tuples of (file, score) for neighbours not in the seeds, best first.
+    """
+    seed_files = set(seed_files)
+    if not seed_files or hops < 1 or max_neighbours < 1:
+        return []
+
+    connection = _get_centrality_connection(repo_dir)
+
+    def fetch_nodes(column, values):
+        return select_by_files(connection, f'''
+            SELECT f.id, f.file_name, c.degree, c.pagerank FROM files f
+            JOIN file_centrality c ON c.file_id = f.id
+            WHERE f.{column} IN ({{files}})
+            ''', values)
+
+    nodes = {}
+    for file_id, file_name, degree, pagerank in fetch_nodes('file_name', seed_files):
+        nodes[file_id] = (file_name, degree, pagerank)
+
+    scores = {file_id: 1.0 for file_id in nodes}
+    frontier = dict(scores)
+    for _ in range(hops):
+        if not frontier:
+            break
+        propagated = {}
+        for batch in iter_batches(list(frontier)):
+            placeholders = ",".join("?" * len(batch))
+            rows = connection.execute(f'''
+                SELECT DISTINCT caller_id, called_id FROM file_relations
+                WHERE caller_id IN ({placeholders}) OR called_id IN ({placeholders})
+                ''', batch + batch)
+            for caller_id, called_id in rows:
+                for source, target in ((caller_id, called_id), (called_id, caller_id)):
+                    if source not in frontier or target == source:
+                        continue
+                    score = frontier[source] * decay * _hub_weight(nodes[source][1])
+                    propagated[target] = max(propagated.get(target, 0.0), score)
+
+        unknown = [file_id for file_id in propagated if file_id not in nodes]
+        for file_id, file_name, degree, pagerank in fetch_nodes('id', unknown):
+            nodes[file_id] = (file_name, degree, pagerank)
+
+        frontier = {}
+        for file_id, score in propagated.items():
+            if file_id not in nodes:
+                continue
+            score *= _hub_weight(nodes[file_id][1])
+            if score > scores.get(file_id, 0.0):
+                scores[file_id] = score
+                frontier[file_id] = score
+
+    neighbours = [
+        (nodes[file_id][0], score, nodes[file_id][2])
+        for file_id, score in scores.items()
+        if nodes[file_id][0] not in seed_files
+    ]
+    neighbours.sort(key=lambda neighbour: (neighbour[1], neighbour[2]), reverse=True)
+    return [(file_name, score) for file_name, score, _ in neighbours[:max_neighbours]]
@@ -0,0 +1,183 @@
+import json
+import os
+import sqlite3
+
+from storage import iter_batches
+from utils import get_store_dir_from_repository, create_call_analysis_tables, to_pipeline_path
+
+GRAPH_FORMATS = ("vite", "madge", "pydeps")
+READ_SIZE = 1 << 16
+RELATION_FLUSH_SIZE = 10000
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = " \t\n\r"
+
+
+def iter_json_object_items(f):
+    """
+    Stream the members of the top-level JSON object of a file as (key, value) pairs.
+
+    Only the member being decoded is held in memory, so graphs much larger than the memory
+    of the process can be read. The values are decoded with the standard json decoder.
+    """
+    buffer = ""
+    position = 0
+    eof = False
+
+    def skip(chars):
+        # skips whitespace and the given separators, reading more input when the buffer is exhausted
+        nonlocal buffer, position, eof
+        while True:
+            while position < len(buffer) and buffer[position] in _WHITESPACE + chars:
+                position += 1
+            if position < len(buffer) or eof:
+                return
+            buffer, position = f.read(READ_SIZE), 0
+            eof = buffer == ""
+
+    def decode():
+        nonlocal buffer, position, eof
+        while True:
+            try:
+                value, end = _decoder.raw_decode(buffer, position)
+                # a number at the end of the buffer may continue in the next read
+                if end < len(buffer) or eof:
+                    position = end
+                    return value
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            more = f.read(READ_SIZE)
+            eof = more == ""
+            buffer, position = buffer[position:] + more, 0
+
+    skip("")
+    if buffer[position:position + 1] != "{":
+        raise ValueError("Expected a JSON object at the top level of the import graph")
+    position += 1
+    while True:
+        skip(",")
+        if buffer[position:position + 1] == "}":
+            return
+        key = decode()
+        skip(":")
+        yield key, decode()
+
+
+def iter_vite_edges(items):
+    # vite-plugin-import-graph and madge --json: {"importer": ["imported", ...]}
+    for importer, imported_files in items:
+        for imported in imported_files:
+            yield importer, imported
+
+
+def iter_pydeps_edges(items):
+    # pydeps --show-deps: {"module": {"path": "/abs/module.py", "imports": ["module", ...]}}
+    # imports are module names, so the paths of all modules are needed before they can be resolved
+    module_paths = {}
+    module_imports = []
+    for name, module in items:
+        if module.get("path"):
+            module_paths[name] = module["path"]
+            module_imports.append((module["path"], module.get("imports", [])))
+    for path, imports in module_imports:
+        for name in imports:
+            if name in module_paths:
+                yield path, module_paths[name]
+
+
+EDGE_READERS = {
+    "vite": iter_vite_edges,
+    "madge": iter_vite_edges,
+    "pydeps": iter_pydeps_edges,
+}
+
+
+def to_repository_path(directory, path, path_prefix=None):
+    """
+    Normalise a path of an import graph to a path relative to the repository.
+
+    Args:
+        directory (str): The repository root.
+        path (str): Absolute path, or path relative to the repository root.
+        path_prefix (str): The root the graph was generated in, if it was generated on another machine.
+
+    Returns:
+        str: The relative path in the form of the rest of the pipeline, e.g. ./main.py and src/app.py, or
+            None for paths that are not files of the repository, like packages.
+    """
+    if path_prefix and path.startswith(path_prefix):
+        path = path[len(path_prefix):].lstrip("/")
+    if os.path.isabs(path):
+        path = os.path.relpath(path, directory)
+    path = os.path.normpath(path)
+    if path.startswith(os.pardir) or not os.path.isfile(os.path.join(directory, path)):
+        return None
+    return to_pipeline_path(path)
+
+
+def _flush_relations(cursor, relations):
+    file_names = list({file_name for relation in relations for file_name in relation})
+    cursor.executemany('INSERT OR IGNORE INTO files (file_name) VALUES (?);', [(name,) for name in file_names])
+    file_ids = {}
+    for batch in iter_batches(file_names):
+        cursor.execute(f'SELECT file_name, id FROM files WHERE file_name IN ({",".join("?" * len(batch))});', batch)
+        file_ids.update(cursor.fetchall())
+    cursor.executemany('INSERT INTO file_relations (caller_id, called_id) VALUES (?, ?);',
+                       [(file_ids[caller], file_ids[called]) for caller, called in relations])
+
+
+def import_graph_files(directory, graph_files, graph_format="vite", path_prefix=None):
+    """
+    Load import graphs computed by other tools into call_analysis.db, replacing the stored relations.
+
+    Several graphs, e.g. of the sub projects of a monorepo, are merged. Imports of files outside of the
+    repository are dropped.
+
+    Args:
+        directory (str): The repository root.
+        graph_files (list): Paths of the JSON graphs.
+        graph_format (str): One of GRAPH_FORMATS.
+        path_prefix (str): The root the graphs were generated in, defaults to the repository root.
+
+    Returns:
+        int: The number of imported relations.
+    """
+    if graph_format not in EDGE_READERS:
+        raise ValueError(f"Unknown import graph format '{graph_format}', choose from {', '.join(GRAPH_FORMATS)}")
+
+    store_dir = get_store_dir_from_repository(directory)
+    conn = sqlite3.connect(f"{store_dir}/call_analysis.db")
+    cursor = conn.cursor()
+    create_call_analysis_tables(cursor)
+    cursor.execute('DELETE FROM file_relations;')
+
+    # the same files appear in many relations, each path is checked once
+    repository_paths = {}
+
+    def normalise(path):
+        if path not in repository_paths:
+            repository_paths[path] = to_repository_path(directory, path, path_prefix)
+        return repository_paths[path]
+
+    seen = set()
+    relations = []
+    imported = 0
+    for graph_file in graph_files:
+        with open(graph_file, "r") as f:
+            for caller, called in EDGE_READERS[graph_format](iter_json_object_items(f)):
+                caller, called = normalise(caller), normalise(called)
+                if caller is None or called is None or (caller, called) in seen:
+                    continue
+                seen.add((caller, called))
+                relations.append((caller, called))
+                if len(relations) >= RELATION_FLUSH_SIZE:
+                    _flush_relations(cursor, relations)
+                    imported += len(relations)
+                    relations = []
+    _flush_relations(cursor, relations)
+    imported += len(relations)
+
+    conn.commit()
+    conn.close()
+    return imported
@@ -0,0 +1,256 @@
+import os
+import statistics
+import time
+
+from graph_expansion import load_file_centrality, expand_adjacent_files
+from quantized_index import load_quantized_index, get_quantized_index_path, get_store_version, clear_loaded_indexes
+from storage import get_read_connection, get_cached_summaries, invalidate_cached_summaries, close_read_connections
+from utils import get_store_dir_from_repository, iter_initial_files, load_summary_hashes, load_last_build, \
+    read_file_content, get_content_hash, get_embedding_tokens, set_embedding_tokens, VECTOR_STORES
+
+# rows counted per database, tables that do not exist are left out
+STORE_TABLES = {
+    "call_analysis.db": ("files", "file_relations", "symbols", "symbol_relations", "file_centrality"),
+    "summaries.db": ("files", "summaries", "summary_errors", "duplicates", "directory_summaries", "builds"),
+    "manifest.db": ("files",),
+    "query_cache.db": ("query_cache",),
+    "query_log.db": ("stage_decisions",),
+}
+# files listed per kind of drift, the counts are always complete
+DRIFT_EXAMPLES = 5
+BENCHMARK_REPEATS = 5
+# files the summary lookup and the graph expansion of the benchmark start from
+BENCHMARK_SAMPLE_FILES = 20
+BENCHMARK_QUERY = "Where is the configuration loaded and validated?"
+
+
+def count_store_rows(store_dir):
+    """
+    Returns:
+        dict: Mapping of database to the number of rows of each of its tables.
+    """
+    counts = {}
+    for database, tables in STORE_TABLES.items():
+        connection = get_read_connection(f"{store_dir}/{database}")
+        if connection is None:
+            continue
+        existing = {name for name, in connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        counts[database] = {table: connection.execute(f"SELECT COUNT(*) FROM {table}")[0][0]
+                            for table in tables if table in existing}
+    return counts
+
+
+def get_disk_sizes(store_dir):
+    """
+    Returns:
+        dict: The size in bytes of every database, vector store and index file of the store, largest first.
+    """
+    sizes = {}
+    for name in os.listdir(store_dir):
+        path = os.path.join(store_dir, name)
+        if os.path.isdir(path):
+            sizes[name] = sum(os.path.getsize(os.path.join(root, file))
+                              for root, _, files in os.walk(path) for file in files
+                              if not os.path.islink(os.path.join(root, file)))
+        else:
+            sizes[name] = os.path.getsize(path)
+    return dict(sorted(sizes.items(), key=lambda item: item[1], reverse=True))
+
+
+def get_vector_store_stats(directory, store_name, metadata_key="file"):
+    """
+    Args:
+        metadata_key (str): The metadata naming the source of a document, "directory" for the directory store.
+
+    Returns:
+        dict: The number of documents, their dimension, the sources they belong to and the quantized
+            index of the store, or None if the store does not exist.
+    """
+    from langchain_chroma import Chroma
+
+    from backends import get_embeddings
+
+    persist_directory = f"{get_store_dir_from_repository(directory)}/{store_name}"
+    if not os.path.isdir(persist_directory):
+        return None
+    vector_store = Chroma(embedding_function=get_embeddings(), persist_directory=persist_directory)
+    sample = vector_store.get(limit=1, include=["embeddings"])
+    metadatas = vector_store.get(include=["metadatas"])["metadatas"]
+    stats = {"documents": len(metadatas),
+             "dimensions": len(sample["embeddings"][0]) if len(sample["ids"]) else None,
+             "sources": {metadata[metadata_key] for metadata in metadatas}}
+    index = load_quantized_index(directory, store_name)
+    if index is not None:
+        stats["quantized"] = {"quantization": str(index["quantization"]), "documents": len(index["ids"]),
+                              "bytes": os.path.getsize(get_quantized_index_path(directory, store_name)),
+                              "up_to_date": str(index.get("version")) == get_store_version(directory, store_name)}
+    return stats
+
+
+def find_index_drift(directory, project, vector_stats):
+    """
+    Compare the stores with the files currently in the project directory.
+
+    Returns:
+        dict: Files per kind of drift: "unsummarised" text files other than empty ones, which have no
+            summaries, "stale" summaries of files that changed, "orphaned_summaries" and "orphaned_graph"
+            entries of files that are gone or excluded, and "orphaned_vectors" per vector store, of files
+            without summaries.
+    """
+    store_dir = get_store_dir_from_repository(directory)
+    # the stats leave the manifest of the next init as it is
+    current = {os.path.normpath(file["file"]): file for file in
+               iter_initial_files(directory, project.get("include"), project.get("exclude"), readonly=True)}
+    summarised = {os.path.normpath(file): content_hash for file, content_hash in load_summary_hashes(directory).items()}
+
+    linked = set()
+    connection = get_read_connection(f"{store_dir}/summaries.db")
+    if connection is not None:
+        linked = {os.path.normpath(file) for file, in connection.execute("SELECT file FROM duplicates")}
+
+    stale = []
+    for file, content_hash in summarised.items():
+        record = current.get(file)
+        # the manifest hashes the bytes, the summaries the decoded text, they only differ e.g. for CRLF files
+        if record is not None and record["hash"] != content_hash and \
+                get_content_hash(read_file_content(directory, record["file"])) != content_hash:
+            stale.append(file)
+
+    graph_files = []
+    connection = get_read_connection(f"{store_dir}/call_analysis.db")
+    if connection is not None:
+        graph_files = [file for file, in connection.execute("SELECT file_name FROM files")]
+
+    drift = {
+        "unsummarised": sorted(file for file in set(current) - set(summarised) - linked if current[file]["size"]),
+        "stale": sorted(stale),
+        "orphaned_summaries": sorted(set(summarised) - set(current)),
+        "orphaned_graph": sorted(file for file in graph_files if not os.path.isfile(os.path.join(directory, file))),
+    }
+    for store_name, stats in vector_stats.items():
+        if stats is not None:
+            drift[f"orphaned_vectors_{store_name}"] = sorted(
+                {os.path.normpath(file) for file in stats["sources"]} - set(summarised))
+    return drift
+
+
+def _time_call(function, repeats):
+    durations = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def benchmark_index(directory, repeats=BENCHMARK_REPEATS):
+    """
+    Time the lookups of a query on the local stores, cold and warm.
+
+    Cold timings start without pooled connections, cached summaries and loaded quantized indexes, as
+    the first query of a process does; warm timings repeat the lookup with everything cached. The
+    query is embedded once up front, so the vector search timings leave out the embedding backend.
+    The vector searches are left out while the vector stores do not exist, they would create them.
+
+    Returns:
+        dict: Mapping of lookup to its "cold" duration and the "warm" median and maximum, in seconds.
+    """
+    from backends import get_embeddings, get_embedding_token_counter
+    from query_requirement import search_similar_files
+
+    store_dir = get_store_dir_from_repository(directory)
+    files = [file for file, _ in sorted(load_summary_hashes(directory).items())][:BENCHMARK_SAMPLE_FILES]
+
+    def reset():
+        close_read_connections()
+        invalidate_cached_summaries(store_dir)
+        clear_loaded_indexes()
+
+    lookups = {
+        "graph_load": lambda: load_file_centrality(directory),
+        "graph_expansion": lambda: expand_adjacent_files(directory, files),
+        "summary_lookup": lambda: get_cached_summaries(store_dir, files),
+    }
+    if all(os.path.isdir(f"{store_dir}/{store_name}") for store_name in VECTOR_STORES):
+        embedding = get_embeddings().embed_query(BENCHMARK_QUERY)
+        set_embedding_tokens(get_embedding_tokens() + get_embedding_token_counter()(BENCHMARK_QUERY))
+        lookups["vector_search"] = lambda: search_similar_files(BENCHMARK_QUERY, directory, embedding=embedding)
+        lookups["vector_search_exact"] = lambda: search_similar_files(BENCHMARK_QUERY, directory, exact=True,
+                                                                      embedding=embedding)
+    results = {}
+    for name, lookup in lookups.items():
+        reset()
+        cold = _time_call(lookup, 1)[0]
+        warm = _time_call(lookup, repeats)
+        results[name] = {"cold": cold, "warm_median": statistics.median(warm), "warm_max": max(warm)}
+    return results
+
+
+def print_drift(drift):
+    for kind, files in drift.items():
+        examples = ", ".join(files[:DRIFT_EXAMPLES]) + (", ..." if len(files) > DRIFT_EXAMPLES else "")
+        print(f"  {kind}: {len(files)}" + (f" ({examples})" if files else ""))
+
+
+def query_stats(directory, args, project=None):
+    """
+    Print the health of the project's index: sizes, row and document counts, drift against the files
+    in the directory and the cost of the last build, and with ``args.benchmark`` the lookup latencies.
+    """
+    store_dir = get_store_dir_from_repository(directory)
+
+    print("Disk size:")
+    sizes = get_disk_sizes(store_dir)
+    print(f"  total: {sum(sizes.values()) / 1024 / 1024:.2f} MB")
+    for name, size in sizes.items():
+        print(f"  {name}: {size / 1024 / 1024:.2f} MB")
+
+    print("Rows:")
+    rows = count_store_rows(store_dir)
+    for database, counts in rows.items():
+        print(f"  {database}: " + ", ".join(f"{table} {count}" for table, count in counts.items()))
+
+    print("Vector stores:")
+    vector_stats = {store_name: get_vector_store_stats(directory, store_name) for store_name in VECTOR_STORES}
+    vector_stats["directory_store"] = get_vector_store_stats(directory, "directory_store", "directory")
+    for store_name, stats in vector_stats.items():
+        if stats is None:
+            print(f"  {store_name}: missing")
+            continue
+        sources = "directories" if store_name == "directory_store" else "files"
+        print(f"  {store_name}: {stats['documents']} documents of {len(stats['sources'])} {sources}, "
+              f"{stats['dimensions']} dimensions")
+        # one document per summary chunk, per file and per directory
+        expected = rows.get("summaries.db", {}).get({"summary_store": "summaries", "contents_store": "files",
+                                                     "directory_store": "directory_summaries"}[store_name])
+        if expected is not None and stats["documents"] > expected:
+            print(f"    {stats['documents'] - expected} documents more than stored in summaries.db, "
+                  f"vectorized more than once?")
+        quantized = stats.get("quantized")
+        if quantized is not None:
+            state = "up to date" if quantized["up_to_date"] else "outdated"
+            print(f"    {quantized['quantization']} index: {quantized['documents']} documents, "
+                  f"{quantized['bytes'] / 1024 / 1024:.2f} MB, {state}")
+
+    print("Drift against the project directory:")
+    # the directory store holds directories, not files
+    vector_stats.pop("directory_store")
+    print_drift(find_index_drift(directory, project or {}, vector_stats))
+
+    build = load_last_build(directory)
+    if build is None:
+        print("Last build: none recorded")
+    else:
+        print(f"Last build: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(build['started']))}, "
+              f"{' '.join(build['stages']) or 'no stages'}, {build['duration']:.1f} seconds, "
+              f"{build['input_tokens']} input, {build['output_tokens']} output and "
+              f"{build['embedding_tokens']} embedding tokens")
+
+    if getattr(args, "benchmark", False):
+        print(f"Benchmark, {BENCHMARK_REPEATS} warm runs:")
+        timings_per_lookup = benchmark_index(directory)
+        for name, timings in timings_per_lookup.items():
+            print(f"  {name}: cold {timings['cold'] * 1000:.2f} ms, warm median "
+                  f"{timings['warm_median'] * 1000:.2f} ms, max {timings['warm_max'] * 1000:.2f} ms")
+        if "vector_search" not in timings_per_lookup:
+            print("  vector_search: skipped, the vector stores were never vectorized")
@@ -1,62 +1,199 @@
 import argparse
 import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextvars import copy_context
 
-from memory_profiler import memory_usage
+# Only cheap modules are imported at the top. The analyzers, the pipeline stages and with them
+# the LLM and vector store SDKs are imported by the command that needs them.
+from backends import configure_backends, parse_backend_option, use_project_backends
+from directory_summaries import DEFAULT_TOP_DIRECTORIES
+from graph_expansion import DEFAULT_HOPS, DEFAULT_MAX_NEIGHBOURS
+from graph_import import GRAPH_FORMATS
+from metrics import print_metrics
+from profiling import configure_profiling, write_profile_summary
+from project_registry import DEFAULT_CONFIG_PATH, load_project_registry, load_analyzer
+from quantized_index import QUANTIZATIONS
+from query_cache import DEFAULT_CACHE_THRESHOLD
+from utils import print_runtime, get_input_tokens, get_output_tokens, get_embedding_tokens, use_project_store
 
-from analyzer_js import analyze_directory as analyze_js_directory
-from analyzer_py import analyze_directory as analyze_py_directory
-from query_requirement import query_project, query_stats
-from setup_repository import init_project
-from utils import print_runtime, get_input_tokens, get_output_tokens, get_embedding_tokens
 
-
-@print_runtime
 def main():
-    projects = {
-        "crawlee_python_master": ("/Users/lucas/Downloads/crawlee-python-master", analyze_py_directory),
-        "jitsi_analytics": ("/Users/lucas/Downloads/jitsi-meet-master/react/features/analytics", analyze_js_directory),
-        "jitsi_media": ("/Users/lucas/Downloads/jitsi-meet-master/react/features/base/media/components", analyze_js_directory),
-        "jitsi": ("/Users/lucas/Downloads/jitsi-meet-master", analyze_js_directory),
-        "jitsi_react": ("/Users/lucas/Downloads/jitsi-meet-master/react", analyze_js_directory),
-        "newsscraper": ("../../NewsPolitics/newsscraper", analyze_py_directory),
-        "cula": ("data/cula", None),
-    }
-    
-    parser = argparse.ArgumentParser()
-    parser.add_argument("project", help="The project to analyze", choices=projects.keys())
+    config_parser = argparse.ArgumentParser(add_help=False)
+    config_parser.add_argument("--config", default=DEFAULT_CONFIG_PATH, help="TOML file with the projects")
+    config_args, _ = config_parser.parse_known_args()
+    registry = load_project_registry(config_args.config)
+    projects = registry["projects"]
+
+    parser = argparse.ArgumentParser(parents=[config_parser])
+    parser.add_argument("project", nargs="?", help="The project to analyze", choices=projects.keys())
+    parser.add_argument("--profile-memory", action="store_true", help="Report the maximum memory usage of the run")
+    parser.add_argument("--profile", action="store_true",
+                        help="Time and profile every pipeline stage, the profiles are written to a directory per run")
+    parser.add_argument("--profile-sampler", action="store_true",
+                        help="Profile with a sampling profiler that sees the worker threads, instead of cProfile")
+    parser.add_argument("--profile-allocations", action="store_true",
+                        help="Compare tracemalloc snapshots before and after every stage")
+    parser.add_argument("--profile-dir", help="Directory for the profiles of this run, default profiles/<time>")
+    parser.add_argument("--backend", action="append", default=[], metavar="STAGE=BACKEND[:MODEL]",
+                        help="Backend for a pipeline stage (summary, reformulate, missing, filter, relevant, final, "
+                             "embeddings, or all for every LLM stage), e.g. summary=ollama:llama3.1:8B or all=fake")
     subparsers = parser.add_subparsers(dest="command", required=True)
     
     init_parser = subparsers.add_parser("init", help="Initialize the project")
+    init_parser.add_argument("--all", action="store_true", help="Initialize all projects of the config concurrently")
     init_parser.add_argument("--analyse", action="store_true", help="Analyze the directory")
+    init_parser.add_argument("--import-graph", action="append", metavar="FILE",
+                             help="Import graph JSON to use for --analyse instead of the analyzer, can be repeated")
+    init_parser.add_argument("--graph-format", choices=GRAPH_FORMATS, help="Format of the import graphs")
+    init_parser.add_argument("--graph-path-prefix", help="Root directory the import graphs were generated in")
     init_parser.add_argument("--summarize", action="store_true", help="Summarize the contents")
+    init_parser.add_argument("--pack", action="store_true",
+                             help="Summarize small files together, with one prompt for many files")
+    init_parser.add_argument("--dedup", action="store_true",
+                             help="Summarize and vectorize exact and near-duplicate files only once")
+    init_parser.add_argument("--share", action="store_true",
+                             help="Reuse summaries and embeddings of identical files from other projects")
+    init_parser.add_argument("--resume", action="store_true",
+                             help="Only summarize files that are new, changed or failed in an earlier run")
     init_parser.add_argument("--vectorize-summaries", action="store_true", help="Vectorize the summaries")
     init_parser.add_argument("--vectorize-content", action="store_true", help="Vectorize the contents")
+    init_parser.add_argument("--quantize", choices=QUANTIZATIONS,
+                             help="Search int8 or binary copies of the vectors first, re-ranking with the full vectors")
     
+    watch_parser = subparsers.add_parser("watch", help="Keep the index up to date while the files change")
+    watch_parser.add_argument("--debounce", type=float,
+                              help="Seconds without changes before the changed files are indexed, default 1")
+    watch_parser.add_argument("--poll", action="store_true",
+                              help="Poll the modification times instead of using filesystem events")
+
+    export_parser = subparsers.add_parser("export", help="Pack the index of the project into one archive")
+    export_parser.add_argument("--output", help="Path of the archive, default <project>.index.tar.gz")
+
+    import_parser = subparsers.add_parser("import", help="Replace the index of the project with an exported archive")
+    import_parser.add_argument("archive", help="Path of the archive made by export")
+    import_parser.add_argument("--force", action="store_true",
+                               help="Import the archive even if it was embedded with another embedding backend")
+
     query_parser = subparsers.add_parser("retrieve", help="Query the database for similar files")
     query_group = query_parser.add_mutually_exclusive_group(required=True)
     query_group.add_argument("--query", help="The query string")
-    query_group.add_argument("--stats", action="store_true", help="Show the stats of the project")
+    query_group.add_argument("--stats", action="store_true",
+                             help="Show the sizes, counts, drift and last build cost of the project's index")
+    query_parser.add_argument("--benchmark", action="store_true",
+                              help="With --stats, time cold and warm graph, summary and vector lookups")
 
     query_options_group = query_parser.add_argument_group("Options for retrieval while querying")
     query_options_group.add_argument("--adjacent", action="store_true")
+    query_options_group.add_argument("--adjacent-hops", type=int, default=DEFAULT_HOPS,
+                                     help="Maximum import graph distance of adjacent files")
+    query_options_group.add_argument("--adjacent-limit", type=int, default=DEFAULT_MAX_NEIGHBOURS,
+                                     help="Maximum number of adjacent files added to the candidates")
+    query_options_group.add_argument("--subtrees", action="store_true",
+                                     help="Search only the files of the directories most relevant to the query")
+    query_options_group.add_argument("--subtree-limit", type=int, default=DEFAULT_TOP_DIRECTORIES,
+                                     help="Maximum number of directories searched with --subtrees")
+    query_options_group.add_argument("--symbols", action="store_true",
+                                     help="Add the code that references symbols matching the query")
+    query_options_group.add_argument("--adaptive", action="store_true",
+                                     help="Skip the LLM stages that are not needed when the similarity search is decisive")
+    query_options_group.add_argument("--cache", action="store_true",
+                                     help="Reuse the result of a nearly identical earlier requirement")
+    query_options_group.add_argument("--cache-threshold", type=float, default=DEFAULT_CACHE_THRESHOLD,
+                                     help="Minimum cosine similarity of the requirements for a cache hit")
+    query_options_group.add_argument("--cache-refresh-summary", action="store_true",
+                                     help="Generate the final summary again for cache hits")
     query_options_group.add_argument("--find-missing", action="store_true")
     query_options_group.add_argument("--filter-files", action="store_true")
 
     args = parser.parse_args()
-    
-    (directory, analyze_fn) = projects[args.project]
-    
-    # get abs path, in case of relative
-    directory = os.path.abspath(directory)    
+    if args.project is None and not (args.command == "init" and args.all):
+        parser.error("the project is required, unless all projects are initialized with init --all")
+
+    # the limits are shared by all projects, the backends are chosen per project in run_project
+    configure_backends({stage: {"concurrency": concurrency} for stage, concurrency in registry["limits"].items()})
+    args.backend = [parse_backend_option(option) for option in args.backend]
+    if args.profile and args.command == "init" and args.all and not args.profile_sampler:
+        # only one cProfile can be active per process, the projects of init --all run at the same time
+        print("Profiling the concurrent projects with the sampling profiler, as with --profile-sampler.")
+        args.profile_sampler = True
+    if args.profile or args.profile_sampler or args.profile_allocations:
+        configure_profiling(args.profile_dir, sampler=args.profile_sampler, allocations=args.profile_allocations)
+
+    if args.profile_memory:
+        from memory_profiler import memory_usage
+
+        mem_usage = memory_usage((run, (projects, args)), max_usage=True)
+        print(f"Maximum memory usage: {mem_usage:.2f} MB")
+    else:
+        run(projects, args)
+
+
+@print_runtime
+def run(projects, args):
+    if args.command == "init" and args.all:
+        # every project runs in its own context with its own backends, the stage limits are shared
+        with ThreadPoolExecutor(max_workers=len(projects) or 1) as executor:
+            futures = {executor.submit(copy_context().run, run_project, project, args): project_id
+                       for project_id, project in projects.items()}
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    print(f"Initializing {futures[future]} failed: {e}")
+    else:
+        run_project(projects[args.project], args)
+
+    COST_PER_INPUT_TOKEN = 0.00000015
+    COST_PER_OUTPUT_TOKEN = 0.0000006
+    print(f"Input tokens: {get_input_tokens()}")
+    print(f"Output tokens: {get_output_tokens()}")
+    print(f"Embedding tokens: {get_embedding_tokens()}")
+    print_metrics()
+    profile_summary = write_profile_summary()
+    if profile_summary is not None:
+        print(f"Profile written to {os.path.dirname(profile_summary)}")
+
+    # print(f"Total API Cost (USD): {get_input_tokens() * COST_PER_INPUT_TOKEN + get_output_tokens() * COST_PER_OUTPUT_TOKEN}")
+
+
+def run_project(project, args):
+    directory = project["path"]
+    use_project_store(directory, project["id"])
+    use_project_backends(project["backends"], *args.backend)
     if not os.path.isdir(directory):
-        print("Invalid directory path.")
+        print(f"Invalid directory path for {project['id']}.")
         return
     
     if args.command == "init":
-        init_project(directory, analyze_fn, args)
+        from setup_repository import init_project
+
+        init_project(directory, load_analyzer(project["analyzer"]), args, project)
+
+    if args.command == "watch":
+        from watch_project import watch_project
+
+        watch_project(directory, load_analyzer(project["analyzer"]), args, project)
         
+    if args.command == "export":
+        from snapshot import export_snapshot
+
+        output = args.output or f"{project['id']}.index.tar.gz"
+        print(f"Exporting index to {output}...")
+        file_count = export_snapshot(directory, output, project["id"])
+        print(f"Exporting index done, {file_count} files.")
+
+    if args.command == "import":
+        from snapshot import import_snapshot
+
+        print(f"Importing index from {args.archive}...")
+        snapshot = import_snapshot(directory, args.archive, force=args.force)
+        print(f"Importing index done, {len(snapshot['files'])} files of {snapshot['project']}.")
+        print("Run init --summarize --resume to summarise the files that changed since the export.")
+
     if args.command == "retrieve":
         if args.query:
+            from query_requirement import query_project
+
             # requirement = """
             # It would be handy to have the ability to select multiple items in the filter inputs for events. I have a camera that generates pretty constant events, so when I visit events it is pages of "bird bird bird bird" as my wife likes to see what her chickens were up to during the day. All other categories are interesting to me, but it's pages of scrolling to get to it unless I select a different label, but then I have to look at labels one at a time.
             # The ability to select all and then deselect one or more labels -- or simply select multiple labels individually -- would be a nice to have!
@@ -70,16 +207,10 @@ def main():
             
             query_project(directory, args)
         if args.stats:
-            query_stats(directory, args)
+            from index_stats import query_stats
 
-    COST_PER_INPUT_TOKEN = 0.00000015
-    COST_PER_OUTPUT_TOKEN = 0.0000006
-    print(f"Input tokens: {get_input_tokens()}")
-    print(f"Output tokens: {get_output_tokens()}")
-    print(f"Embedding tokens: {get_embedding_tokens()}")
+            query_stats(directory, args, project)
 
-    # print(f"Total API Cost (USD): {get_input_tokens() * COST_PER_INPUT_TOKEN + get_output_tokens() * COST_PER_OUTPUT_TOKEN}")
 
 if __name__ == "__main__":
-    mem_usage = memory_usage(main, max_usage=True)
-    print(f"Maximum memory usage: {mem_usage:.2f} MB")
+    main()
@@ -0,0 +1,41 @@
+import threading
+import time
+from contextlib import contextmanager
+
+_metrics = {}
+_metrics_lock = threading.Lock()
+
+
+def record_metric(name, value):
+    """
+    Record one measurement, e.g. a duration in seconds, under the given name.
+    """
+    with _metrics_lock:
+        _metrics.setdefault(name, []).append(value)
+
+
+def get_metrics():
+    """
+    Returns:
+        dict: Mapping of metric name to the list of recorded values, in recording order.
+    """
+    with _metrics_lock:
+        return {name: list(values) for name, values in _metrics.items()}
+
+
+@contextmanager
+def measure(name):
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_metric(name, time.perf_counter() - start_time)
+
+
+def print_metrics():
+    for name, values in get_metrics().items():
+        if len(values) == 1:
+            print(f"{name}: {values[0]:.3f}")
+        else:
+            print(f"{name}: {sum(values):.3f} total, {sum(values) / len(values):.3f} avg, {max(values):.3f} max "
+                  f"over {len(values)}")
@@ -0,0 +1,83 @@
+import hashlib
+import re
+
+SIMHASH_BITS = 64
+# files with fewer shingles are too short for a stable fingerprint, only exact copies are detected
+SIMHASH_MIN_SHINGLES = 20
+# the fingerprint uses the shingles with the smallest hashes, the same ones in near-identical files
+SIMHASH_MAX_SHINGLES = 2000
+SHINGLE_SIZE = 3
+# fingerprints differing in at most this many bits are near-duplicates
+SIMHASH_MAX_DISTANCE = 3
+# with at most 3 differing bits one of 4 bands of 16 bits is equal
+SIMHASH_BANDS = 4
+
+TOKEN_PATTERN = re.compile(r'\w+')
+
+
+def compute_simhash(text):
+    """
+    SimHash fingerprint of the token shingles of a text.
+
+    Returns:
+        int: The signed 64 bit fingerprint, as SQLite stores it, or None for texts that are too short.
+    """
+    tokens = TOKEN_PATTERN.findall(text.lower())
+    shingles = {" ".join(tokens[i:i + SHINGLE_SIZE]) for i in range(max(0, len(tokens) - SHINGLE_SIZE + 1))}
+    if len(shingles) < SIMHASH_MIN_SHINGLES:
+        return None
+    hashes = sorted(int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "little")
+                    for shingle in shingles)[:SIMHASH_MAX_SHINGLES]
+
+    fingerprint = 0
+    for bit in range(SIMHASH_BITS):
+        mask = 1 << bit
+        if 2 * sum(1 for value in hashes if value & mask) > len(hashes):
+            fingerprint |= mask
+    return fingerprint - (1 << SIMHASH_BITS) if fingerprint >= 1 << (SIMHASH_BITS - 1) else fingerprint
+
+
+def hamming_distance(a, b):
+    return bin((a ^ b) & ((1 << SIMHASH_BITS) - 1)).count("1")
+
+
+def _bands(simhash):
+    band_bits = SIMHASH_BITS // SIMHASH_BANDS
+    unsigned = simhash & ((1 << SIMHASH_BITS) - 1)
+    return [(band, (unsigned >> (band * band_bits)) & ((1 << band_bits) - 1)) for band in range(SIMHASH_BANDS)]
+
+
+def cluster_duplicates(files):
+    """
+    Cluster exact copies (same content hash) and near-duplicates (close SimHash fingerprints).
+
+    The first file of a cluster, in the given order, represents it.
+
+    Args:
+        files (list): File records with "file" and optionally "hash" and "simhash", most important first.
+
+    Returns:
+        dict: Mapping of every duplicate file to the file representing its cluster.
+    """
+    representatives_by_hash = {}
+    buckets = {}
+    duplicates = {}
+    for file in files:
+        if not file.get('hash'):
+            continue
+        representative = representatives_by_hash.get(file['hash'])
+        if representative is None and file.get('simhash') is not None:
+            candidates = {candidate for band in _bands(file['simhash']) for candidate in buckets.get(band, [])}
+            representative = min(
+                (candidate for candidate in candidates
+                 if hamming_distance(candidate[1], file['simhash']) <= SIMHASH_MAX_DISTANCE),
+                key=lambda candidate: candidate[2], default=(None,))[0]
+        if representative is not None:
+            duplicates[file['file']] = representative
+            continue
+
+        representatives_by_hash[file['hash']] = file['file']
+        if file.get('simhash') is not None:
+            for band in _bands(file['simhash']):
+                buckets.setdefault(band, []).append((file['file'], file['simhash'], len(representatives_by_hash)))
+    return duplicates
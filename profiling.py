@@ -0,0 +1,186 @@
+import cProfile
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+from metrics import get_metrics
+from utils import get_store_dir_from_repository
+
+PROFILE_ROOT = "profiles"
+SAMPLE_INTERVAL = 0.005
+# one frame per traced allocation suffices for the statistics per line, every further frame slows the run
+ALLOCATION_FRAMES = 1
+# lines of the allocation statistics written per stage
+ALLOCATION_TOP_LINES = 30
+
+_profile_config = None
+_profile_lock = threading.Lock()
+_stage_results = []
+_stage_sequence = itertools.count()
+# stages running in the current thread, a nested stage is only timed
+_thread_state = threading.local()
+# collapsed stack counts of the running stages, filled by the sampler thread
+_sampled_stages = []
+_sampler = None
+# Python 3.12 allows one active cProfile per process, stages running alongside the profiled one are only timed
+_cprofile_active = False
+
+
+def configure_profiling(run_directory=None, sampler=False, allocations=False):
+    """
+    Enable the profiling of the pipeline stages for this run.
+
+    Every stage wrapped with ``profile_stage`` is timed and either profiled with cProfile, which sees
+    the thread that runs the stage, or with a sampling profiler, which sees all threads including the
+    workers of the stage. cProfile profiles one stage at a time. Stages running alongside it are only
+    timed. With ``allocations``, tracemalloc compares the memory before and after each stage.
+
+    Args:
+        run_directory (str): Where the profiles are written, defaults to a new directory in PROFILE_ROOT.
+
+    Returns:
+        str: The run directory.
+    """
+    global _profile_config
+    run_directory = run_directory or os.path.join(PROFILE_ROOT, time.strftime("%Y%m%d-%H%M%S"))
+    os.makedirs(run_directory, exist_ok=True)
+    if allocations:
+        tracemalloc.start(ALLOCATION_FRAMES)
+    _profile_config = {"directory": run_directory, "sampler": sampler, "allocations": allocations,
+                       "started": time.time(), "command": sys.argv}
+    return run_directory
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _sample_stacks():
+    own_id = threading.get_ident()
+    while True:
+        time.sleep(SAMPLE_INTERVAL)
+        if not _sampled_stages:
+            continue
+        stacks = []
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_id:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame))
+                frame = frame.f_back
+            stacks.append(";".join(reversed(stack)))
+        with _profile_lock:
+            for counter in _sampled_stages:
+                for key in stacks:
+                    counter[key] = counter.get(key, 0) + 1
+
+
+def _start_sampler():
+    global _sampler
+    with _profile_lock:
+        if _sampler is None:
+            _sampler = threading.Thread(target=_sample_stacks, daemon=True)
+            _sampler.start()
+
+
+@contextmanager
+def profile_stage(directory, stage):
+    """
+    Time a pipeline stage and capture its profile, if profiling is enabled with ``configure_profiling``.
+    """
+    global _cprofile_active
+    if _profile_config is None:
+        yield
+        return
+
+    active = getattr(_thread_state, "stages", [])
+    _thread_state.stages = active + [stage]
+    nested = bool(active)
+    name = f"{next(_stage_sequence):03d}-{os.path.basename(get_store_dir_from_repository(directory))}-{stage}"
+    files = {}
+
+    profiler = samples = snapshot = None
+    if not nested and _profile_config["sampler"]:
+        samples = {}
+        with _profile_lock:
+            _sampled_stages.append(samples)
+        _start_sampler()
+    elif not nested:
+        with _profile_lock:
+            if not _cprofile_active:
+                _cprofile_active = True
+                profiler = cProfile.Profile()
+    if _profile_config["allocations"]:
+        snapshot = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+
+    wall_start, cpu_start, thread_cpu_start = time.perf_counter(), time.process_time(), time.thread_time()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            with _profile_lock:
+                _cprofile_active = False
+        result = {"stage": stage, "store": os.path.basename(get_store_dir_from_repository(directory)),
+                  "nested_in": active[-1] if nested else None,
+                  "wall_seconds": time.perf_counter() - wall_start,
+                  "cpu_seconds": time.process_time() - cpu_start,
+                  "thread_cpu_seconds": time.thread_time() - thread_cpu_start}
+        _thread_state.stages = active
+
+        if profiler is not None:
+            files["pstats"] = os.path.join(_profile_config["directory"], f"{name}.pstats")
+            profiler.dump_stats(files["pstats"])
+        if samples is not None:
+            with _profile_lock:
+                _sampled_stages.remove(samples)
+            # collapsed stacks, the input of flamegraph.pl and speedscope
+            files["collapsed"] = os.path.join(_profile_config["directory"], f"{name}.collapsed")
+            with open(files["collapsed"], "w") as f:
+                for stack, count in sorted(samples.items()):
+                    f.write(f"{stack} {count}\n")
+            result["samples"] = sum(samples.values())
+        if snapshot is not None:
+            result["peak_traced_bytes"] = tracemalloc.get_traced_memory()[1]
+            files["allocations"] = os.path.join(_profile_config["directory"], f"{name}.allocations.txt")
+            with open(files["allocations"], "w") as f:
+                # the profilers themselves allocate too
+                own_files = [tracemalloc.Filter(False, module.__file__) for module in (cProfile, tracemalloc)]
+                differences = tracemalloc.take_snapshot().filter_traces(own_files).compare_to(
+                    snapshot.filter_traces(own_files), "lineno")
+                for difference in differences[:ALLOCATION_TOP_LINES]:
+                    f.write(f"{difference}\n")
+        result["files"] = files
+        with _profile_lock:
+            _stage_results.append(result)
+
+
+def write_profile_summary():
+    """
+    Write summary.json with the timings of all profiled stages and the recorded metrics of the run.
+
+    Returns:
+        str: The path of the summary, or None if profiling is not enabled.
+    """
+    if _profile_config is None:
+        return None
+    metrics = {name: {"count": len(values), "total": sum(values), "avg": sum(values) / len(values),
+                      "max": max(values)} for name, values in get_metrics().items()}
+    summary = {"started": _profile_config["started"], "command": _profile_config["command"],
+               "wall_seconds": time.time() - _profile_config["started"],
+               "profiler": "sampler" if _profile_config["sampler"] else "cprofile",
+               "stages": list(_stage_results), "metrics": metrics}
+    path = os.path.join(_profile_config["directory"], "summary.json")
+    with open(path, "w") as f:
+        json.dump(summary, f, indent=2)
+    return path
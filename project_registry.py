@@ -0,0 +1,79 @@
+import os
+import tomllib
+
+from graph_import import GRAPH_FORMATS
+from quantized_index import QUANTIZATIONS
+
+DEFAULT_CONFIG_PATH = "projects.toml"
+
+ANALYZERS = ("js", "py")
+
+PROJECT_DEFAULTS = {
+    "analyzer": None,
+    "include": [],
+    "exclude": [],
+    "backends": {},
+    "concurrency": None,
+    "chunk_size": None,
+    "chunk_overlap": None,
+    "pack_small_files": False,
+    "deduplicate": False,
+    "share": False,
+    "quantize": None,
+    "import_graphs": [],
+    "graph_format": "vite",
+    "graph_path_prefix": None,
+}
+
+
+def load_project_registry(config_path=DEFAULT_CONFIG_PATH):
+    """
+    Load the projects and the shared limits from the TOML config file.
+
+    Every project is keyed by its id, which also names its store directory, so two checkouts with the
+    same directory name get separate stores.
+
+    Returns:
+        dict: "projects" maps project id to its settings (with absolute "path"), "limits" maps
+            pipeline stage to the concurrency shared by all projects.
+    """
+    with open(config_path, "rb") as f:
+        config = tomllib.load(f)
+
+    projects = {}
+    for project_id, project in config.get("projects", {}).items():
+        unknown_keys = set(project) - set(PROJECT_DEFAULTS) - {"path"}
+        if unknown_keys:
+            raise ValueError(f"Unknown settings for project '{project_id}': {', '.join(sorted(unknown_keys))}")
+        if "path" not in project:
+            raise ValueError(f"Project '{project_id}' has no path")
+        if project.get("graph_format", "vite") not in GRAPH_FORMATS:
+            raise ValueError(f"Unknown graph format '{project['graph_format']}' for project '{project_id}', "
+                             f"choose from {', '.join(GRAPH_FORMATS)}")
+        if project.get("quantize") is not None and project["quantize"] not in QUANTIZATIONS:
+            raise ValueError(f"Unknown quantization '{project['quantize']}' for project '{project_id}', "
+                             f"choose from {', '.join(QUANTIZATIONS)}")
+        if project.get("analyzer") not in ANALYZERS + (None,):
+            raise ValueError(f"Unknown analyzer '{project['analyzer']}' for project '{project_id}', "
+                             f"choose from {', '.join(ANALYZERS)}")
+
+        projects[project_id] = {
+            **PROJECT_DEFAULTS,
+            **project,
+            "id": project_id,
+            # relative paths are relative to the working directory, like all other paths of the CLI
+            "path": os.path.abspath(os.path.expanduser(project["path"])),
+            "import_graphs": [os.path.abspath(os.path.expanduser(path)) for path in project.get("import_graphs", [])],
+        }
+
+    return {"projects": projects, "limits": config.get("limits", {})}
+
+
+def load_analyzer(name):
+    if name == "js":
+        from analyzer_js import analyze_directory
+        return analyze_directory
+    if name == "py":
+        from analyzer_py import analyze_directory
+        return analyze_directory
+    return None
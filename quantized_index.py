@@ -0,0 +1,239 @@
+import os
+import threading
+import time
+
+from backends import get_embeddings
+from utils import get_store_dir_from_repository, VECTOR_STORES
+
+QUANTIZATIONS = ("int8", "binary")
+QUANTIZED_INDEX_SUFFIX = ".quantized.npz"
+# written by every change of a vector store, an index built from another version is not used
+STORE_VERSION_SUFFIX = ".version"
+# candidates re-scored with the full vectors per requested hit, binary codes are coarser
+RERANK_FACTORS = {"int8": 4, "binary": 10}
+# vectors read from Chroma and scored at once, bounds the memory of the float copies
+QUANTIZE_BATCH_SIZE = 4096
+
+_loaded_indexes = {}
+_loaded_indexes_lock = threading.Lock()
+# the Chroma stores the re-rank candidates are read from, opened once per version of the store
+_opened_stores = {}
+
+
+def get_quantized_index_path(directory, store_name):
+    return f"{get_store_dir_from_repository(directory)}/{store_name}{QUANTIZED_INDEX_SUFFIX}"
+
+
+def bump_store_version(directory, store_name):
+    """
+    Mark a vector store as changed before it is written, its quantized index is not used until it is
+    built again.
+    """
+    with open(f"{get_store_dir_from_repository(directory)}/{store_name}{STORE_VERSION_SUFFIX}", "w") as f:
+        f.write(str(time.time_ns()))
+
+
+def get_store_version(directory, store_name):
+    try:
+        with open(f"{get_store_dir_from_repository(directory)}/{store_name}{STORE_VERSION_SUFFIX}", "r") as f:
+            return f.read()
+    except FileNotFoundError:
+        return "0"
+
+
+def quantize_vectors(vectors, quantization, center=None):
+    """
+    Args:
+        center: The mean vector of the store, binary codes are the signs of the vectors relative to it.
+
+    Returns:
+        tuple: The codes and the scale of every vector, None for binary codes.
+    """
+    import numpy as np
+
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if quantization == "binary":
+        # the sign of every dimension, 32 times smaller than float32; embeddings share a common offset,
+        # without the centering most of their signs would be the same
+        return np.packbits(vectors > center, axis=1), None
+    # symmetric int8 per vector, 4 times smaller than float32
+    scales = np.abs(vectors).max(axis=1) / 127
+    scales[scales == 0] = 1
+    return np.round(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+
+
+def _open_vector_store(directory, store_name):
+    from langchain_chroma import Chroma
+
+    return Chroma(embedding_function=get_embeddings(),
+                  persist_directory=f"{get_store_dir_from_repository(directory)}/{store_name}")
+
+
+def build_quantized_index(directory, store_name, quantization):
+    """
+    Store quantized copies of the vectors of a Chroma store next to it, for ``search_quantized_index``.
+
+    Returns:
+        int: The number of quantized vectors, 0 if the store does not exist.
+    """
+    import numpy as np
+
+    if quantization not in QUANTIZATIONS:
+        raise ValueError(f"Unknown quantization '{quantization}', choose from {', '.join(QUANTIZATIONS)}")
+    if not os.path.isdir(f"{get_store_dir_from_repository(directory)}/{store_name}"):
+        return 0
+
+    version = get_store_version(directory, store_name)
+    vector_store = _open_vector_store(directory, store_name)
+
+    def iter_batches():
+        offset = 0
+        while True:
+            batch = vector_store.get(include=["embeddings", "metadatas"], limit=QUANTIZE_BATCH_SIZE, offset=offset)
+            if not batch["ids"]:
+                return
+            yield batch
+            offset += len(batch["ids"])
+
+    center = None
+    if quantization == "binary":
+        # a first pass for the mean, the vectors are never all in memory at once
+        total, count = 0, 0
+        for batch in iter_batches():
+            total = total + np.asarray(batch["embeddings"], dtype=np.float64).sum(axis=0)
+            count += len(batch["ids"])
+        center = (total / count).astype(np.float32) if count else None
+
+    ids, files, codes, scales = [], [], [], []
+    for batch in iter_batches():
+        batch_codes, batch_scales = quantize_vectors(batch["embeddings"], quantization, center)
+        ids += batch["ids"]
+        files += [metadata["file"] for metadata in batch["metadatas"]]
+        codes.append(batch_codes)
+        if batch_scales is not None:
+            scales.append(batch_scales)
+
+    # bytes instead of numpy unicode strings, which take 4 bytes per character
+    index = {"quantization": np.array(quantization), "version": np.array(version),
+             "ids": np.array([i.encode("utf-8") for i in ids], dtype=bytes),
+             "files": np.array([file.encode("utf-8") for file in files], dtype=bytes)}
+    if center is not None:
+        index["center"] = center
+    if codes:
+        index["codes"] = np.concatenate(codes)
+    if scales:
+        index["scales"] = np.concatenate(scales)
+        # the squared norms of the dequantized vectors, for the approximate distances
+        index["squared_norms"] = (index["codes"].astype(np.float32) ** 2).sum(axis=1) * index["scales"] ** 2
+    path = get_quantized_index_path(directory, store_name)
+    # written next to the index and renamed, a running query keeps reading the complete old index
+    np.savez(f"{path}.tmp.npz", **index)
+    os.replace(f"{path}.tmp.npz", path)
+    return len(ids)
+
+
+def rebuild_quantized_indexes(directory):
+    """
+    Bring the quantized indexes that exist up to date after their vector stores changed.
+    """
+    for store_name in VECTOR_STORES:
+        index = load_quantized_index(directory, store_name)
+        if index is not None:
+            build_quantized_index(directory, store_name, str(index["quantization"]))
+
+
+def load_quantized_index(directory, store_name):
+    """
+    Returns:
+        dict: The arrays of the quantized index, loaded once per version of the file, or None.
+    """
+    import numpy as np
+
+    path = get_quantized_index_path(directory, store_name)
+    try:
+        mtime_ns = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    with _loaded_indexes_lock:
+        loaded = _loaded_indexes.get(path)
+        if loaded is None or loaded[0] != mtime_ns:
+            with np.load(path) as data:
+                loaded = (mtime_ns, {name: data[name] for name in data.files})
+            _loaded_indexes[path] = loaded
+    return loaded[1]
+
+
+def clear_loaded_indexes():
+    with _loaded_indexes_lock:
+        _loaded_indexes.clear()
+        _opened_stores.clear()
+
+
+def _get_opened_vector_store(directory, store_name, version):
+    key = get_quantized_index_path(directory, store_name)
+    with _loaded_indexes_lock:
+        opened = _opened_stores.get(key)
+        if opened is None or opened[0] != version:
+            opened = (version, _open_vector_store(directory, store_name))
+            _opened_stores[key] = opened
+    return opened[1]
+
+
+def _approximate_distances(index, rows, query):
+    import numpy as np
+
+    if str(index["quantization"]) == "binary":
+        # Hamming distance of the signs, in the order of the angle between the vectors
+        query_bits = np.packbits(query > index["center"])
+        return np.unpackbits(index["codes"][rows] ^ query_bits, axis=1).sum(axis=1)
+
+    # squared L2 distance to the dequantized vectors, computed in blocks to bound the float copies
+    distances = np.empty(len(rows), dtype=np.float32)
+    for start in range(0, len(rows), QUANTIZE_BATCH_SIZE):
+        block = rows[start:start + QUANTIZE_BATCH_SIZE]
+        dots = (index["codes"][block].astype(np.float32) @ query) * index["scales"][block]
+        distances[start:start + len(block)] = index["squared_norms"][block] - 2 * dots
+    return distances + query @ query
+
+
+def search_quantized_index(directory, store_name, embedding, k, files=None):
+    """
+    Find the k closest documents of a store with its quantized index.
+
+    The quantized vectors of the whole store, or of the given files, are scored first; only a shortlist
+    of ``k`` times RERANK_FACTORS candidates is then re-scored with their full vectors read from Chroma,
+    so the distances are the exact squared L2 distances of Chroma. The store is opened once per process
+    and version, an index built from another version of the store is not used.
+
+    Returns:
+        list: (file, distance) of the hits, closest first, or None if the store has no up to date index.
+    """
+    import numpy as np
+
+    index = load_quantized_index(directory, store_name)
+    if index is None:
+        return None
+    version = get_store_version(directory, store_name)
+    if "version" not in index or str(index["version"]) != version:
+        # the store changed after the index was built, e.g. by an interrupted vectorization
+        return None
+    if not len(index["ids"]):
+        return []
+
+    rows = np.flatnonzero(np.isin(index["files"], [file.encode("utf-8") for file in files])) if files \
+        else np.arange(len(index["ids"]))
+    if not len(rows):
+        return []
+    query = np.asarray(embedding, dtype=np.float32)
+    approximate = _approximate_distances(index, rows, query)
+    shortlist_size = min(len(rows), k * RERANK_FACTORS[str(index["quantization"])])
+    shortlist = rows[np.argpartition(approximate, shortlist_size - 1)[:shortlist_size]]
+
+    # only the vectors of the candidates are read, the files are known from the index
+    files = {document_id.decode("utf-8"): file.decode("utf-8")
+             for document_id, file in zip(index["ids"][shortlist], index["files"][shortlist])}
+    candidates = _get_opened_vector_store(directory, store_name, version).get(ids=list(files),
+                                                                              include=["embeddings"])
+    distances = ((np.asarray(candidates["embeddings"], dtype=np.float32) - query) ** 2).sum(axis=1)
+    order = np.argsort(distances)[:k]
+    return [(files[candidates["ids"][i]], float(distances[i])) for i in order]
@@ -0,0 +1,113 @@
+import json
+import math
+import sqlite3
+import time
+from array import array
+
+from backends import LLM_STAGES, EMBEDDING_STAGE, get_embeddings, get_embedding_token_counter, get_stage_config
+from utils import get_store_dir_from_repository, get_embedding_tokens, set_embedding_tokens, get_index_version
+
+DEFAULT_CACHE_THRESHOLD = 0.95
+QUERY_CACHE_SIZE = 256
+
+# options of retrieve that change the result of a query
+RESULT_OPTIONS = ("adjacent", "adjacent_hops", "adjacent_limit", "symbols", "find_missing", "filter_files",
+                  "adaptive", "subtrees", "subtree_limit")
+
+
+def get_result_options(args):
+    options = {option: getattr(args, option, None) for option in RESULT_OPTIONS}
+    # other models give other answers
+    options["backends"] = {stage: get_stage_config(stage) for stage in LLM_STAGES + (EMBEDDING_STAGE,)}
+    for config in options["backends"].values():
+        config.pop("concurrency", None)
+    return json.dumps(options, sort_keys=True)
+
+
+def connect_query_cache(directory):
+    conn = sqlite3.connect(f"{get_store_dir_from_repository(directory)}/query_cache.db")
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS query_cache (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        requirement TEXT NOT NULL,
+        embedding BLOB NOT NULL,
+        options TEXT NOT NULL,
+        index_version TEXT NOT NULL,
+        relevant_files TEXT NOT NULL,
+        summary TEXT NOT NULL,
+        created REAL NOT NULL,
+        last_used REAL NOT NULL,
+        hits INTEGER NOT NULL DEFAULT 0
+    )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_query_cache_options ON query_cache (index_version, options);")
+    return conn
+
+
+def embed_requirement(requirement):
+    embedding = get_embeddings().embed_query(requirement)
+    set_embedding_tokens(get_embedding_tokens() + get_embedding_token_counter()(requirement))
+    return embedding
+
+
+def cosine_similarity(a, b):
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+def lookup_cached_result(directory, args, embedding, threshold=DEFAULT_CACHE_THRESHOLD):
+    """
+    Find the result of an earlier query whose requirement is nearly the same.
+
+    Entries of older versions of the index are dropped on the way.
+
+    Returns:
+        dict: "requirement", "relevant_files", "summary" and "similarity" of the best match at or above
+            the threshold, or None.
+    """
+    conn = connect_query_cache(directory)
+    index_version = get_index_version(directory)
+    with conn:
+        conn.execute("DELETE FROM query_cache WHERE index_version != ?", (index_version,))
+
+    best = None
+    for entry_id, requirement, blob, relevant_files, summary in conn.execute("""
+            SELECT id, requirement, embedding, relevant_files, summary FROM query_cache
+            WHERE index_version = ? AND options = ?
+            """, (index_version, get_result_options(args))):
+        similarity = cosine_similarity(embedding, array("f", blob))
+        if similarity >= threshold and (best is None or similarity > best["similarity"]):
+            best = {"id": entry_id, "requirement": requirement, "relevant_files": json.loads(relevant_files),
+                    "summary": summary, "similarity": similarity}
+
+    if best is not None:
+        with conn:
+            conn.execute("UPDATE query_cache SET last_used = ?, hits = hits + 1 WHERE id = ?",
+                         (time.time(), best["id"]))
+    conn.close()
+    return best
+
+
+def store_cached_result(directory, args, embedding, index_version, relevant_files, summary):
+    """
+    Store the result of a query, evicting the least recently used entries beyond QUERY_CACHE_SIZE.
+
+    Args:
+        index_version (str): The version of the index when the query started.
+    """
+    conn = connect_query_cache(directory)
+    now = time.time()
+    with conn:
+        conn.execute("""
+            INSERT INTO query_cache (requirement, embedding, options, index_version, relevant_files, summary,
+                created, last_used)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, (args.query, array("f", embedding).tobytes(), get_result_options(args), index_version,
+                  json.dumps(relevant_files), summary, now, now))
+        conn.execute("""
+            DELETE FROM query_cache WHERE id NOT IN (
+                SELECT id FROM query_cache ORDER BY last_used DESC LIMIT ?
+            )
+            """, (QUERY_CACHE_SIZE,))
+    conn.close()
@@ -0,0 +1,88 @@
+import sqlite3
+import time
+from contextlib import contextmanager
+
+from metrics import record_metric
+from profiling import profile_stage
+from utils import get_store_dir_from_repository, get_input_tokens, get_output_tokens
+
+# number of most recent runs of a stage its savings are estimated from
+COST_ESTIMATE_WINDOW = 20
+
+
+def connect_query_log(directory):
+    conn = sqlite3.connect(f"{get_store_dir_from_repository(directory)}/query_log.db")
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS stage_decisions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        created REAL NOT NULL,
+        query TEXT NOT NULL,
+        stage TEXT NOT NULL,
+        skipped INTEGER NOT NULL,
+        reason TEXT,
+        duration REAL,
+        input_tokens INTEGER,
+        output_tokens INTEGER
+    )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_stage_decisions_stage ON stage_decisions (stage, skipped);")
+    return conn
+
+
+def _record_decision(directory, query, stage, skipped, reason, duration, input_tokens, output_tokens):
+    conn = connect_query_log(directory)
+    with conn:
+        conn.execute("""
+            INSERT INTO stage_decisions (created, query, stage, skipped, reason, duration, input_tokens, output_tokens)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?);
+            """, (time.time(), query, stage, int(skipped), reason, duration, input_tokens, output_tokens))
+    conn.close()
+
+
+@contextmanager
+def track_stage(directory, query, stage):
+    """
+    Record the duration and the tokens of a pipeline stage that was run, and profile it with --profile.
+    """
+    input_tokens, output_tokens = get_input_tokens(), get_output_tokens()
+    start_time = time.perf_counter()
+    with profile_stage(directory, stage):
+        yield
+    duration = time.perf_counter() - start_time
+    record_metric(f"{stage}_duration", duration)
+    _record_decision(directory, query, stage, False, None, duration,
+                     get_input_tokens() - input_tokens, get_output_tokens() - output_tokens)
+
+
+def estimate_stage_cost(directory, stage):
+    """
+    Estimate the cost of a stage from its recent runs on the project.
+
+    Returns:
+        tuple: Average duration, input tokens and output tokens, all None if the stage never ran.
+    """
+    conn = connect_query_log(directory)
+    row = conn.execute("""
+        SELECT AVG(duration), AVG(input_tokens), AVG(output_tokens) FROM (
+            SELECT duration, input_tokens, output_tokens FROM stage_decisions
+            WHERE stage = ? AND skipped = 0 ORDER BY id DESC LIMIT ?
+        )
+        """, (stage, COST_ESTIMATE_WINDOW)).fetchone()
+    conn.close()
+    return row
+
+
+def record_skip(directory, query, stage, reason):
+    """
+    Record that a stage was skipped, with the latency and tokens it is estimated to have saved.
+
+    Returns:
+        tuple: The estimated saved duration, input tokens and output tokens.
+    """
+    duration, input_tokens, output_tokens = estimate_stage_cost(directory, stage)
+    record_metric(f"{stage}_skipped", 1)
+    if duration is not None:
+        record_metric("saved_duration", duration)
+        record_metric("saved_tokens", input_tokens + output_tokens)
+    _record_decision(directory, query, stage, True, reason, duration, input_tokens, output_tokens)
+    return duration, input_tokens, output_tokens
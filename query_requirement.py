@@ -1,39 +1,107 @@
 import json
-import sqlite3
 import os
-from langchain_chroma import Chroma
-from tiktoken import get_encoding
-
+import sys
+import time
+
+from backends import get_embeddings, get_embedding_token_counter, get_llm_query_result, stream_llm_query_result
+from directory_summaries import find_relevant_directories, get_files_in_directories
+from graph_expansion import expand_adjacent_files
+from metrics import record_metric
+from query_cache import embed_requirement, lookup_cached_result, store_cached_result
+from query_log import track_stage, record_skip
+from quantized_index import search_quantized_index
 from setup_repository import CALC_EMBEDDING_TOKENS
-from utils import get_embeddings, get_store_dir_from_repository, get_llm_query_result, load_call_analysis_results, \
-    get_file_summaries_dict, set_embedding_tokens, get_embedding_tokens, get_model_encoding_string
+from symbol_graph import match_symbols, expand_symbol_references, read_line_ranges
+from utils import get_store_dir_from_repository, get_file_summaries_dict, set_embedding_tokens, get_embedding_tokens, \
+    get_index_version, get_duplicate_members, VECTOR_STORES
 
+# Adaptive mode: stages are skipped when the closest file is at most this fraction of the median distance
+ADAPTIVE_MAX_DISTANCE_RATIO = 0.75
+# number of top hits per store that have to overlap
+ADAPTIVE_TOP_FILES = 3
+# the filter stage is only skipped for candidate sets up to this size
+ADAPTIVE_MAX_CANDIDATES = 8
+
+
+def search_similar_files(query, directory, k=10, files=None, exact=False, embedding=None):
+    """
+    Search the summary and the content vector stores, optionally only among the given files.
+
+    Stores with a quantized index (init --quantize) are searched with it, unless ``exact`` is set.
+    The query is embedded unless its ``embedding`` is given.
+
+    Returns:
+        tuple: The hits of the summary store and of the content store, each a list of (file, distance),
+            closest first.
+    """
+    from langchain_chroma import Chroma
 
-def similar_files_vector_db(query, directory):
     embeddings = get_embeddings()
     store_dir = get_store_dir_from_repository(directory)
+    # embedded once for both stores
+    embedded = embedding is None
+    if embedded:
+        embedding = embeddings.embed_query(query)
+    search_filter = {"file": {"$in": list(files)}} if files else None
 
-    persist_summary_store_dir = f"{store_dir}/summary_store"
-    vector_store_summaries = Chroma(embedding_function=embeddings, persist_directory=persist_summary_store_dir)
+    hits = []
+    for store_name in VECTOR_STORES:
+        store_hits = None if exact else search_quantized_index(directory, store_name, embedding, k, files)
+        if store_hits is None:
+            vector_store = Chroma(embedding_function=embeddings, persist_directory=f"{store_dir}/{store_name}")
+            similar_documents = vector_store.similarity_search_by_vector_with_relevance_scores(
+                embedding, k=k, filter=search_filter)
+            store_hits = [(document.metadata["file"], distance) for document, distance in similar_documents]
+        hits.append(store_hits)
 
-    persist_contents_store_dir = f"{store_dir}/contents_store"
-    vector_store_contents = Chroma(embedding_function=embeddings, persist_directory=persist_contents_store_dir)
+    if CALC_EMBEDDING_TOKENS and embedded:
+        set_embedding_tokens(get_embedding_tokens() + get_embedding_token_counter()(query))
 
-    similar_documents_summaries = vector_store_summaries.similarity_search(query, k=10)
-    similar_documents_contents = vector_store_contents.similarity_search(query, k=10)
+    summary_hits, content_hits = hits
+    return summary_hits, content_hits
 
-    if CALC_EMBEDDING_TOKENS:
-        encoding = get_encoding(get_model_encoding_string())
-        token_count = len(encoding.encode(query))
-        set_embedding_tokens(get_embedding_tokens() + 2 * token_count)
 
-    similar_files_summaries = [document.metadata["file"] for document in similar_documents_summaries]
-    similar_files_contents = [document.metadata["file"] for document in similar_documents_contents]
+def similar_files_vector_db(query, directory):
+    summary_hits, content_hits = search_similar_files(query, directory)
+    return [file for file, _ in summary_hits] + [file for file, _ in content_hits]
+
 
-    return similar_files_summaries + similar_files_contents
+def retrieval_confidence(summary_hits, content_hits, lexical_files=()):
+    """
+    Decide whether the similarity search results are decisive enough to skip LLM stages.
 
+    The hits are decisive when the closest file is much closer than the median candidate, which does not
+    depend on the scale of the embedding distances, and when the top hits of the two stores, or of a
+    store and the symbols matching the query, overlap.
 
-def get_relevant_files(requirement, file_list, directory):
+    Returns:
+        dict: "decisive" and the "reason" for the decision.
+    """
+    best_distances = {}
+    for file, distance in summary_hits + content_hits:
+        best_distances[file] = min(distance, best_distances.get(file, distance))
+    if not best_distances:
+        return {"decisive": False, "reason": "no similar files"}
+
+    distances = sorted(best_distances.values())
+    median_distance = distances[len(distances) // 2]
+    distance_ratio = distances[0] / median_distance if median_distance > 0 else 1.0
+
+    top_summary_files = {file for file, _ in summary_hits[:ADAPTIVE_TOP_FILES]}
+    top_content_files = {file for file, _ in content_hits[:ADAPTIVE_TOP_FILES]}
+    if top_summary_files & top_content_files or (top_summary_files | top_content_files) & set(lexical_files):
+        agreement = "top hits agree"
+    elif not summary_hits or not content_hits:
+        # a single vectorized store cannot be cross checked
+        agreement = "single store"
+    else:
+        return {"decisive": False, "reason": f"top hits disagree, distance ratio {distance_ratio:.2f}"}
+
+    return {"decisive": distance_ratio <= ADAPTIVE_MAX_DISTANCE_RATIO,
+            "reason": f"{agreement}, distance ratio {distance_ratio:.2f}"}
+
+
+def get_relevant_files(requirement, file_list, directory, line_ranges=None):
     TEMPLATE = \
         """
         What are the names of the files that are related to the following use case requirement?
@@ -48,43 +116,20 @@ def get_relevant_files(requirement, file_list, directory):
         {files}
         """
 
-    store_dir = get_store_dir_from_repository(directory)
-    conn = sqlite3.connect(f"{store_dir}/summaries.db")
-    cursor = conn.cursor()
-
+    line_ranges = line_ranges or {}
     files = []
     for file in file_list:
-        cursor.execute("SELECT summary FROM summaries WHERE file=?", (file,))
-        # summary = cursor.fetchone()
-
-        with open(os.path.join(directory, file), 'r') as f:
-            content = f.read()
+        if file in line_ranges:
+            # only the symbols that reference or are referenced by the matched symbols
+            content = read_line_ranges(directory, file, line_ranges[file])
+        else:
+            with open(os.path.join(directory, file), 'r') as f:
+                content = f.read()
 
         files.append(f"{file}: {content}")
 
-    cursor.close()
-    conn.close()
-
     query = TEMPLATE.format(requirement=requirement, files="\n".join(files))
-    return get_llm_query_result(query)
-
-
-def query_stats(directory, args):
-    store_dir = get_store_dir_from_repository(directory)
-
-    def get_size():
-        total_size = 0
-        for dirpath, dirnames, filenames in os.walk(store_dir):
-            for f in filenames:
-                fp = os.path.join(dirpath, f)
-                # skip if it is symbolic link
-                if not os.path.islink(fp):
-                    total_size += os.path.getsize(fp)
-
-        return total_size
-
-    print(f'disk size of databases: {get_size() / 1024 / 1024:.2f} MB')
-    # ..to be continued
+    return get_llm_query_result(query, "relevant")
 
 
 def reformulate_query_for_retrieval(query):
@@ -108,14 +153,18 @@ def reformulate_query_for_retrieval(query):
     {query}
     """
 
-    return get_llm_query_result(TEMPLATE.format(query=query))
+    return get_llm_query_result(TEMPLATE.format(query=query), "reformulate")
 
 
-def get_file_summaries_string(file, summary_list):
+def get_file_summaries_string(file, summary_list, copies=()):
     def get_joined_summary_string(summaries):
         return "\n".join([summary for summary in summaries])
 
-    return f"Filename {file}:\n {'Summaries' if len(summary_list) > 1 else 'Summary'} {get_joined_summary_string(summary_list)}"
+    summary_string = f"Filename {file}:\n {'Summaries' if len(summary_list) > 1 else 'Summary'} {get_joined_summary_string(summary_list)}"
+    if copies:
+        # duplicates are only summarised once, the copies probably need the same changes
+        summary_string += f"\n Identical or nearly identical copies: {', '.join(copies)}"
+    return summary_string
 
 
 def filter_similar_files_by_summary(query, similar_files, directory):
@@ -139,7 +188,7 @@ def filter_similar_files_by_summary(query, similar_files, directory):
         [get_file_summaries_string(file, summary_list)
          for file, summary_list in summaries.items()]))
 
-    result = get_llm_query_result(query)
+    result = get_llm_query_result(query, "filter")
     try:
         result = json.loads(result.replace('```json\n', '').replace('```', ''))
     except Exception as e:
@@ -165,12 +214,21 @@ def find_missing_files(query, similar_files, directory):
     summaries = get_file_summaries_dict(directory, similar_files)
 
     search_string = get_llm_query_result(TEMPLATE.format(requirement=query, files="\n\n".join(
-        [get_file_summaries_string(file, summary_list) for file, summary_list in summaries.items()])))
+        [get_file_summaries_string(file, summary_list) for file, summary_list in summaries.items()])), "missing")
 
     return similar_files_vector_db(search_string, directory)
 
 
-def get_final_summary(query, similar_files, directory):
+def get_final_summary(query, similar_files, directory, output=sys.stdout):
+    """
+    Generate the implementation summary for the requirement, streaming it to ``output`` as it is generated.
+
+    Args:
+        output: File like object the summary is written to, e.g. stdout or a server response, or None.
+
+    Returns:
+        str: The complete summary.
+    """
     TEMPLATE = """
     You are given a requirement for a software project and a list of files with their summaries that are similar to the requirement.
     A user needs to implement this requirement and through preprocessing we selected a list of files that could be relevant.
@@ -228,54 +286,129 @@ def get_final_summary(query, similar_files, directory):
     """
 
     summaries = get_file_summaries_dict(directory, similar_files)
+    copies = get_duplicate_members(directory, summaries)
 
     query = TEMPLATE.format(requirement=query,
-                            files="\n\n".join([get_file_summaries_string(file, summary_list) for file, summary_list in
-                                               summaries.items()]))
-    return get_llm_query_result(query)
+                            files="\n\n".join([get_file_summaries_string(file, summary_list, copies.get(file, ()))
+                                               for file, summary_list in summaries.items()]))
+
+    # the summary is written as it is generated, so the user waits only for the first token
+    parts = []
+    start_time = time.perf_counter()
+    for part in stream_llm_query_result(query, "final"):
+        if not parts:
+            record_metric("final_time_to_first_token", time.perf_counter() - start_time)
+        parts.append(part)
+        if output is not None:
+            output.write(part)
+            output.flush()
+    if output is not None:
+        output.write("\n")
+    return "".join(parts)
 
 
 def query_project(directory, args):
     VERBOSE = False
+    adaptive = getattr(args, "adaptive", False)
+
+    use_cache = getattr(args, "cache", False)
+    # the requirement is embedded once, for the cache lookup and the search of the directories
+    requirement_embedding = None
+    if use_cache:
+        index_version = get_index_version(directory)
+        requirement_embedding = embed_requirement(args.query)
+        cached = lookup_cached_result(directory, args, requirement_embedding, args.cache_threshold)
+        if cached is not None:
+            record_metric("query_cache_hit", cached["similarity"])
+            print(f"Using the result of the cached requirement \"{cached['requirement']}\" "
+                  f"(similarity {cached['similarity']:.3f})")
+            if args.cache_refresh_summary:
+                print('Generating summary...')
+                with track_stage(directory, args.query, "final"):
+                    summary = get_final_summary(args.query, cached["relevant_files"], directory)
+                print('Generating summary done')
+                return summary
+            print(cached["summary"])
+            return cached["summary"]
+
+    scope_files = None
+    if getattr(args, "subtrees", False):
+        # coarse to fine, the files are only searched inside the directories relevant to the requirement
+        print('Finding relevant directories...')
+        with track_stage(directory, args.query, "subtrees"):
+            relevant_directories = find_relevant_directories(args.query, directory, args.subtree_limit,
+                                                             embedding=requirement_embedding)
+            scope_files = get_files_in_directories(directory, relevant_directories) or None
+        if VERBOSE:
+            print('Relevant directories:', relevant_directories)
+        print('Finding relevant directories done')
 
     # find similar files
     print("Generating similarity query...")
-    reformulated_query = reformulate_query_for_retrieval(args.query)
+    with track_stage(directory, args.query, "reformulate"):
+        reformulated_query = reformulate_query_for_retrieval(args.query)
     print("Generating similarity query done")
     print('Finding similar files...')
-    similar_files = set(similar_files_vector_db(reformulated_query, directory))
+    with track_stage(directory, args.query, "search"):
+        summary_hits, content_hits = search_similar_files(reformulated_query, directory, files=scope_files)
+    # the stages after the search are skipped when its hits are decisive
+    confidence = retrieval_confidence(summary_hits, content_hits) if adaptive else {"decisive": False}
     print('Finding similar files done')
+    similar_files = {file for file, _ in summary_hits + content_hits}
 
     if args.adjacent:
         # find and add adjacent files
         print('Finding adjacent files...')
-        file_list = load_call_analysis_results(directory)
-        adjacent_files = set()
-        for file in file_list:
-            if file['file'] in similar_files:
-                for called_file in file['calls']:
-                    adjacent_files.add(called_file)
-                for calling_file in file['called_by']:
-                    adjacent_files.add(calling_file)
+        with track_stage(directory, args.query, "adjacent"):
+            adjacent_files = expand_adjacent_files(directory, similar_files, hops=args.adjacent_hops,
+                                                   max_neighbours=args.adjacent_limit)
+        adjacent_files = {file for file, _ in adjacent_files}
         similar_files = similar_files.union(adjacent_files)
         if VERBOSE:
             print('Adjacent files:', adjacent_files)
         print('Finding adjacent files done')
 
+    line_ranges = {}
+    if args.symbols:
+        print('Finding referenced symbols...')
+        with track_stage(directory, args.query, "symbols"):
+            matched_symbols = match_symbols(directory, similar_files, f"{args.query} {reformulated_query}")
+            line_ranges = expand_symbol_references(directory, [symbol['id'] for symbol in matched_symbols])
+        line_ranges = {file: ranges for file, ranges in line_ranges.items() if file not in similar_files}
+        similar_files = similar_files.union(line_ranges)
+        if adaptive:
+            confidence = retrieval_confidence(summary_hits, content_hits,
+                                              {symbol['file'] for symbol in matched_symbols})
+        if VERBOSE:
+            print('Matched symbols:', [f"{symbol['file']}:{symbol['name']}" for symbol in matched_symbols])
+        print('Finding referenced symbols done')
+
     if args.find_missing:
-        print('Finding missing files...')
-        missing_files = find_missing_files(args.query, list(similar_files), directory)
-        similar_files = similar_files.union(missing_files)
-        print('Finding missing files done')
+        if adaptive and confidence["decisive"]:
+            record_skip(directory, args.query, "missing", confidence["reason"])
+            print(f"Skipping missing files, {confidence['reason']}")
+        else:
+            print('Finding missing files...')
+            with track_stage(directory, args.query, "missing"):
+                missing_files = find_missing_files(args.query, list(similar_files), directory)
+            similar_files = similar_files.union(missing_files)
+            print('Finding missing files done')
 
     if args.filter_files:
-        print('Filtering similar files...')
-        similar_files = filter_similar_files_by_summary(args.query, list(similar_files), directory)
-        print('Filtering similar files done')
+        if adaptive and confidence["decisive"] and len(similar_files) <= ADAPTIVE_MAX_CANDIDATES:
+            reason = f"{confidence['reason']}, {len(similar_files)} candidates"
+            record_skip(directory, args.query, "filter", reason)
+            print(f"Skipping filtering similar files, {reason}")
+        else:
+            print('Filtering similar files...')
+            with track_stage(directory, args.query, "filter"):
+                similar_files = filter_similar_files_by_summary(args.query, list(similar_files), directory)
+            print('Filtering similar files done')
 
     # get relevant files
     print('Getting relevant files...')
-    relevant_files = get_relevant_files(args.query, list(similar_files), directory)
+    with track_stage(directory, args.query, "relevant"):
+        relevant_files = get_relevant_files(args.query, list(similar_files), directory, line_ranges)
     print('Getting relevant files done')
 
     if VERBOSE:
@@ -290,6 +423,9 @@ def query_project(directory, args):
         return
 
     print('Generating summary...')
-    summary = get_final_summary(args.query, result, directory)
-    if VERBOSE:
-        print('Summary:\n', summary)
+    with track_stage(directory, args.query, "final"):
+        summary = get_final_summary(args.query, result, directory)
+    print('Generating summary done')
+    if use_cache:
+        store_cached_result(directory, args, requirement_embedding, index_version, result, summary)
+    return summary
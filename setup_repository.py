@@ -1,16 +1,42 @@
+import heapq
+import json
+import math
 import os
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import time
+from contextvars import copy_context
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
-from langchain_core.documents import Document
-from tiktoken import get_encoding
 from tqdm import tqdm
-from langchain_chroma import Chroma
-from utils import get_llm_query_result, get_embeddings, get_store_dir_from_repository, load_call_analysis_results, \
-    load_summaries, \
-    store_call_analysis_results, is_binary_file, store_summaries, get_initial_files, join_file_lists, \
-    get_embedding_tokens, set_embedding_tokens, get_model_encoding_string
+
+from backends import get_llm_query_result, get_embeddings, get_embedding_token_counter, get_stage_concurrency
+from directory_summaries import build_directory_summaries, initialize_directory_vector_db
+from graph_expansion import compute_file_centrality, load_file_centrality
+from graph_import import import_graph_files
+from metrics import record_metric
+from near_duplicates import cluster_duplicates
+from profiling import profile_stage
+from quantized_index import build_quantized_index, rebuild_quantized_indexes, bump_store_version
+from shared_store import SharedEmbeddings, get_summary_key, lookup_shared_summaries
+from symbol_graph import store_symbol_analysis_results
+from utils import get_store_dir_from_repository, load_call_analysis_results, \
+    iter_summaries, read_file_content, \
+    store_call_analysis_results, is_binary_file, iter_initial_files, join_file_lists, filter_analysis_results, \
+    get_embedding_tokens, set_embedding_tokens, get_content_hash, load_summary_hashes, SummaryWriter, \
+    bump_index_version, store_duplicates, record_build, get_input_tokens, get_output_tokens, VECTOR_STORES
 
 CALC_EMBEDDING_TOKENS = True
+SUMMARY_FLUSH_SIZE = 50
+SUMMARY_CHUNK_SIZE = 100000
+SUMMARY_CHUNK_OVERLAP = 1000
+# scheduling estimates, a token is about four bytes of code, the summary prompt itself about 150 tokens
+BYTES_PER_TOKEN = 4
+SUMMARY_PROMPT_TOKENS = 150
+# how much the page rank of a file raises its priority, relative to its length
+CENTRALITY_PRIORITY_WEIGHT = 1.0
+# packing mode: files up to this size are summarised together, in prompts of up to PACK_TOKEN_BUDGET tokens
+PACK_MAX_FILE_SIZE = 4000
+PACK_TOKEN_BUDGET = 8000
+PACK_MAX_FILES = 40
 
 SUMMARY_SYSTEM_PROMPT_CHUNKED = \
     """
@@ -27,7 +53,31 @@ SUMMARY_SYSTEM_PROMPT_CHUNKED = \
     """
 
 
-def generate_single_file_summaries(directory, file):
+SUMMARY_PROMPT_PACKED = \
+    """
+    You are an expert software engineer who has been asked to generate summaries of code files.
+    Each summary should not only contain information about the code, but also what it is used for, its purpose, including keywords at the end.
+    The summaries will later be stored in a vector database for retrieval.
+    They will be compared to software requirements to determine if they are relevant, so make sure to include relevant information.
+    Be as concise as possible and do not repeat yourself.
+
+    Return ONLY a JSON object that maps every file name below to the summary of its file, without additional text.
+    {{"<File 1 Name>": "<Summary of file 1>", ... "<File N Name>": "<Summary of file N>"}}
+
+    The files are:
+    {files}
+    """
+
+
+def prepare_file_summary(directory, file, chunk_size=SUMMARY_CHUNK_SIZE, chunk_overlap=SUMMARY_CHUNK_OVERLAP,
+                         stored_hashes=None):
+    """
+    Read a file and split it into the chunks to summarise.
+
+    Returns:
+        tuple: The result dict (without summaries) and the chunks, or None if ``stored_hashes`` has the
+            hash of its current content, i.e. its summaries are up to date.
+    """
     result = {
         "file": file['file'],
         "content": "",
@@ -36,22 +86,35 @@ def generate_single_file_summaries(directory, file):
         "called_by": file['called_by']
     }
 
+    # files from discovery carry a hash and were already classified as text
     file_path = os.path.join(directory, file['file'])
-    with open(file_path, "r") as f:
-        try:
-            if is_binary_file(file_path):
-                return result
-
-            result['content'] = f.read()
-            chunks = split_into_chunks(result['content'], 100000, 1000)
-            chunked_summaries = [
-                get_llm_query_result(SUMMARY_SYSTEM_PROMPT_CHUNKED.format(file_name=file['file'], file_content=chunk))
-                for chunk in chunks
-            ]
-            result['summaries'] = chunked_summaries
-        except UnicodeDecodeError:
-            result['content'] = ''
-            result['summaries'] = []
+    if 'hash' not in file and (not os.path.isfile(file_path) or is_binary_file(file_path)):
+        return result, []
+
+    result['content'] = read_file_content(directory, file['file'])
+    if stored_hashes and stored_hashes.get(file['file']) == get_content_hash(result['content']):
+        return None
+    return result, split_into_chunks(result['content'], chunk_size, chunk_overlap)
+
+
+def summarise_chunk(file_name, chunk):
+    return get_llm_query_result(SUMMARY_SYSTEM_PROMPT_CHUNKED.format(file_name=file_name, file_content=chunk),
+                                "summary")
+
+
+def generate_single_file_summaries(directory, file, chunk_size=SUMMARY_CHUNK_SIZE,
+                                   chunk_overlap=SUMMARY_CHUNK_OVERLAP, stored_hashes=None):
+    """
+    Summarise a file chunk by chunk.
+
+    Returns:
+        dict: The file with its content and summaries, or None if its summaries are up to date.
+    """
+    prepared = prepare_file_summary(directory, file, chunk_size, chunk_overlap, stored_hashes)
+    if prepared is None:
+        return None
+    result, chunks = prepared
+    result['summaries'] = [summarise_chunk(file['file'], chunk) for chunk in chunks]
     return result
 
 
@@ -65,122 +128,513 @@ def split_into_chunks(text, chunk_size, overlap):
     return chunks
 
 
-def add_file_contents(file_list, directory):
-    results = []
-    with ThreadPoolExecutor(max_workers=10) as executor:
-        future_to_file = {executor.submit(generate_single_file_summaries, directory, file): file for file in file_list}
-        for future in tqdm(as_completed(future_to_file), total=len(file_list)):
-            try:
-                results.append(future.result())
-            except Exception as e:
-                print(f"Error processing file: {e}")
+def estimate_summary_cost(file, chunk_size=SUMMARY_CHUNK_SIZE, chunk_overlap=SUMMARY_CHUNK_OVERLAP):
+    """
+    Estimate the input tokens and the number of chunks of summarising a file from its size.
+    """
+    size = file.get('size') or 0
+    chunk_count = max(1, math.ceil(max(0, size - chunk_overlap) / (chunk_size - chunk_overlap)))
+    return size / BYTES_PER_TOKEN + chunk_count * SUMMARY_PROMPT_TOKENS, chunk_count
+
+
+def prioritise_files(file_list, directory, chunk_size=SUMMARY_CHUNK_SIZE, chunk_overlap=SUMMARY_CHUNK_OVERLAP):
+    """
+    Order the files to summarise longest first, weighted by their centrality in the import graph.
+
+    Long files dominate the run time, starting them first avoids a long tail at the end of the run,
+    and central files are summarised, and thus queryable, early. Only the file records are held in
+    memory, the contents are read by the workers.
+
+    Returns:
+        list: (priority, file) tuples, highest priority first.
+    """
+    files = list(file_list)
+    for file in files:
+        if 'size' not in file and os.path.isfile(os.path.join(directory, file['file'])):
+            file['size'] = os.path.getsize(os.path.join(directory, file['file']))
+
+    centrality = load_file_centrality(directory, [file['file'] for file in files])
+    # the page rank sums up to one, scaled by the number of files an average file has weight one
+    scale = len(centrality)
+    prioritised = []
+    for file in files:
+        tokens, _ = estimate_summary_cost(file, chunk_size, chunk_overlap)
+        pagerank = centrality.get(file['file'], {}).get("pagerank", 0.0)
+        prioritised.append((tokens * (1 + CENTRALITY_PRIORITY_WEIGHT * pagerank * scale), file))
+    prioritised.sort(key=lambda item: item[0], reverse=True)
+    return prioritised
+
+
+def use_shared_summaries(writer, result):
+    """
+    Hand the summaries another project generated for the same content to the writer.
+
+    Returns:
+        bool: Whether the shared store had summaries for the content, with the model and chunking of the writer.
+    """
+    if writer.shared_key is None or not result['content']:
+        return False
+    summaries = lookup_shared_summaries(get_content_hash(result['content']), writer.shared_key)
+    if summaries is None:
+        return False
+    writer.put_result({**result, "summaries": summaries})
+    record_metric("shared_summaries", 1)
+    return True
+
+
+def summarise_file(writer, directory, file, chunk_size, chunk_overlap, stored_hashes):
+    # runs in the workers, files with a single chunk are summarised and handed to the writer directly
+    try:
+        prepared = prepare_file_summary(directory, file, chunk_size, chunk_overlap, stored_hashes)
+        if prepared is None:
+            return None
+        result, chunks = prepared
+        if use_shared_summaries(writer, result):
+            return result, []
+        if len(chunks) > 1:
+            return result, chunks
+        result['summaries'] = [summarise_chunk(file['file'], chunk) for chunk in chunks]
+    except Exception as e:
+        writer.put_error(file['file'], f"{type(e).__name__}: {e}")
+        return None
+    writer.put_result(result)
+    return result, []
+
+
+def pack_small_files(prioritised):
+    """
+    Group the small files into packs that are summarised with one prompt each.
 
-    store_summaries(results, directory)
-    return results
+    Returns:
+        tuple: The packs as (priority, files) tuples and the remaining (priority, file) tuples.
+    """
+    packs = []
+    remaining = []
+    pack, pack_priority, pack_tokens = [], 0, 0
+    for priority, file in prioritised:
+        size = file.get('size')
+        if size is None or size > PACK_MAX_FILE_SIZE:
+            remaining.append((priority, file))
+            continue
+        tokens = size / BYTES_PER_TOKEN
+        if pack and (pack_tokens + tokens > PACK_TOKEN_BUDGET or len(pack) >= PACK_MAX_FILES):
+            packs.append((pack_priority, pack))
+            pack, pack_priority, pack_tokens = [], 0, 0
+        pack.append(file)
+        pack_priority += priority
+        pack_tokens += tokens
+    if pack:
+        packs.append((pack_priority, pack))
+    return packs, remaining
+
+
+def parse_packed_summaries(response, file_names):
+    """
+    Validate the JSON answer to a packed prompt.
+
+    Returns:
+        dict: The non-empty summaries of the requested files, files the model skipped are missing.
+    """
+    try:
+        summaries = json.loads(response.replace('```json\n', '').replace('```', ''))
+    except json.JSONDecodeError:
+        return {}
+    if not isinstance(summaries, dict):
+        return {}
+    return {file_name: summaries[file_name].strip() for file_name in file_names
+            if isinstance(summaries.get(file_name), str) and summaries[file_name].strip()}
 
 
-def initialize_summary_vector_db(file_list, directory):
+def summarise_pack(writer, directory, files, stored_hashes):
+    """
+    Summarise several small files with one prompt, runs in the workers.
+
+    Returns:
+        tuple: The number of summarised and unchanged files, and the files to summarise one by one
+            because the answer did not contain their summaries.
+    """
+    summarised, unchanged, packed, fallback_files = 0, 0, [], []
+    for file in files:
+        try:
+            prepared = prepare_file_summary(directory, file, stored_hashes=stored_hashes)
+        except Exception:
+            # summarised on its own, where the error is recorded
+            fallback_files.append(file)
+            continue
+        if prepared is None:
+            unchanged += 1
+        elif not prepared[1]:
+            # nothing to summarise
+            writer.put_result(prepared[0])
+            summarised += 1
+        elif use_shared_summaries(writer, prepared[0]):
+            summarised += 1
+        else:
+            packed.append((file, prepared[0]))
+    if not packed:
+        return summarised, unchanged, fallback_files
+
+    prompt = SUMMARY_PROMPT_PACKED.format(files="\n\n".join(
+        f"Filename {result['file']}:\n{result['content']}" for _, result in packed))
+    try:
+        summaries = parse_packed_summaries(get_llm_query_result(prompt, "summary"),
+                                           [result['file'] for _, result in packed])
+    except Exception:
+        # the files are summarised one by one, where their errors are recorded
+        summaries = {}
+
+    fallback = []
+    for file, result in packed:
+        if result['file'] in summaries:
+            writer.put_result({**result, "summaries": [summaries[result['file']]]})
+            summarised += 1
+        else:
+            fallback.append(file)
+    record_metric("packed_files", len(packed) - len(fallback))
+    record_metric("pack_fallback_files", len(fallback))
+    return summarised, unchanged, fallback_files + fallback
+
+
+def add_file_contents(file_list, directory, chunk_size=SUMMARY_CHUNK_SIZE, chunk_overlap=SUMMARY_CHUNK_OVERLAP,
+                      workers=None, resume=False, pack=False, deduplicate=False, share=False):
+    """
+    Summarise the files of ``file_list`` and store the summaries.
+
+    Files are scheduled by ``prioritise_files``, the chunks of large files are summarised by several
+    workers at once. Only a bounded number of tasks is in flight and the workers hand their results
+    to a single writer thread that commits them as they arrive, so an interrupted run keeps every
+    finished summary; on KeyboardInterrupt the started files are finished and stored before it is
+    raised again. Files that fail are recorded in the summary_errors table. With ``resume``,
+    files whose summaries were generated for their current content are skipped, so failed and
+    unfinished files are summarised by running again. With ``pack``, small files are summarised
+    together by ``summarise_pack``. With ``deduplicate``, exact and near-duplicate files are clustered
+    by ``cluster_duplicates`` and only the file representing a cluster is summarised, and thus
+    vectorized, the others are linked to it. With ``share``, files whose content another project
+    summarised with the same model and chunking take the summaries from the shared store.
+
+    Returns:
+        int: The number of processed files.
+    """
+    workers = workers or get_stage_concurrency("summary")
+    stored_hashes = load_summary_hashes(directory) if resume else None
+    prioritised = prioritise_files(file_list, directory, chunk_size, chunk_overlap)
+
+    # the longest and most central file represents its cluster
+    duplicates = cluster_duplicates([file for _, file in prioritised]) if deduplicate else {}
+    if deduplicate:
+        store_duplicates(directory, duplicates)
+    if duplicates:
+        prioritised = [(priority, file) for priority, file in prioritised if file['file'] not in duplicates]
+        record_metric("duplicate_files", len(duplicates))
+        print(f"{len(duplicates)} duplicate files share the summary of another file.")
+
+    file_count = len(prioritised)
+    packs = []
+    if pack:
+        packs, prioritised = pack_small_files(prioritised)
+
+    # heap of (-priority, sequence, task), the chunks of a started file inherit its priority and so
+    # run before the files after it
+    ready = [(-priority, sequence, ("file", file)) for sequence, (priority, file) in enumerate(prioritised)]
+    ready += [(-priority, len(ready) + sequence, ("pack", files)) for sequence, (priority, files) in enumerate(packs)]
+    heapq.heapify(ready)
+    sequence = len(ready)
+    split_files = {}
+
+    writer = SummaryWriter(directory, SUMMARY_FLUSH_SIZE,
+                           shared_key=get_summary_key(chunk_size, chunk_overlap) if share else None)
+    processed = 0
+    summarised = 0
+    interrupted = False
+
+    def complete(future, priority, task):
+        nonlocal processed, summarised, sequence
+        kind, item = task
+        if kind == "pack":
+            pack_summarised, pack_unchanged, fallback = future.result()
+            processed += pack_summarised + pack_unchanged
+            summarised += pack_summarised
+            progress.update(pack_summarised + pack_unchanged)
+            for file in fallback:
+                heapq.heappush(ready, (priority, sequence, ("file", file)))
+                sequence += 1
+            return
+        if kind == "file":
+            outcome = future.result()
+            if outcome is not None and outcome[1]:
+                result, chunks = outcome
+                split_files[result['file']] = {"result": result, "summaries": [None] * len(chunks),
+                                               "remaining": len(chunks)}
+                for chunk_index, chunk in enumerate(chunks):
+                    heapq.heappush(ready, (priority, sequence, ("chunk", (result['file'], chunk_index, chunk))))
+                    sequence += 1
+                return
+            processed += 1
+            summarised += outcome is not None
+            progress.update()
+            return
+
+        file_name, chunk_index, _ = item
+        split_file = split_files.get(file_name)
+        if split_file is None:
+            # another chunk of the file failed already
+            return
+        try:
+            split_file["summaries"][chunk_index] = future.result()
+        except Exception as e:
+            writer.put_error(file_name, f"{type(e).__name__}: {e}")
+            del split_files[file_name]
+            processed += 1
+            progress.update()
+            return
+        split_file["remaining"] -= 1
+        if split_file["remaining"] == 0:
+            del split_files[file_name]
+            writer.put_result({**split_file["result"], "summaries": split_file["summaries"]})
+            processed += 1
+            summarised += 1
+            progress.update()
+
+    def run_tasks(executor, in_flight, chunks_only=False):
+        while ready or in_flight:
+            while ready and len(in_flight) < 2 * workers:
+                priority, _, task = heapq.heappop(ready)
+                kind, item = task
+                if chunks_only and kind != "chunk":
+                    continue
+                # the workers run in a copy of the context to see the backends of the project
+                if kind == "file":
+                    future = executor.submit(copy_context().run, summarise_file, writer, directory, item,
+                                             chunk_size, chunk_overlap, stored_hashes)
+                elif kind == "pack":
+                    future = executor.submit(copy_context().run, summarise_pack, writer, directory, item,
+                                             stored_hashes)
+                else:
+                    future = executor.submit(copy_context().run, summarise_chunk, item[0], item[2])
+                in_flight[future] = (priority, task)
+            if not in_flight:
+                break
+
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                priority, task = in_flight.pop(future)
+                if not future.cancelled():
+                    complete(future, priority, task)
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor, tqdm(total=file_count) as progress:
+            in_flight = {}
+            try:
+                run_tasks(executor, in_flight)
+            except KeyboardInterrupt:
+                # the summaries being generated are paid for, the files and packs not started yet are
+                # dropped, the started ones and the remaining chunks of split files are finished
+                interrupted = True
+                print("Interrupted, storing the summaries in progress, interrupt again to stop at once...")
+                for future, (_, task) in in_flight.items():
+                    if task[0] != "chunk":
+                        future.cancel()
+                run_tasks(executor, in_flight, chunks_only=True)
+    finally:
+        writer.close()
+
+    print(f"{summarised} files summarised, {processed - summarised - writer.failed} unchanged, "
+          f"{writer.failed} failed.")
+    if writer.failed or interrupted:
+        print("Run init --summarize --resume to summarise the failed and remaining files.")
+    if interrupted:
+        # the directory roll-ups and the vectorization would work on the incomplete summaries
+        raise KeyboardInterrupt
+    return processed
+
+
+def initialize_summary_vector_db(file_list, directory, share=False):
+    from langchain_chroma import Chroma
+    from langchain_core.documents import Document
+
     store_dir = get_store_dir_from_repository(directory)
 
-    embeddings = get_embeddings()
+    # shared embeddings count the tokens of the texts they embed themselves
+    embeddings = SharedEmbeddings(get_embeddings()) if share else get_embeddings()
+    count_embedding_tokens = CALC_EMBEDDING_TOKENS and not share
     CHUNK_SIZE = 10
 
     # Initialize the summary vector store
     persist_summary_store_dir = f"{store_dir}/summary_store"
+    bump_store_version(directory, "summary_store")
     vector_store_summaries = Chroma(embedding_function=embeddings, persist_directory=persist_summary_store_dir)
 
-    if CALC_EMBEDDING_TOKENS:
-        encoding = get_encoding(get_model_encoding_string())
+    if count_embedding_tokens:
+        count_tokens = get_embedding_token_counter()
 
-    # Prepare summary documents for vectorization
-    summary_documents = []
-    for file in file_list:
+    # Prepare summary documents for vectorization and add them to the vector store in chunks
+    summary_chunk = []
+    for file in tqdm(file_list):
         if not file['summaries']:
             continue
         for summary in file['summaries']:
             document = Document(page_content=summary, metadata={"file": file['file']})
-            summary_documents.append(document)
-            if CALC_EMBEDDING_TOKENS:
-                set_embedding_tokens(get_embedding_tokens() + len(encoding.encode(document.page_content)))
-
-    # Chunk the summary documents and add them to the vector store
-    summary_chunks = [summary_documents[i:i + CHUNK_SIZE] for i in range(0, len(summary_documents), CHUNK_SIZE)]
-    for chunk in tqdm(summary_chunks):
-        vector_store_summaries.add_documents(chunk)
+            summary_chunk.append(document)
+            if count_embedding_tokens:
+                set_embedding_tokens(get_embedding_tokens() + count_tokens(document.page_content))
+            if len(summary_chunk) >= CHUNK_SIZE:
+                vector_store_summaries.add_documents(summary_chunk)
+                summary_chunk = []
+    if summary_chunk:
+        vector_store_summaries.add_documents(summary_chunk)
 
     return vector_store_summaries
 
 
-def initialize_content_vector_db(file_list, directory):
+def initialize_content_vector_db(file_list, directory, share=False):
+    from langchain_chroma import Chroma
+    from langchain_core.documents import Document
+
     store_dir = get_store_dir_from_repository(directory)
 
-    embeddings = get_embeddings()
+    # shared embeddings count the tokens of the texts they embed themselves
+    embeddings = SharedEmbeddings(get_embeddings()) if share else get_embeddings()
+    count_embedding_tokens = CALC_EMBEDDING_TOKENS and not share
     CHUNK_SIZE = 10
 
     # Initialize the content vector store
     persist_contents_store_dir = f"{store_dir}/contents_store"
+    bump_store_version(directory, "contents_store")
     vector_store_contents = Chroma(embedding_function=embeddings, persist_directory=persist_contents_store_dir)
 
-    if CALC_EMBEDDING_TOKENS:
-        encoding = get_encoding(get_model_encoding_string())
+    if count_embedding_tokens:
+        count_tokens = get_embedding_token_counter()
 
-    # Prepare content documents for vectorization
-    content_documents = []
-    for file in file_list:
+    # Prepare content documents for vectorization and add them to the vector store in chunks
+    content_chunk = []
+    for file in tqdm(file_list):
         if file['content'] == '':
             continue
         document = Document(page_content=f"Filename: {file['file']} Content: {file['content']}",
                             metadata={"file": file['file']})
-        content_documents.append(document)
-        if CALC_EMBEDDING_TOKENS:
-            set_embedding_tokens(get_embedding_tokens() + len(encoding.encode(document.page_content)))
-
-    # Chunk the content documents and add them to the vector store
-    content_chunks = [content_documents[i:i + CHUNK_SIZE] for i in range(0, len(content_documents), CHUNK_SIZE)]
-    for chunk in tqdm(content_chunks):
-        vector_store_contents.add_documents(chunk)
+        content_chunk.append(document)
+        if count_embedding_tokens:
+            set_embedding_tokens(get_embedding_tokens() + count_tokens(document.page_content))
+        if len(content_chunk) >= CHUNK_SIZE:
+            vector_store_contents.add_documents(content_chunk)
+            content_chunk = []
+    if content_chunk:
+        vector_store_contents.add_documents(content_chunk)
 
     # Return the initialized vector stores
     return vector_store_contents
 
 
-def init_project(directory, analyze_fn, args):
-    if not any([args.analyse, args.summarize, args.vectorize_content, args.vectorize_summaries]):
+def delete_vector_documents(directory, files, store_names=VECTOR_STORES):
+    """
+    Remove the documents of the given files from the vector stores that exist, before they are added again.
+    """
+    from langchain_chroma import Chroma
+
+    store_dir = get_store_dir_from_repository(directory)
+    files = list(files)
+    for store_name in store_names:
+        if not files or not os.path.isdir(f"{store_dir}/{store_name}"):
+            continue
+        vector_store = Chroma(embedding_function=get_embeddings(), persist_directory=f"{store_dir}/{store_name}")
+        ids = vector_store.get(where={"file": {"$in": files}}, include=[])["ids"]
+        if ids:
+            bump_store_version(directory, store_name)
+            vector_store.delete(ids)
+
+
+def init_project(directory, analyze_fn, args, project=None):
+    if not any([args.analyse, args.summarize, args.vectorize_content, args.vectorize_summaries,
+                getattr(args, "quantize", None)]):
         print(
-            "choose at least one of the following options: --analyse, --summarize, --vectorize-content, --vectorize-summaries")
+            "choose at least one of the following options: --analyse, --summarize, --vectorize-content, --vectorize-summaries, "
+            "--quantize")
         return
 
-    all_files = get_initial_files(directory)
-
+    stages = [stage for stage in ("analyse", "summarize", "vectorize_summaries", "vectorize_content", "quantize")
+              if getattr(args, stage, None)]
+    # the token counters are process-wide, with init --all they include the projects initialized alongside
+    started, tokens = time.time(), (get_input_tokens(), get_output_tokens(), get_embedding_tokens())
+    # before the first write, so an interrupted run invalidates the results of the old index as well
+    bump_index_version(directory)
+    try:
+        initialize_project_stages(directory, analyze_fn, args, project or {})
+    finally:
+        bump_index_version(directory)
+    record_build(directory, started, stages, get_input_tokens() - tokens[0], get_output_tokens() - tokens[1],
+                 get_embedding_tokens() - tokens[2])
+
+
+def initialize_project_stages(directory, analyze_fn, args, project):
+    graph_files = getattr(args, "import_graph", None) or project.get("import_graphs")
     if args.analyse:
-        print("Analyzing directory...")
-        if analyze_fn is None:
-            print("Analysis function not specified for this project.")
-            return
-        import_graph = analyze_fn(directory)
-        print("Analyzing directory done.")
-        print("Storing analysis results...")
-        store_call_analysis_results(directory, import_graph)
-        print("Storing analysis results done.")
-
+        with profile_stage(directory, "analyse"):
+            if graph_files:
+                # the graph computed by the bundler or another tool replaces the analysis
+                print("Importing import graph...")
+                graph_format = getattr(args, "graph_format", None) or project.get("graph_format")
+                path_prefix = getattr(args, "graph_path_prefix", None) or project.get("graph_path_prefix")
+                relation_count = import_graph_files(directory, graph_files, graph_format, path_prefix)
+                print(f"Importing import graph done, {relation_count} imports.")
+            else:
+                print("Analyzing directory...")
+                if analyze_fn is None:
+                    print("Analysis function not specified for this project.")
+                    return
+                import_graph = filter_analysis_results(analyze_fn(directory), project.get("include"),
+                                                       project.get("exclude"))
+                print("Analyzing directory done.")
+                print("Storing analysis results...")
+                store_call_analysis_results(directory, import_graph)
+                store_symbol_analysis_results(directory, import_graph)
+                print("Storing analysis results done.")
+            print("Computing file centrality...")
+            compute_file_centrality(directory)
+            print("Computing file centrality done.")
+
+    share = getattr(args, "share", False) or project.get("share")
     if args.summarize:
-        file_list = load_call_analysis_results(directory)
-        file_list = join_file_lists(file_list, all_files)
-        print("Adding file contents and generating summaries...")
-        file_list = add_file_contents(file_list, directory)
-        print("Adding file contents and generating summaries done.")
-
-    if args.vectorize_content or args.vectorize_summaries:
-        analysis_results = {descr['file']: descr for descr in load_call_analysis_results(directory)}
-        summary_results = {descr['file']: descr for descr in load_summaries(directory)}
-        file_list = [{**analysis_results.get(id, {'calls': [], 'called_by': []}), **summaries} for id, summaries in
-                     summary_results.items()]
+        with profile_stage(directory, "summarize"):
+            file_list = load_call_analysis_results(directory)
+            file_list = join_file_lists(file_list, iter_initial_files(directory, project.get("include"),
+                                                                     project.get("exclude")),
+                                        project.get("include"), project.get("exclude"))
+            deduplicate = getattr(args, "dedup", False) or project.get("deduplicate")
+            if not deduplicate:
+                # the links of an earlier run with deduplication are stale
+                store_duplicates(directory, {})
+            print("Adding file contents and generating summaries...")
+            add_file_contents(file_list, directory,
+                              chunk_size=project.get("chunk_size") or SUMMARY_CHUNK_SIZE,
+                              chunk_overlap=project.get("chunk_overlap") or SUMMARY_CHUNK_OVERLAP,
+                              workers=project.get("concurrency"), resume=getattr(args, "resume", False),
+                              pack=getattr(args, "pack", False) or project.get("pack_small_files"),
+                              deduplicate=deduplicate, share=share)
+            print("Adding file contents and generating summaries done.")
+        with profile_stage(directory, "directory_summaries"):
+            print("Generating directory summaries...")
+            build_directory_summaries(directory, workers=project.get("concurrency"))
+            initialize_directory_vector_db(directory)
+            print("Generating directory summaries done.")
 
     if args.vectorize_summaries:
-        print("Initializing summary vector database...")
-        initialize_summary_vector_db(file_list, directory)
-        print("Initializing summary vector database done.")
+        with profile_stage(directory, "vectorize_summaries"):
+            print("Initializing summary vector database...")
+            initialize_summary_vector_db(iter_summaries(directory), directory, share=share)
+            print("Initializing summary vector database done.")
     if args.vectorize_content:
-        print("Initializing content vector database...")
-        initialize_content_vector_db(file_list, directory)
-        print("Initializing content vector database done.")
+        with profile_stage(directory, "vectorize_content"):
+            print("Initializing content vector database...")
+            initialize_content_vector_db(iter_summaries(directory), directory, share=share)
+            print("Initializing content vector database done.")
+
+    quantization = getattr(args, "quantize", None) or project.get("quantize")
+    if quantization:
+        with profile_stage(directory, "quantize"):
+            print(f"Quantizing vectors to {quantization}...")
+            for store_name in VECTOR_STORES:
+                build_quantized_index(directory, store_name, quantization)
+            print(f"Quantizing vectors to {quantization} done.")
+    elif args.vectorize_summaries or args.vectorize_content:
+        # the indexes of an earlier run with --quantize follow the stores
+        rebuild_quantized_indexes(directory)
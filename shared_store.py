@@ -0,0 +1,132 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from array import array
+
+from backends import EMBEDDING_STAGE, get_stage_config, get_embedding_token_counter
+from metrics import record_metric
+from storage import get_read_connection, iter_batches
+from utils import get_content_hash, get_embedding_tokens, set_embedding_tokens
+
+# next to the stores of the projects, shared by all of them. The projects keep full copies of the shared
+# summaries and vectors in their own stores, sharing saves the LLM and embedding calls, not disk space
+SHARED_STORE_DIR = "./data/_shared"
+SHARED_STORE_TIMEOUT = 30
+
+
+def get_shared_store_path():
+    os.makedirs(SHARED_STORE_DIR, exist_ok=True)
+    return os.path.join(SHARED_STORE_DIR, "shared_store.db")
+
+
+def connect_shared_store():
+    # the projects of init --all write at the same time, they wait for each other's transactions
+    conn = sqlite3.connect(get_shared_store_path(), timeout=SHARED_STORE_TIMEOUT)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS shared_summaries (
+        content_hash TEXT NOT NULL,
+        summary_key TEXT NOT NULL,
+        summaries TEXT NOT NULL,
+        created REAL NOT NULL,
+        PRIMARY KEY (content_hash, summary_key)
+    ) WITHOUT ROWID
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS shared_embeddings (
+        text_hash TEXT NOT NULL,
+        embedding_key TEXT NOT NULL,
+        embedding BLOB NOT NULL,
+        PRIMARY KEY (text_hash, embedding_key)
+    ) WITHOUT ROWID
+    """)
+    conn.commit()
+    return conn
+
+
+def get_stage_key(stage, **options):
+    """
+    Returns:
+        str: The backend and model of a stage, and the options that change its results.
+    """
+    config = get_stage_config(stage)
+    config.pop("concurrency", None)
+    return json.dumps({**config, **options}, sort_keys=True)
+
+
+def get_summary_key(chunk_size, chunk_overlap):
+    return get_stage_key("summary", chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+
+
+def lookup_shared_summaries(content_hash, summary_key):
+    """
+    Returns:
+        list: The summaries of a content generated by any project with the same model and chunking, or None.
+    """
+    connection = get_read_connection(get_shared_store_path())
+    if connection is None:
+        return None
+    rows = connection.execute("SELECT summaries FROM shared_summaries WHERE content_hash = ? AND summary_key = ?",
+                              (content_hash, summary_key))
+    return json.loads(rows[0][0]) if rows else None
+
+
+def insert_shared_summaries(conn, results, summary_key):
+    conn.executemany(
+        """
+        INSERT OR REPLACE INTO shared_summaries (content_hash, summary_key, summaries, created)
+        VALUES (?, ?, ?, ?)
+        """,
+        [(get_content_hash(result["content"]), summary_key, json.dumps(result["summaries"]), time.time())
+         for result in results if result["summaries"]]
+    )
+
+
+def get_text_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class SharedEmbeddings:
+    """
+    Embeddings looked up in the shared store by the hash of the text, only the missing texts are embedded.
+
+    The embedding tokens are counted for the embedded texts only. Queries are embedded as usual.
+    """
+
+    def __init__(self, embeddings):
+        self.embeddings = embeddings
+        self.embedding_key = get_stage_key(EMBEDDING_STAGE)
+
+    def embed_documents(self, texts):
+        text_hashes = [get_text_hash(text) for text in texts]
+        found = {}
+        connection = get_read_connection(get_shared_store_path())
+        if connection is not None:
+            for batch in iter_batches(list(set(text_hashes))):
+                found.update(connection.execute(
+                    f"""
+                    SELECT text_hash, embedding FROM shared_embeddings
+                    WHERE embedding_key = ? AND text_hash IN ({",".join("?" * len(batch))})
+                    """, [self.embedding_key] + batch))
+        vectors = {text_hash: list(array("f", blob)) for text_hash, blob in found.items()}
+
+        missing = [i for i, text_hash in enumerate(text_hashes) if text_hash not in vectors]
+        if missing:
+            embedded = self.embeddings.embed_documents([texts[i] for i in missing])
+            count_tokens = get_embedding_token_counter()
+            set_embedding_tokens(get_embedding_tokens() + sum(count_tokens(texts[i]) for i in missing))
+            conn = connect_shared_store()
+            with conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO shared_embeddings (text_hash, embedding_key, embedding) VALUES (?, ?, ?)",
+                    [(text_hashes[i], self.embedding_key, array("f", vector).tobytes())
+                     for i, vector in zip(missing, embedded)])
+            conn.close()
+            vectors.update((text_hashes[i], list(vector)) for i, vector in zip(missing, embedded))
+        record_metric("shared_embedding_hits", len(texts) - len(missing))
+        return [vectors[text_hash] for text_hash in text_hashes]
+
+    def embed_query(self, text):
+        return self.embeddings.embed_query(text)
@@ -0,0 +1,190 @@
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import tarfile
+import tempfile
+import time
+
+from backends import EMBEDDING_STAGE
+from quantized_index import QUANTIZED_INDEX_SUFFIX, STORE_VERSION_SUFFIX
+from shared_store import get_stage_key
+from storage import close_read_connections
+from utils import get_store_dir_from_repository, bump_index_version, VECTOR_STORES
+
+SNAPSHOT_FORMAT = "repository-index-snapshot"
+SNAPSHOT_VERSION = 1
+SNAPSHOT_MANIFEST = "snapshot.json"
+# the stores built by init, the query log and the query cache belong to the machine that ran the queries
+SNAPSHOT_STORES = ("call_analysis.db", "summaries.db", "manifest.db", "directory_store") + VECTOR_STORES
+# the quantized indexes and the versions of the stores they were built from
+SNAPSHOT_SUFFIXES = (QUANTIZED_INDEX_SUFFIX, STORE_VERSION_SUFFIX)
+SQLITE_SUFFIXES = (".db", ".sqlite3")
+COPY_BUFFER_SIZE = 1024 * 1024
+
+
+def iter_store_files(store_dir):
+    """
+    Yields:
+        str: The paths of the exported files, relative to the store directory.
+    """
+    for name in sorted(os.listdir(store_dir)):
+        path = os.path.join(store_dir, name)
+        if name in SNAPSHOT_STORES and os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                for file in sorted(files):
+                    if not file.endswith(("-wal", "-shm", "-journal")):
+                        yield os.path.relpath(os.path.join(root, file), store_dir)
+        elif name in SNAPSHOT_STORES or name.endswith(SNAPSHOT_SUFFIXES):
+            yield name
+
+
+def copy_consistent(source, target):
+    # databases are copied with the backup API, a copy of the file could miss the pages still in the WAL
+    if source.endswith(SQLITE_SUFFIXES):
+        source_conn = sqlite3.connect(f"file:{source}?mode=ro", uri=True)
+        target_conn = sqlite3.connect(target)
+        with target_conn:
+            source_conn.backup(target_conn)
+        target_conn.execute("PRAGMA journal_mode=DELETE")
+        source_conn.close()
+        target_conn.close()
+    else:
+        shutil.copyfile(source, target)
+
+
+def get_file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(COPY_BUFFER_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def export_snapshot(directory, output, project_id=None):
+    """
+    Pack the stores of a project into one compressed archive, for ``import_snapshot`` on another machine.
+
+    The archive starts with snapshot.json, which holds the format version, the backends the index was
+    built with and the SHA-256 of every file. All stored paths are relative to the project directory,
+    so the archive can be imported for a checkout in any location.
+
+    Returns:
+        int: The number of archived files.
+    """
+    store_dir = get_store_dir_from_repository(directory)
+    files = list(iter_store_files(store_dir))
+    if not files:
+        raise ValueError(f"Nothing to export in {store_dir}, run init first.")
+
+    with tempfile.TemporaryDirectory(prefix="snapshot-") as staging:
+        checksums = {}
+        for file in files:
+            os.makedirs(os.path.join(staging, os.path.dirname(file)), exist_ok=True)
+            copy_consistent(os.path.join(store_dir, file), os.path.join(staging, file))
+            checksums[file] = get_file_hash(os.path.join(staging, file))
+
+        snapshot = {"format": SNAPSHOT_FORMAT, "version": SNAPSHOT_VERSION, "created": time.time(),
+                    "project": project_id or os.path.basename(store_dir),
+                    "embeddings": get_stage_key(EMBEDDING_STAGE), "summary": get_stage_key("summary"),
+                    "files": checksums}
+        with open(os.path.join(staging, SNAPSHOT_MANIFEST), "w") as f:
+            json.dump(snapshot, f, indent=2)
+
+        # written next to the output and renamed, an interrupted export leaves no truncated archive
+        with tarfile.open(f"{output}.tmp", "w:gz") as archive:
+            for name in [SNAPSHOT_MANIFEST] + files:
+                archive.add(os.path.join(staging, name), arcname=name, recursive=False)
+        os.replace(f"{output}.tmp", output)
+    return len(files)
+
+
+def read_snapshot_manifest(archive, member):
+    if member is None or member.name != SNAPSHOT_MANIFEST:
+        raise ValueError(f"Not an index snapshot, {SNAPSHOT_MANIFEST} is missing.")
+    snapshot = json.load(archive.extractfile(member))
+    if snapshot.get("format") != SNAPSHOT_FORMAT:
+        raise ValueError("Not an index snapshot.")
+    if snapshot.get("version") != SNAPSHOT_VERSION:
+        raise ValueError(f"Unsupported snapshot version {snapshot.get('version')}, expected {SNAPSHOT_VERSION}.")
+    for name in snapshot["files"]:
+        if os.path.isabs(name) or name != os.path.normpath(name) or name.split(os.sep)[0] == os.pardir:
+            raise ValueError(f"Invalid path {name} in the snapshot.")
+    return snapshot
+
+
+def extract_member(archive, member, target):
+    """
+    Stream a file of the archive to disk, hashing it on the way.
+
+    Returns:
+        str: The SHA-256 of the file.
+    """
+    digest = hashlib.sha256()
+    source = archive.extractfile(member)
+    with open(target, "wb") as f:
+        for block in iter(lambda: source.read(COPY_BUFFER_SIZE), b""):
+            digest.update(block)
+            f.write(block)
+    return digest.hexdigest()
+
+
+def import_snapshot(directory, path, force=False):
+    """
+    Replace the stores of a project with the contents of a snapshot made by ``export_snapshot``.
+
+    The archive is read in one pass, every file is verified against its checksum before any store is
+    replaced, so a corrupt or truncated archive leaves the current stores untouched. Nothing is embedded
+    again; the snapshot is refused if its embedding backend differs from the project's, since queries
+    embedded with another model cannot be compared to its vectors, unless ``force`` is given.
+
+    Returns:
+        dict: The manifest of the imported snapshot.
+    """
+    store_dir = get_store_dir_from_repository(directory)
+    staging = tempfile.mkdtemp(prefix=".import-", dir=os.path.dirname(os.path.abspath(store_dir)))
+    try:
+        with tarfile.open(path, "r|gz") as archive:
+            manifest_member = archive.next()
+            snapshot = read_snapshot_manifest(archive, manifest_member)
+            if snapshot["embeddings"] != get_stage_key(EMBEDDING_STAGE) and not force:
+                raise ValueError(f"The snapshot was embedded with {snapshot['embeddings']}, the project uses "
+                                 f"{get_stage_key(EMBEDDING_STAGE)}. Use --force to import it anyway.")
+            checksums = snapshot["files"]
+            extracted = set()
+            for member in archive:
+                if member is manifest_member:
+                    continue
+                name = os.path.normpath(member.name)
+                # only the listed regular files, nothing outside the store directory
+                if not member.isfile() or name not in checksums or name in extracted:
+                    raise ValueError(f"Unexpected entry {member.name} in the snapshot.")
+                target = os.path.join(staging, name)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                if extract_member(archive, member, target) != checksums[name]:
+                    raise ValueError(f"Checksum mismatch for {name}, the snapshot is corrupt.")
+                extracted.add(name)
+        missing = set(checksums) - extracted
+        if missing:
+            raise ValueError(f"The snapshot is incomplete, {len(missing)} files are missing.")
+
+        # the pooled read connections would keep reading the replaced databases
+        close_read_connections()
+        # the WAL of a replaced database would be applied to the imported one
+        replaced = {f"{name}{suffix}" for name in SNAPSHOT_STORES for suffix in ("", "-wal", "-shm")}
+        for name in os.listdir(store_dir):
+            if name in replaced or name.endswith(SNAPSHOT_SUFFIXES):
+                target = os.path.join(store_dir, name)
+                if os.path.isdir(target):
+                    shutil.rmtree(target)
+                else:
+                    os.remove(target)
+        for name in os.listdir(staging):
+            os.replace(os.path.join(staging, name), os.path.join(store_dir, name))
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+    # cached query results were computed from the replaced index
+    bump_index_version(directory)
+    return snapshot
@@ -0,0 +1,138 @@
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+SQLITE_MAX_PARAMETERS = 500
+SUMMARY_CACHE_SIZE = 4096
+
+_connections = {}
+_connections_lock = threading.Lock()
+
+_summary_cache = OrderedDict()
+_summary_cache_lock = threading.Lock()
+
+
+class ReadConnection:
+    """A shared read-only connection to one SQLite store, serialised by a lock."""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.lock = threading.RLock()
+        # autocommit, an implicit transaction around the temp table writes would pin an old snapshot
+        self.conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, check_same_thread=False,
+                                    isolation_level=None)
+
+    def execute(self, sql, params=()):
+        with self.lock:
+            return self.conn.execute(sql, params).fetchall()
+
+
+def get_read_connection(db_path):
+    """
+    Return the pooled read-only connection for the given database, opening it on first use.
+
+    Returns:
+        ReadConnection: The shared connection, or None if the database does not exist yet.
+    """
+    db_path = os.path.abspath(db_path)
+    with _connections_lock:
+        connection = _connections.get(db_path)
+        if connection is None:
+            if not os.path.isfile(db_path):
+                return None
+            connection = ReadConnection(db_path)
+            _connections[db_path] = connection
+        return connection
+
+
+def close_read_connections():
+    with _connections_lock:
+        for connection in _connections.values():
+            with connection.lock:
+                connection.conn.close()
+        _connections.clear()
+
+
+def iter_batches(items, size=SQLITE_MAX_PARAMETERS):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def select_by_files(connection, sql, files):
+    """
+    Run a query that filters on a list of files, given as ``{files}`` placeholder in ``sql``.
+
+    Small lists are inlined as ``IN (...)`` parameters, large lists go through a temporary table,
+    so the whole lookup is one statement either way.
+    """
+    files = list(files)
+    if not files:
+        return []
+    if len(files) <= SQLITE_MAX_PARAMETERS:
+        return connection.execute(sql.format(files=",".join("?" * len(files))), files)
+
+    with connection.lock:
+        cursor = connection.conn.cursor()
+        # no column type, so integer ids keep comparing as integers
+        cursor.execute("CREATE TEMP TABLE IF NOT EXISTS lookup_files (file PRIMARY KEY)")
+        cursor.execute("DELETE FROM lookup_files")
+        cursor.executemany("INSERT OR IGNORE INTO lookup_files (file) VALUES (?)", [(file,) for file in files])
+        rows = cursor.execute(sql.format(files="SELECT file FROM lookup_files")).fetchall()
+        cursor.execute("DELETE FROM lookup_files")
+        return rows
+
+
+def get_cached_summaries(store_dir, files):
+    """
+    Look up the chunk summaries of the given files, first in the in-process LRU, then in summaries.db.
+
+    Returns:
+        dict: Mapping of file to its list of chunk summaries. Files without summaries are left out.
+    """
+    summaries = {}
+    missing = []
+    with _summary_cache_lock:
+        for file in files:
+            key = (store_dir, file)
+            if key in _summary_cache:
+                _summary_cache.move_to_end(key)
+                if _summary_cache[key]:
+                    summaries[file] = _summary_cache[key]
+            else:
+                missing.append(file)
+
+    if not missing:
+        return summaries
+
+    connection = get_read_connection(f"{store_dir}/summaries.db")
+    loaded = {file: [] for file in missing}
+    if connection is not None:
+        rows = select_by_files(connection, """
+            SELECT f.file, s.summary FROM summaries s
+            JOIN files f ON f.id = s.file_id
+            WHERE f.file IN ({files})
+            ORDER BY s.file_id, s.chunk_index
+            """, missing)
+        for file, summary in rows:
+            loaded[file].append(summary)
+
+    with _summary_cache_lock:
+        for file, summary_list in loaded.items():
+            _summary_cache[(store_dir, file)] = summary_list
+        while len(_summary_cache) > SUMMARY_CACHE_SIZE:
+            _summary_cache.popitem(last=False)
+
+    summaries.update({file: summary_list for file, summary_list in loaded.items() if summary_list})
+    # keep the order the files were requested in
+    return {file: summaries[file] for file in dict.fromkeys(files) if file in summaries}
+
+
+def invalidate_cached_summaries(store_dir, files=None):
+    with _summary_cache_lock:
+        if files is None:
+            for key in [key for key in _summary_cache if key[0] == store_dir]:
+                del _summary_cache[key]
+        else:
+            for file in files:
+                _summary_cache.pop((store_dir, file), None)
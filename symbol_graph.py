@@ -0,0 +1,242 @@
+import os
+import re
+import sqlite3
+
+from storage import get_read_connection, iter_batches, select_by_files
+from utils import get_store_dir_from_repository
+
+MAX_MATCHED_SYMBOLS = 20
+MAX_REFERENCED_FILES = 20
+MIN_WORD_LENGTH = 3
+
+WORD_PATTERN = re.compile(r'[A-Z]?[a-z]+|[A-Z]+(?![a-z])|\d+')
+
+
+def create_symbol_tables(cursor):
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS symbols (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        file_id INTEGER NOT NULL,
+        name TEXT NOT NULL,
+        kind TEXT NOT NULL,
+        start_line INTEGER NOT NULL,
+        end_line INTEGER NOT NULL,
+        exported INTEGER NOT NULL,
+        default_export INTEGER NOT NULL DEFAULT 0,
+        UNIQUE (file_id, name),
+        FOREIGN KEY (file_id) REFERENCES files(id) ON DELETE CASCADE
+    );
+    ''')
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS symbol_relations (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        caller_file_id INTEGER NOT NULL,
+        caller_symbol_id INTEGER,
+        called_symbol_id INTEGER NOT NULL,
+        line INTEGER NOT NULL,
+        FOREIGN KEY (caller_file_id) REFERENCES files(id) ON DELETE CASCADE,
+        FOREIGN KEY (caller_symbol_id) REFERENCES symbols(id) ON DELETE CASCADE,
+        FOREIGN KEY (called_symbol_id) REFERENCES symbols(id) ON DELETE CASCADE
+    );
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_symbols_name ON symbols (name);')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_symbol_relations_called ON symbol_relations (called_symbol_id);')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_symbol_relations_caller ON symbol_relations (caller_symbol_id);')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_symbol_relations_caller_file '
+                   'ON symbol_relations (caller_file_id);')
+
+
+def store_symbol_analysis_results(repo_dir, files):
+    """
+    Store the symbol tables and symbol references produced by the analyzers.
+
+    Symbols and references of the given files replace the stored ones. References to symbols that
+    were not found in the referenced file are dropped.
+
+    Args:
+        repo_dir (str): Path to the analysed repository.
+        files (list): Analyzer results with "symbols" and "references" per file.
+    """
+    store_dir = get_store_dir_from_repository(repo_dir)
+    conn = sqlite3.connect(f"{store_dir}/call_analysis.db")
+    cursor = conn.cursor()
+    create_symbol_tables(cursor)
+
+    files = [file for file in files if 'symbols' in file]
+    cursor.executemany('INSERT OR IGNORE INTO files (file_name) VALUES (?);', [(file['file'],) for file in files])
+    # the analyzers key root level files as ./helpers.py but resolve imports to helpers.py, references
+    # join the stored file of the same normalised path, preferring the files that have symbols
+    stored_names = {}
+    for query in ('SELECT file_name FROM files;',
+                  'SELECT DISTINCT f.file_name FROM files f JOIN symbols s ON s.file_id = f.id;'):
+        stored_names.update((os.path.normpath(file_name), file_name) for file_name, in cursor.execute(query))
+    stored_names.update((os.path.normpath(file['file']), file['file']) for file in files)
+
+    def stored_name(file_name):
+        return stored_names.get(os.path.normpath(file_name), file_name)
+
+    referenced_files = {stored_name(reference['file']) for file in files for reference in file.get('references', [])}
+    cursor.executemany('INSERT OR IGNORE INTO files (file_name) VALUES (?);',
+                       [(file_name,) for file_name in referenced_files])
+
+    file_ids = {}
+    for batch in iter_batches(list({file['file'] for file in files} | referenced_files)):
+        cursor.execute(f'SELECT file_name, id FROM files WHERE file_name IN ({",".join("?" * len(batch))});', batch)
+        file_ids.update(cursor.fetchall())
+
+    stored_ids = [(file_ids[file['file']],) for file in files]
+    cursor.executemany('DELETE FROM symbol_relations WHERE caller_file_id = ?;', stored_ids)
+    cursor.executemany('''
+        DELETE FROM symbol_relations WHERE called_symbol_id IN (SELECT id FROM symbols WHERE file_id = ?);
+        ''', stored_ids)
+    cursor.executemany('DELETE FROM symbols WHERE file_id = ?;', stored_ids)
+
+    cursor.executemany('''
+        INSERT OR IGNORE INTO symbols (file_id, name, kind, start_line, end_line, exported, default_export)
+        VALUES (?, ?, ?, ?, ?, ?, ?);
+        ''', [
+        (file_ids[file['file']], symbol['name'], symbol['kind'], symbol['start_line'], symbol['end_line'],
+         int(symbol['exported']), int(symbol.get('default_export', False)))
+        for file in files for symbol in file['symbols']
+    ])
+
+    symbol_ids = {}
+    default_exports = {}
+    for batch in iter_batches(list(set(file_ids.values()))):
+        cursor.execute(f'''
+            SELECT file_id, name, id, default_export FROM symbols
+            WHERE file_id IN ({",".join("?" * len(batch))});
+            ''', batch)
+        for file_id, name, symbol_id, default_export in cursor.fetchall():
+            symbol_ids[(file_id, name)] = symbol_id
+            if default_export:
+                default_exports[file_id] = symbol_id
+
+    relations = []
+    for file in files:
+        caller_file_id = file_ids[file['file']]
+        for reference in file.get('references', []):
+            called_file_id = file_ids[stored_name(reference['file'])]
+            called_symbol_id = symbol_ids.get((called_file_id, reference['symbol']))
+            if called_symbol_id is None and reference['symbol'] == 'default':
+                called_symbol_id = default_exports.get(called_file_id)
+            if called_symbol_id is None:
+                continue
+            caller_symbol_id = symbol_ids.get((caller_file_id, reference['from_symbol']))
+            relations.append((caller_file_id, caller_symbol_id, called_symbol_id, reference['line']))
+    cursor.executemany('''
+        INSERT INTO symbol_relations (caller_file_id, caller_symbol_id, called_symbol_id, line)
+        VALUES (?, ?, ?, ?);
+        ''', relations)
+
+    conn.commit()
+    conn.close()
+
+
+def split_words(text):
+    return {word.lower() for word in WORD_PATTERN.findall(text) if len(word) >= MIN_WORD_LENGTH}
+
+
+def _get_symbol_connection(repo_dir):
+    connection = get_read_connection(f"{get_store_dir_from_repository(repo_dir)}/call_analysis.db")
+    if connection is None or not connection.execute(
+            "SELECT name FROM sqlite_master WHERE type='table' AND name='symbols';"):
+        return None
+    return connection
+
+
+def match_symbols(repo_dir, files, query, limit=MAX_MATCHED_SYMBOLS):
+    """
+    Find the symbols of the given files whose name shares words with the query.
+
+    Names are split at camel case and underscores, so ``getAudioTrack`` matches "audio track".
+
+    Returns:
+        list: Dictionaries with id, file, name, start_line and end_line, best match first.
+    """
+    connection = _get_symbol_connection(repo_dir)
+    if connection is None:
+        return []
+
+    query_words = split_words(query)
+    rows = select_by_files(connection, '''
+        SELECT s.id, f.file_name, s.name, s.start_line, s.end_line FROM symbols s
+        JOIN files f ON f.id = s.file_id
+        WHERE f.file_name IN ({files})
+        ''', files)
+
+    matches = []
+    for symbol_id, file_name, name, start_line, end_line in rows:
+        name_words = split_words(name)
+        if not name_words:
+            continue
+        score = len(name_words & query_words) / len(name_words)
+        if score > 0:
+            matches.append((score, {"id": symbol_id, "file": file_name, "name": name,
+                                    "start_line": start_line, "end_line": end_line}))
+    matches.sort(key=lambda match: match[0], reverse=True)
+    return [symbol for _, symbol in matches[:limit]]
+
+
+def expand_symbol_references(repo_dir, symbol_ids, max_files=MAX_REFERENCED_FILES):
+    """
+    Follow the symbol reference edges of the given symbols in both directions.
+
+    Returns:
+        dict: Mapping of each referencing or referenced file to the line ranges of the symbols involved.
+            References from module level code are given as the single referencing line.
+    """
+    connection = _get_symbol_connection(repo_dir)
+    symbol_ids = list(symbol_ids)
+    if connection is None or not symbol_ids:
+        return {}
+
+    ranges = {}
+
+    def add_range(file_name, start_line, end_line):
+        if file_name not in ranges and len(ranges) >= max_files:
+            return
+        ranges.setdefault(file_name, set()).add((start_line, end_line))
+
+    for batch in iter_batches(symbol_ids):
+        placeholders = ",".join("?" * len(batch))
+        # files that use the matched symbols
+        for file_name, start_line, end_line, line in connection.execute(f'''
+                SELECT f.file_name, s.start_line, s.end_line, r.line FROM symbol_relations r
+                JOIN files f ON f.id = r.caller_file_id
+                LEFT JOIN symbols s ON s.id = r.caller_symbol_id
+                WHERE r.called_symbol_id IN ({placeholders})
+                ORDER BY r.id
+                ''', batch):
+            add_range(file_name, start_line or line, end_line or line)
+        # symbols the matched symbols use
+        for file_name, start_line, end_line in connection.execute(f'''
+                SELECT f.file_name, s.start_line, s.end_line FROM symbol_relations r
+                JOIN symbols s ON s.id = r.called_symbol_id
+                JOIN files f ON f.id = s.file_id
+                WHERE r.caller_symbol_id IN ({placeholders})
+                ORDER BY r.id
+                ''', batch):
+            add_range(file_name, start_line, end_line)
+
+    return {file_name: merge_line_ranges(file_ranges) for file_name, file_ranges in ranges.items()}
+
+
+def merge_line_ranges(ranges):
+    merged = []
+    for start_line, end_line in sorted(ranges):
+        if merged and start_line <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end_line))
+        else:
+            merged.append((start_line, end_line))
+    return merged
+
+
+def read_line_ranges(directory, file, ranges):
+    with open(os.path.join(directory, file), 'r') as f:
+        lines = f.read().splitlines()
+    return "\n".join(
+        f"lines {start_line}-{end_line}:\n" + "\n".join(lines[start_line - 1:end_line])
+        for start_line, end_line in ranges
+    )
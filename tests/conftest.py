@@ -0,0 +1,75 @@
+import argparse
+
+import pytest
+
+import utils
+from backends import use_project_backends
+from quantized_index import clear_loaded_indexes
+from storage import close_read_connections, invalidate_cached_summaries
+from utils import use_project_store
+
+FAKE_BACKENDS = {"all": {"backend": "fake"}, "embeddings": {"backend": "fake"}}
+SAMPLE_FILES = {
+    "audio/player.py": "def play_audio(stream):\n    return decode_audio_stream(stream)\n",
+    "config/loader.py": "def load_config(path):\n    return parse_config_file(path)\n",
+    "main.py": "from config.loader import load_config\n\n\ndef main():\n    return load_config('settings.toml')\n",
+}
+
+
+@pytest.fixture
+def repository(tmp_path, monkeypatch):
+    """
+    An empty project directory with the fake backends, its store is created in the temporary directory.
+    """
+    monkeypatch.chdir(tmp_path)
+    directory = tmp_path / "repository"
+    directory.mkdir()
+    use_project_store(str(directory), "test")
+    use_project_backends(FAKE_BACKENDS)
+    yield directory
+    close_read_connections()
+    invalidate_cached_summaries("./data/test")
+    clear_loaded_indexes()
+    # the tests run in one context, the next test starts without project
+    use_project_backends()
+    utils._project_store.set((None, None))
+    # Chroma caches its clients by the relative store path, which points to another directory in the next test
+    try:
+        from chromadb.api.client import SharedSystemClient
+    except ImportError:
+        return
+    SharedSystemClient.clear_system_cache()
+
+
+@pytest.fixture
+def indexed_repository(repository):
+    """
+    The sample files, analysed, summarised and vectorized with the fake backends.
+    """
+    from analyzer_py import analyze_directory
+    from setup_repository import init_project
+
+    write_files(repository, SAMPLE_FILES)
+    init_project(str(repository), analyze_directory, init_args())
+    return repository
+
+
+def init_args(**options):
+    defaults = {"analyse": True, "summarize": True, "vectorize_summaries": True, "vectorize_content": True,
+                "quantize": None}
+    return argparse.Namespace(**{**defaults, **options})
+
+
+def query_args(query, **options):
+    defaults = {"query": query, "adaptive": False, "cache": False, "cache_threshold": 0.95,
+                "cache_refresh_summary": False, "subtrees": False, "subtree_limit": 3, "adjacent": False,
+                "adjacent_hops": 2, "adjacent_limit": 20, "symbols": False, "find_missing": False,
+                "filter_files": False}
+    return argparse.Namespace(**{**defaults, **options})
+
+
+def write_files(directory, files):
+    for name, content in files.items():
+        path = directory / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(content)
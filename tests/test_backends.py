@@ -0,0 +1,51 @@
+import contextvars
+
+import pytest
+
+from backends import configure_backends, get_embeddings, get_llm_query_result, get_stage_config, \
+    parse_backend_option, use_project_backends, FAKE_EMBEDDING_DIMENSIONS
+
+
+def test_parse_backend_option():
+    assert parse_backend_option("summary=ollama:llama3.1:8B") == {"summary": {"backend": "ollama",
+                                                                              "model": "llama3.1:8B"}}
+    assert parse_backend_option("all=fake") == {"all": {"backend": "fake"}}
+    with pytest.raises(ValueError):
+        parse_backend_option("summary")
+
+
+def test_unknown_stage_and_backend_are_rejected():
+    with pytest.raises(ValueError, match="Unknown stage"):
+        configure_backends({"summarise": {"backend": "fake"}})
+    with pytest.raises(ValueError, match="Unknown backend"):
+        use_project_backends({"summary": {"backend": "missing"}})
+
+
+def test_project_backends_only_apply_to_their_context():
+    def project():
+        use_project_backends({"all": {"backend": "fake", "model": "small"}}, {"final": {"model": "large"}})
+        return get_stage_config("summary"), get_stage_config("final")
+
+    summary, final = contextvars.copy_context().run(project)
+    assert (summary["backend"], summary["model"]) == ("fake", "small")
+    assert (final["backend"], final["model"]) == ("fake", "large")
+    # the concurrency limits are shared by all projects
+    assert summary["concurrency"] == get_stage_config("summary")["concurrency"]
+    assert get_stage_config("summary")["backend"] != "fake"
+
+
+def test_fake_backends_are_deterministic(repository):
+    first = get_llm_query_result("Summarise def parse_config(path): return path", "summary")
+    assert first == get_llm_query_result("Summarise def parse_config(path): return path", "summary")
+    assert "parse_config" in first
+
+    embeddings = get_embeddings()
+    config, audio, query = embeddings.embed_documents(["parse the config file", "play the audio stream",
+                                                       "config file parser"])
+    assert len(config) == FAKE_EMBEDDING_DIMENSIONS
+    assert embeddings.embed_query("parse the config file") == config
+
+    def distance(a, b):
+        return sum((x - y) ** 2 for x, y in zip(a, b))
+
+    assert distance(query, config) < distance(query, audio)
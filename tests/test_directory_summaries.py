@@ -0,0 +1,29 @@
+import pytest
+
+from directory_summaries import build_directory_summaries, initialize_directory_vector_db
+from utils import delete_summaries, get_store_dir_from_repository
+
+pytest.importorskip("langchain_chroma")
+
+
+def stored_directories(directory):
+    from langchain_chroma import Chroma
+
+    from backends import get_embeddings
+
+    vector_store = Chroma(embedding_function=get_embeddings(),
+                          persist_directory=f"{get_store_dir_from_repository(directory)}/directory_store")
+    return sorted(metadata["directory"] for metadata in vector_store.get(include=["metadatas"])["metadatas"])
+
+
+def test_only_changed_directories_are_embedded_again(indexed_repository):
+    directory = str(indexed_repository)
+    assert stored_directories(directory) == [".", "audio", "config"]
+    assert initialize_directory_vector_db(directory) == 0
+
+    delete_summaries(directory, ["config/loader.py"])
+    build_directory_summaries(directory)
+
+    # the root lost a child, the roll-up of the removed directory is deleted
+    assert initialize_directory_vector_db(directory) == 1
+    assert stored_directories(directory) == [".", "audio"]
@@ -0,0 +1,49 @@
+import pytest
+
+from file_manifest import (BINARY, GENERATED, MAX_TEXT_FILE_SIZE, MINIFIED, TEXT, TOO_LARGE, classify_by_name,
+                           classify_file, classify_sample)
+
+
+@pytest.mark.parametrize("path, size, verdict", [
+    ("static/vendor/jquery.min.js", 100, MINIFIED),
+    ("static/App.Bundle.JS", 100, MINIFIED),
+    ("static/app.css.map", 100, MINIFIED),
+    ("docs/logo.PNG", 100, BINARY),
+    ("models/weights.npz", 100, BINARY),
+    ("data/dump.sql", MAX_TEXT_FILE_SIZE + 1, TOO_LARGE),
+    ("app/main.py", MAX_TEXT_FILE_SIZE, None),
+    ("static/app.js", 100, None),
+])
+def test_classify_by_name(path, size, verdict):
+    assert classify_by_name(path, size) == verdict
+
+
+@pytest.mark.parametrize("path, sample, verdict", [
+    ("app/main.py", b"def main():\n    return 1\n", TEXT),
+    ("docs/notes.md", "Grüße\n".encode("utf-8"), TEXT),
+    # a multi-byte character cut off by the sample size is still text
+    ("docs/notes.md", "Grüße".encode("utf-8")[:3], TEXT),
+    ("assets/blob", b"ELF\x00\x01\x02", BINARY),
+    ("assets/latin1.txt", b"caf\xe9 au lait\n", BINARY),
+    ("static/vendor/lib.js", b"var a=1;" * 400, MINIFIED),
+    ("static/vendor/lib.css", b".a{color:red}" * 200, MINIFIED),
+    # long lines outside of web assets, or too short a sample, are not minified
+    ("app/table.py", b"x = 1;" * 600, TEXT),
+    ("static/small.js", b"var a=1;" * 100, TEXT),
+    ("static/app.js", b"var a = 1;\n" * 300, TEXT),
+    ("api/schema_pb2.py", b"# -*- coding: utf-8 -*-\n# Generated by the protocol buffer compiler.  DO NOT EDIT!\n",
+     GENERATED),
+    ("app/parser.go", b"// Code generated by goyacc. DO NOT EDIT.\npackage app\n", GENERATED),
+    ("app/late.py", b"#" * 2000 + b"\n# @generated\n", TEXT),
+])
+def test_classify_sample(path, sample, verdict):
+    assert classify_sample(path, sample) == verdict
+
+
+def test_classify_file_checks_the_name_before_the_content(tmp_path):
+    (tmp_path / "lib.min.js").write_text("var a = 1;\n")
+    (tmp_path / "main.py").write_text("print('hello')\n")
+    (tmp_path / "image.dat").write_bytes(b"\x89PNG\r\n\x1a\n\x00\x00")
+    assert classify_file(str(tmp_path / "lib.min.js")) == MINIFIED
+    assert classify_file(str(tmp_path / "main.py")) == TEXT
+    assert classify_file(str(tmp_path / "image.dat")) == BINARY
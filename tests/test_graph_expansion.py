@@ -0,0 +1,57 @@
+import math
+
+import pytest
+
+from graph_expansion import expand_adjacent_files, load_file_centrality
+from utils import store_call_analysis_results
+
+
+def store_imports(repository, imports):
+    store_call_analysis_results(str(repository), [
+        {"file": file, "calls": called, "called_by": []} for file, called in imports.items()
+    ])
+
+
+def test_scores_decay_with_every_hop(repository):
+    store_imports(repository, {"app/a.py": ["app/b.py"], "app/b.py": ["app/c.py"]})
+
+    assert expand_adjacent_files(str(repository), ["app/a.py"], hops=1) == [
+        ("app/b.py", pytest.approx(0.5 / (math.log2(3) * math.log2(4))))]
+
+    scores = dict(expand_adjacent_files(str(repository), ["app/a.py"], hops=2))
+    assert scores["app/c.py"] == pytest.approx(scores["app/b.py"] * 0.5 / (math.log2(4) * math.log2(3)))
+    assert load_file_centrality(str(repository), ["app/b.py"])["app/b.py"]["degree"] == 2
+
+
+def test_hubs_are_down_weighted(repository):
+    imports = {"app/seed.py": ["app/index.py", "app/leaf.py"]}
+    imports.update({f"app/user{i}.py": ["app/index.py"] for i in range(6)})
+    store_imports(repository, imports)
+
+    neighbours = expand_adjacent_files(str(repository), ["app/seed.py"], hops=1)
+    assert [file for file, _ in neighbours] == ["app/leaf.py", "app/index.py"]
+
+    # the users of the hub are two hops away and damped by its degree on the way
+    scores = dict(expand_adjacent_files(str(repository), ["app/seed.py"], hops=2))
+    assert max(scores[f"app/user{i}.py"] for i in range(6)) < scores["app/index.py"] < scores["app/leaf.py"]
+
+
+def test_neighbours_are_capped_best_first(repository):
+    store_imports(repository, {
+        "app/seed.py": ["app/a.py", "app/b.py", "app/c.py"],
+        "app/a.py": ["app/a1.py"],
+        "app/b.py": ["app/b1.py", "app/b2.py"],
+    })
+
+    everything = expand_adjacent_files(str(repository), ["app/seed.py"], hops=2)
+    assert len(everything) == 6
+    assert expand_adjacent_files(str(repository), ["app/seed.py"], hops=2, max_neighbours=2) == everything[:2]
+    assert [file for file, _ in everything[:2]] == ["app/c.py", "app/a.py"]
+
+
+def test_seed_files_are_not_returned(repository):
+    store_imports(repository, {"app/a.py": ["app/b.py", "app/c.py"], "app/b.py": ["app/c.py"]})
+
+    neighbours = expand_adjacent_files(str(repository), ["app/a.py", "app/b.py"])
+    assert [file for file, _ in neighbours] == ["app/c.py"]
+    assert expand_adjacent_files(str(repository), ["app/a.py", "app/b.py", "app/c.py"]) == []
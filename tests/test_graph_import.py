@@ -0,0 +1,16 @@
+import json
+
+from conftest import write_files
+from graph_import import import_graph_files, to_repository_path
+from utils import load_call_analysis_results
+
+
+def test_graph_paths_take_the_form_of_the_pipeline(repository):
+    write_files(repository, {"main.ts": "import './src/app'\n", "src/app.ts": "export const app = 1\n"})
+    graph = repository / "graph.json"
+    graph.write_text(json.dumps({f"{repository}/main.ts": ["src/app.ts", "react"]}))
+
+    assert to_repository_path(str(repository), "main.ts") == "./main.ts"
+    assert import_graph_files(str(repository), [str(graph)]) == 1
+    calls = {file["file"]: file["calls"] for file in load_call_analysis_results(str(repository))}
+    assert calls["./main.ts"] == ["src/app.ts"]
@@ -0,0 +1,36 @@
+import argparse
+import os
+import sqlite3
+
+import pytest
+
+from conftest import SAMPLE_FILES, init_args, write_files
+from index_stats import find_index_drift, query_stats
+
+pytest.importorskip("langchain_chroma")
+
+
+def manifest_files():
+    conn = sqlite3.connect("data/test/manifest.db")
+    files = sorted(file for file, in conn.execute("SELECT file FROM files"))
+    conn.close()
+    return files
+
+
+def test_stats_leave_the_stores_as_they_are(repository):
+    from analyzer_py import analyze_directory
+    from setup_repository import init_project
+
+    directory = str(repository)
+    write_files(repository, {**SAMPLE_FILES, "audio/__init__.py": ""})
+    init_project(directory, analyze_directory, init_args(vectorize_summaries=False, vectorize_content=False))
+    indexed = manifest_files()
+    write_files(repository, {"audio/mixer.py": "def mix(tracks):\n    return sum(tracks)\n"})
+
+    # empty files have no summaries, they are not missing
+    assert find_index_drift(directory, {}, {})["unsummarised"] == ["audio/mixer.py"]
+    query_stats(directory, argparse.Namespace(benchmark=True))
+
+    assert manifest_files() == indexed
+    assert not os.path.exists("data/test/summary_store")
+    assert not os.path.exists("data/test/contents_store")
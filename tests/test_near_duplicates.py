@@ -0,0 +1,96 @@
+import setup_repository
+from conftest import write_files
+from near_duplicates import SIMHASH_MAX_DISTANCE, cluster_duplicates, compute_simhash, hamming_distance
+from utils import get_content_hash, get_duplicate_members, iter_initial_files, iter_summaries, join_file_lists, \
+    store_call_analysis_results
+
+LOADER = '''import json
+import os
+
+
+def load_config(path, defaults=None):
+    """Read the JSON configuration and merge it over the defaults."""
+    config = dict(defaults or {})
+    if not os.path.isfile(path):
+        return config
+    with open(path) as f:
+        config.update(json.load(f))
+    return config
+
+
+def save_config(path, config):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(config, f, indent=2, sort_keys=True)
+
+
+def merge_configs(*configs):
+    merged = {}
+    for config in configs:
+        for key, value in config.items():
+            if isinstance(value, dict) and isinstance(merged.get(key), dict):
+                merged[key] = merge_configs(merged[key], value)
+            else:
+                merged[key] = value
+    return merged
+'''
+LOADER_COPY = LOADER.replace("indent=2", "indent=4")
+PLAYER = '''import wave
+
+
+def play_audio(path, device=None):
+    """Stream a WAV file to the output device frame by frame."""
+    with wave.open(path, "rb") as audio:
+        frames = audio.readframes(audio.getnframes())
+        rate = audio.getframerate()
+    device = device or open_default_device(rate)
+    for offset in range(0, len(frames), 4096):
+        device.write(frames[offset:offset + 4096])
+    device.close()
+'''
+
+
+def record(file, content):
+    return {"file": file, "hash": get_content_hash(content), "simhash": compute_simhash(content)}
+
+
+def test_exact_and_near_copies_join_the_cluster_of_the_first_file():
+    assert hamming_distance(compute_simhash(LOADER), compute_simhash(LOADER_COPY)) <= SIMHASH_MAX_DISTANCE
+
+    files = [record("config/loader.py", LOADER), record("audio/player.py", PLAYER),
+             record("vendor/config/loader.py", LOADER), record("legacy/loader.py", LOADER_COPY),
+             {"file": "unknown.py", "hash": None, "simhash": None}]
+    assert cluster_duplicates(files) == {"vendor/config/loader.py": "config/loader.py",
+                                         "legacy/loader.py": "config/loader.py"}
+    assert cluster_duplicates(files[::-1]) == {"vendor/config/loader.py": "legacy/loader.py",
+                                               "config/loader.py": "legacy/loader.py"}
+
+
+def test_distinct_files_are_not_merged():
+    assert hamming_distance(compute_simhash(LOADER), compute_simhash(PLAYER)) > SIMHASH_MAX_DISTANCE
+    files = [record("config/loader.py", LOADER), record("audio/player.py", PLAYER),
+             # too short for a fingerprint, only exact copies of such files are clustered
+             record("a/__init__.py", "from .a import run\n"), record("b/__init__.py", "from .b import run\n"),
+             record("c/__init__.py", "from .a import run\n")]
+    assert files[2]["simhash"] is None
+    assert cluster_duplicates(files) == {"c/__init__.py": "a/__init__.py"}
+
+
+def test_near_duplicates_share_one_summary(repository):
+    write_files(repository, {"config/loader.py": LOADER, "legacy/loader.py": LOADER_COPY, "audio/player.py": PLAYER})
+    records = list(iter_initial_files(str(repository)))
+    # the imported copy is more central, it represents the cluster
+    analysed = [{"file": file["file"], "calls": ["config/loader.py"] if file["file"] == "audio/player.py" else [],
+                 "called_by": []} for file in records]
+    store_call_analysis_results(str(repository), analysed)
+
+    processed = setup_repository.add_file_contents(join_file_lists(analysed, records), str(repository),
+                                                   workers=1, deduplicate=True)
+
+    assert processed == 2
+    assert sorted(file["file"] for file in iter_summaries(str(repository))) == ["audio/player.py",
+                                                                              "config/loader.py"]
+    assert get_duplicate_members(str(repository), ["config/loader.py", "audio/player.py"]) == \
+        {"config/loader.py": ["legacy/loader.py"]}
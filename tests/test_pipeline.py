@@ -0,0 +1,35 @@
+import sqlite3
+
+import pytest
+
+from conftest import SAMPLE_FILES, init_args, write_files
+
+pytest.importorskip("langchain_chroma")
+
+
+def test_init_and_search_with_fake_backends(indexed_repository):
+    from query_requirement import search_similar_files
+    from utils import load_summary_hashes, load_last_build
+
+    assert set(load_summary_hashes(str(indexed_repository))) == {"audio/player.py", "config/loader.py",
+                                                                 "./main.py"}
+    assert load_last_build(str(indexed_repository))["stages"] == ["analyse", "summarize", "vectorize_summaries",
+                                                                  "vectorize_content"]
+    summary_hits, content_hits = search_similar_files("play the audio stream", str(indexed_repository), k=1)
+    assert summary_hits[0][0] == "audio/player.py"
+    assert content_hits[0][0] == "audio/player.py"
+
+
+def test_excluded_files_are_neither_analysed_nor_summarised(repository):
+    from analyzer_py import analyze_directory
+    from setup_repository import init_project
+    from utils import load_summary_hashes
+
+    write_files(repository, SAMPLE_FILES)
+    init_project(str(repository), analyze_directory, init_args(vectorize_summaries=False, vectorize_content=False),
+                 {"exclude": ["config/*"]})
+
+    assert set(load_summary_hashes(str(repository))) == {"audio/player.py", "./main.py"}
+    conn = sqlite3.connect("data/test/call_analysis.db")
+    assert "config/loader.py" not in {name for name, in conn.execute("SELECT file_name FROM files")}
+    conn.close()
@@ -0,0 +1,28 @@
+import threading
+from contextvars import copy_context
+
+import profiling
+from profiling import configure_profiling, profile_stage
+
+
+def test_concurrent_stages_are_profiled_one_at_a_time(repository, tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling, "_stage_results", [])
+    configure_profiling(str(tmp_path / "profiles"))
+    monkeypatch.setattr(profiling, "_profile_config", profiling._profile_config)
+    # both stages are running before either ends
+    barrier = threading.Barrier(2)
+
+    def run_stage(stage):
+        with profile_stage(str(repository), stage):
+            barrier.wait()
+
+    threads = [threading.Thread(target=copy_context().run, args=(run_stage, stage)) for stage in ("summarize", "vectorize_summaries")]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    results = profiling._stage_results
+    assert sorted(result["stage"] for result in results) == ["summarize", "vectorize_summaries"]
+    assert sum("pstats" in result["files"] for result in results) == 1
+    assert not profiling._cprofile_active
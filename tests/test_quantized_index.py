@@ -0,0 +1,31 @@
+import pytest
+
+import quantized_index
+from quantized_index import build_quantized_index, bump_store_version, search_quantized_index
+
+pytest.importorskip("numpy")
+pytest.importorskip("langchain_chroma")
+
+
+def test_search_opens_the_store_once_and_ignores_outdated_indexes(indexed_repository, monkeypatch):
+    from backends import get_embeddings
+
+    directory = str(indexed_repository)
+    assert build_quantized_index(directory, "summary_store", "int8") == 3
+    quantized_index.clear_loaded_indexes()
+    opened = []
+    open_vector_store = quantized_index._open_vector_store
+
+    def counting_open_vector_store(*args):
+        opened.append(args)
+        return open_vector_store(*args)
+
+    monkeypatch.setattr(quantized_index, "_open_vector_store", counting_open_vector_store)
+    embedding = get_embeddings().embed_query("play the audio stream")
+    for _ in range(2):
+        hits = search_quantized_index(directory, "summary_store", embedding, 2)
+        assert hits[0][0] == "audio/player.py"
+    assert len(opened) == 1
+
+    bump_store_version(directory, "summary_store")
+    assert search_quantized_index(directory, "summary_store", embedding, 2) is None
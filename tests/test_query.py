@@ -0,0 +1,108 @@
+import sqlite3
+
+import pytest
+
+from conftest import query_args
+
+pytest.importorskip("langchain_chroma")
+
+
+@pytest.fixture
+def searches(monkeypatch):
+    """
+    The queries and precomputed embeddings of the similarity searches of a test.
+    """
+    import query_requirement
+
+    calls = []
+    search_similar_files = query_requirement.search_similar_files
+
+    def counting_search(query, directory, **options):
+        calls.append((query, options.get("embedding") is not None))
+        return search_similar_files(query, directory, **options)
+
+    monkeypatch.setattr(query_requirement, "search_similar_files", counting_search)
+    return calls
+
+
+def logged_stages():
+    conn = sqlite3.connect("data/test/query_log.db")
+    stages = conn.execute("SELECT stage, skipped FROM stage_decisions ORDER BY id").fetchall()
+    conn.close()
+    return stages
+
+
+def test_adaptive_mode_searches_once_and_keeps_the_similarity_query(indexed_repository, searches):
+    from query_requirement import query_project
+
+    # --find-missing searches again for the files the LLM names, it is left out here
+    query_project(str(indexed_repository), query_args("play the audio stream", adaptive=True, filter_files=True))
+
+    assert len(searches) == 1
+    stages = logged_stages()
+    assert stages[0] == ("reformulate", 0)
+    assert {stage for stage, _ in stages} == {"reformulate", "search", "filter", "relevant", "final"}
+
+
+def test_cached_requirement_is_embedded_once(indexed_repository, monkeypatch):
+    from backends import FakeEmbeddings
+    from query_requirement import query_project
+
+    embedded = []
+    embed_query = FakeEmbeddings.embed_query
+
+    def recording_embed_query(self, text):
+        embedded.append(text)
+        return embed_query(self, text)
+
+    monkeypatch.setattr(FakeEmbeddings, "embed_query", recording_embed_query)
+    query_project(str(indexed_repository), query_args("play the audio stream", cache=True, subtrees=True))
+
+    assert embedded.count("play the audio stream") == 1
+
+
+def test_every_retrieval_stage_is_logged(indexed_repository):
+    from query_requirement import query_project
+
+    query_project(str(indexed_repository), query_args("load the configuration", subtrees=True, adjacent=True,
+                                                      symbols=True))
+
+    assert [stage for stage, _ in logged_stages()] == ["subtrees", "reformulate", "search", "adjacent", "symbols",
+                                                      "relevant", "final"]
+
+
+class RecordingOutput:
+    def __init__(self):
+        self.parts = []
+
+    def write(self, text):
+        self.parts.append(text)
+
+    def flush(self):
+        pass
+
+
+def test_streamed_summary_matches_the_complete_completion(indexed_repository, monkeypatch):
+    import backends
+    from metrics import get_metrics
+    from query_requirement import get_final_summary
+    from utils import get_input_tokens, get_output_tokens
+
+    def summarise(output):
+        input_tokens, output_tokens = get_input_tokens(), get_output_tokens()
+        summary = get_final_summary("play the audio stream", ["audio/player.py", "./main.py"],
+                                    str(indexed_repository), output=output)
+        return summary, get_input_tokens() - input_tokens, get_output_tokens() - output_tokens
+
+    first_tokens = len(get_metrics().get("final_time_to_first_token", []))
+    streamed_output = RecordingOutput()
+    streamed = summarise(streamed_output)
+    assert len(get_metrics()["final_time_to_first_token"]) == first_tokens + 1
+    assert len(streamed_output.parts) > 2
+    assert "".join(streamed_output.parts) == streamed[0] + "\n"
+
+    # without a streaming backend the completion is written at once
+    monkeypatch.delitem(backends.llm_stream_backends, "fake")
+    complete_output = RecordingOutput()
+    assert summarise(complete_output) == streamed
+    assert complete_output.parts == [streamed[0], "\n"]
@@ -0,0 +1,112 @@
+import concurrent.futures
+
+import pytest
+
+import setup_repository
+from conftest import init_args, write_files
+from utils import iter_initial_files, iter_summaries, join_file_lists, load_call_analysis_results, \
+    load_summary_hashes, store_call_analysis_results
+
+pytest.importorskip("langchain_chroma")
+
+
+def test_interrupted_summarisation_keeps_the_started_files_and_stops(repository, monkeypatch):
+    files = {"big.py": "".join(f"def handler_{i}(event):\n    return dispatch(event, {i})\n" for i in range(20)),
+             "first.py": "def first():\n    return 1\n" * 3,
+             "second.py": "def second():\n    return 2\n" * 2,
+             "third.py": "def third():\n    return 3\n"}
+    write_files(repository, files)
+    # the files are scheduled by their centrality in the import graph
+    from analyzer_py import analyze_directory
+    setup_repository.init_project(str(repository), analyze_directory,
+                                  init_args(summarize=False, vectorize_summaries=False, vectorize_content=False))
+    interrupted = []
+
+    def interrupting_wait(futures, return_when):
+        # the interrupt arrives once the first files are being summarised
+        if not interrupted:
+            interrupted.append(True)
+            concurrent.futures.wait(futures)
+            raise KeyboardInterrupt
+        return concurrent.futures.wait(futures, return_when=return_when)
+
+    monkeypatch.setattr(setup_repository, "wait", interrupting_wait)
+    file_list = join_file_lists(load_call_analysis_results(str(repository)), iter_initial_files(str(repository)))
+    with pytest.raises(KeyboardInterrupt):
+        setup_repository.add_file_contents(file_list, str(repository), chunk_size=300, chunk_overlap=0, workers=1)
+
+    # two tasks are in flight with one worker, the chunks of the split file are finished after the interrupt
+    assert sorted(load_summary_hashes(str(repository))) == ["./big.py", "./first.py"]
+
+
+class RecordingWriter:
+    shared_key = None
+
+    def __init__(self):
+        self.results = {}
+
+    def put_result(self, result):
+        self.results[result['file']] = result['summaries']
+
+
+def small_files(repository, names):
+    write_files(repository, {name: f"def {name[:-3]}():\n    return '{name}'\n" for name in names})
+    return [{"file": name, "hash": "new", "calls": [], "called_by": []} for name in names]
+
+
+def test_small_files_are_packed_up_to_the_limits(monkeypatch):
+    monkeypatch.setattr(setup_repository, "PACK_MAX_FILES", 2)
+    prioritised = [(5, {"file": "a.py", "size": 100}), (4, {"file": "big.py", "size": 5000}),
+                   (3, {"file": "b.py", "size": 100}), (2, {"file": "c.py", "size": 30000}),
+                   (1, {"file": "d.py", "size": 100}), (1, {"file": "unknown.py"})]
+    packs, remaining = setup_repository.pack_small_files(prioritised)
+
+    assert [(priority, [file["file"] for file in files]) for priority, files in packs] == \
+        [(8, ["a.py", "b.py"]), (1, ["d.py"])]
+    assert [file["file"] for _, file in remaining] == ["big.py", "c.py", "unknown.py"]
+    # the token budget closes a pack before the file count does
+    packs, _ = setup_repository.pack_small_files([(1, {"file": f"{i}.py", "size": 3000}) for i in range(12)])
+    assert [len(files) for _, files in packs] == [2] * 6
+
+
+def test_packed_response_is_parsed_into_summaries(repository):
+    files = small_files(repository, ["alpha.py", "beta.py"])
+    writer = RecordingWriter()
+
+    assert setup_repository.summarise_pack(writer, str(repository), files, None) == (2, 0, [])
+    assert sorted(writer.results) == ["alpha.py", "beta.py"]
+    assert "alpha" in writer.results["alpha.py"][0] and "beta" not in writer.results["alpha.py"][0]
+
+    response = '```json\n{"alpha.py": " Alpha. ", "beta.py": "", "gamma.py": "Gamma.", "./alpha.py": 1}\n```'
+    assert setup_repository.parse_packed_summaries(response, ["alpha.py", "beta.py"]) == {"alpha.py": "Alpha."}
+    assert setup_repository.parse_packed_summaries('["alpha.py"]', ["alpha.py"]) == {}
+
+
+@pytest.mark.parametrize("response", ["Here are the summaries: alpha.py is ...", '{"alpha.py": "Alpha only."}'])
+def test_files_missing_from_a_packed_response_are_summarised_alone(repository, monkeypatch, response):
+    files = small_files(repository, ["alpha.py", "beta.py"])
+    monkeypatch.setattr(setup_repository, "get_llm_query_result", lambda prompt, stage: response)
+    writer = RecordingWriter()
+
+    summarised, unchanged, fallback = setup_repository.summarise_pack(writer, str(repository), files, None)
+    assert [file["file"] for file in fallback] == [file["file"] for file in files if file["file"] not in writer.results]
+    assert summarised == len(writer.results) and unchanged == 0
+    assert "beta.py" not in writer.results
+
+
+def test_malformed_packed_response_falls_back_to_single_summaries(repository, monkeypatch):
+    files = small_files(repository, ["alpha.py", "beta.py", "gamma.py"])
+    # files are scheduled by their centrality in the import graph
+    store_call_analysis_results(str(repository), files)
+    get_llm_query_result = setup_repository.get_llm_query_result
+
+    def malformed_packs(prompt, stage):
+        return "not json" if "JSON object" in prompt else get_llm_query_result(prompt, stage)
+
+    monkeypatch.setattr(setup_repository, "get_llm_query_result", malformed_packs)
+    processed = setup_repository.add_file_contents(files, str(repository), workers=1, pack=True)
+
+    assert processed == 3
+    summaries = {file["file"]: file["summaries"] for file in iter_summaries(str(repository))}
+    assert sorted(summaries) == ["alpha.py", "beta.py", "gamma.py"]
+    assert all(len(summary_list) == 1 and summary_list[0] for summary_list in summaries.values())
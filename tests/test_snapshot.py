@@ -0,0 +1,89 @@
+import hashlib
+import io
+import json
+import os
+import tarfile
+
+import pytest
+
+from backends import EMBEDDING_STAGE
+from shared_store import get_stage_key
+from snapshot import SNAPSHOT_FORMAT, SNAPSHOT_MANIFEST, SNAPSHOT_VERSION, export_snapshot, import_snapshot
+from utils import iter_summaries, load_call_analysis_results, use_project_store
+
+pytest.importorskip("langchain_chroma")
+
+
+def store_checksums(store_dir="data/test"):
+    checksums = {}
+    for root, _, files in os.walk(store_dir):
+        for file in files:
+            with open(os.path.join(root, file), "rb") as f:
+                checksums[os.path.relpath(os.path.join(root, file), store_dir)] = hashlib.sha256(f.read()).hexdigest()
+    return checksums
+
+
+def write_archive(path, members, checksums=None):
+    """
+    Write a snapshot archive with the given members, listed in its manifest with their checksums.
+    """
+    checksums = checksums or {name: hashlib.sha256(data).hexdigest() for name, data in members.items()}
+    snapshot = {"format": SNAPSHOT_FORMAT, "version": SNAPSHOT_VERSION, "created": 0, "project": "test",
+                "embeddings": get_stage_key(EMBEDDING_STAGE), "summary": get_stage_key("summary"),
+                "files": checksums}
+    with tarfile.open(path, "w:gz") as archive:
+        for name, data in [(SNAPSHOT_MANIFEST, json.dumps(snapshot).encode("utf-8"))] + list(members.items()):
+            member = tarfile.TarInfo(name)
+            member.size = len(data)
+            archive.addfile(member, io.BytesIO(data))
+
+
+def test_snapshot_round_trip(indexed_repository, tmp_path):
+    from query_requirement import search_similar_files
+
+    summaries = list(iter_summaries(str(indexed_repository)))
+    relations = load_call_analysis_results(str(indexed_repository))
+    archive = tmp_path / "index.tar.gz"
+    assert export_snapshot(str(indexed_repository), str(archive)) > 0
+
+    checkout = tmp_path / "checkout"
+    checkout.mkdir()
+    use_project_store(str(checkout), "copy")
+    snapshot = import_snapshot(str(checkout), str(archive))
+
+    assert snapshot["project"] == "test"
+    assert list(iter_summaries(str(checkout))) == summaries
+    assert load_call_analysis_results(str(checkout)) == relations
+    summary_hits, content_hits = search_similar_files("play the audio stream", str(checkout))
+    assert summary_hits[0][0] == "audio/player.py"
+    assert os.path.isfile("data/copy/index_version")
+
+
+@pytest.mark.parametrize("name", ["../summaries.db", "/tmp/summaries.db", "directory_store/../../escaped.db"])
+def test_paths_outside_the_store_are_rejected(indexed_repository, tmp_path, name):
+    before = store_checksums()
+    archive = tmp_path / "evil.tar.gz"
+    write_archive(archive, {name: b"not a database"})
+
+    with pytest.raises(ValueError, match="Invalid path"):
+        import_snapshot(str(indexed_repository), str(archive))
+    # an entry that is not listed in the manifest is refused as well
+    write_archive(archive, {name: b"not a database"}, checksums={"summaries.db": "0" * 64})
+    with pytest.raises(ValueError, match="Unexpected entry"):
+        import_snapshot(str(indexed_repository), str(archive))
+
+    assert store_checksums() == before
+    assert not os.path.exists("data/summaries.db") and not os.path.exists("data/escaped.db")
+
+
+def test_corrupt_snapshot_leaves_the_stores_untouched(indexed_repository, tmp_path):
+    before = store_checksums()
+    archive = tmp_path / "corrupt.tar.gz"
+    write_archive(archive, {"summaries.db": b"first", "call_analysis.db": b"second"},
+                  checksums={"summaries.db": hashlib.sha256(b"first").hexdigest(),
+                             "call_analysis.db": hashlib.sha256(b"tampered").hexdigest()})
+
+    with pytest.raises(ValueError, match="Checksum mismatch for call_analysis.db"):
+        import_snapshot(str(indexed_repository), str(archive))
+    assert store_checksums() == before
+    assert [name for name in os.listdir("data") if name.startswith(".import-")] == []
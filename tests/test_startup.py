@@ -0,0 +1,50 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+REPOSITORY_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# imports of the provider SDKs, the vector store and the numeric stack, loaded by the stages that use them
+HEAVY_MODULES = ("langchain", "langchain_core", "langchain_chroma", "langchain_openai", "langchain_ollama",
+                 "chromadb", "openai", "ollama", "tiktoken", "numpy")
+# the analyzers and the memory profiler are only loaded by the commands that need them
+CLI_HEAVY_MODULES = HEAVY_MODULES + ("tqdm", "memory_profiler", "analyzer_js", "analyzer_py")
+# total import time of the cheap commands, measured with -X importtime
+IMPORT_BUDGET_SECONDS = 0.5
+PIPELINE_MODULES = ("setup_repository", "query_requirement", "watch_project", "index_stats", "snapshot",
+                    "shared_store", "directory_summaries", "quantized_index", "profiling")
+
+
+def import_times(arguments, tmp_path):
+    """
+    Returns:
+        dict: The import time in seconds of every module imported by ``python -X importtime <arguments>``.
+    """
+    config = tmp_path / "projects.toml"
+    config.write_text('[projects.demo]\npath = "."\n')
+    completed = subprocess.run([sys.executable, "-X", "importtime", *arguments], cwd=tmp_path,
+                               env={**os.environ, "PYTHONPATH": REPOSITORY_DIR}, capture_output=True, text=True,
+                               check=True)
+    times = {}
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_time, _, module = line[len("import time:"):].split("|")
+        times[module.strip()] = int(self_time) / 1e6
+    return times
+
+
+@pytest.mark.parametrize("command", [["--help"], ["demo", "retrieve", "--help"], ["demo", "init", "--help"]])
+def test_cli_help_stays_within_import_budget(tmp_path, command):
+    times = import_times([os.path.join(REPOSITORY_DIR, "main.py"), "--config", "projects.toml", *command], tmp_path)
+    heavy = sorted(module for module in times if module.split(".")[0] in CLI_HEAVY_MODULES)
+    assert heavy == []
+    assert sum(times.values()) < IMPORT_BUDGET_SECONDS
+
+
+def test_pipeline_modules_import_sdks_lazily(tmp_path):
+    times = import_times(["-c", f"import {', '.join(PIPELINE_MODULES)}"], tmp_path)
+    heavy = sorted(module for module in times if module.split(".")[0] in HEAVY_MODULES)
+    assert heavy == []
+    assert sum(times.values()) < IMPORT_BUDGET_SECONDS
@@ -0,0 +1,62 @@
+import sqlite3
+
+import pytest
+
+import storage
+from storage import get_cached_summaries, get_read_connection, select_by_files
+from utils import get_store_dir_from_repository, store_summaries
+
+
+@pytest.fixture
+def files_db(tmp_path):
+    db_path = tmp_path / "files.db"
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE files (id INTEGER PRIMARY KEY, file_name TEXT UNIQUE NOT NULL)")
+    conn.executemany("INSERT INTO files (id, file_name) VALUES (?, ?)", [(i, f"app/f{i}.py") for i in range(1, 601)])
+    conn.commit()
+    conn.close()
+    yield str(db_path)
+    storage.close_read_connections()
+
+
+def test_read_connections_are_pooled_and_read_only(files_db, tmp_path):
+    assert get_read_connection(str(tmp_path / "missing.db")) is None
+    connection = get_read_connection(files_db)
+    assert get_read_connection(files_db) is connection
+    with pytest.raises(sqlite3.OperationalError, match="readonly"):
+        connection.execute("DELETE FROM files")
+
+
+@pytest.mark.parametrize("count", [3, storage.SQLITE_MAX_PARAMETERS + 1])
+def test_select_by_files_inlines_or_uses_a_temp_table(files_db, count):
+    connection = get_read_connection(files_db)
+    names = [f"app/f{i}.py" for i in range(1, count + 1)] + ["app/unknown.py"]
+    rows = select_by_files(connection, "SELECT id FROM files WHERE file_name IN ({files}) ORDER BY id", names)
+    assert rows == [(i,) for i in range(1, count + 1)]
+
+    # integer ids still match through the temporary table
+    rows = select_by_files(connection, "SELECT file_name FROM files WHERE id IN ({files})", list(range(1, count + 1)))
+    assert len(rows) == count
+    assert select_by_files(connection, "SELECT id FROM files WHERE file_name IN ({files})", []) == []
+
+
+def test_missing_summaries_are_read_again_after_a_write(repository):
+    store_dir = get_store_dir_from_repository(str(repository))
+    store_summaries([{"file": "app/a.py", "content": "a\n", "summaries": ["A"]}], str(repository))
+
+    assert get_cached_summaries(store_dir, ["app/b.py", "app/a.py"]) == {"app/a.py": ["A"]}
+    store_summaries([{"file": "app/b.py", "content": "b\n", "summaries": ["B1", "B2"]},
+                     {"file": "app/a.py", "content": "a2\n", "summaries": ["A2"]}], str(repository))
+    assert get_cached_summaries(store_dir, ["app/b.py", "app/a.py"]) == {"app/b.py": ["B1", "B2"], "app/a.py": ["A2"]}
+
+
+def test_summary_cache_evicts_the_least_recently_used(repository, monkeypatch):
+    monkeypatch.setattr(storage, "SUMMARY_CACHE_SIZE", 2)
+    store_dir = get_store_dir_from_repository(str(repository))
+    store_summaries([{"file": f"app/{name}.py", "content": name, "summaries": [name]} for name in "abc"],
+                    str(repository))
+
+    get_cached_summaries(store_dir, ["app/a.py", "app/b.py"])
+    get_cached_summaries(store_dir, ["app/a.py"])
+    get_cached_summaries(store_dir, ["app/c.py"])
+    assert [file for _, file in storage._summary_cache] == ["app/a.py", "app/c.py"]
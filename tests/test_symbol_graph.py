@@ -0,0 +1,29 @@
+import sqlite3
+
+from analyzer_py import analyze_directory
+from conftest import write_files
+from symbol_graph import store_symbol_analysis_results, expand_symbol_references, match_symbols
+from utils import store_call_analysis_results
+
+
+def test_references_to_root_level_modules_are_stored(repository):
+    write_files(repository, {
+        "helpers.py": "def parse_config(path):\n    return path\n",
+        "app/main.py": "from helpers import parse_config\n\n\ndef run():\n    return parse_config('a')\n",
+    })
+    results = analyze_directory(str(repository))
+    store_call_analysis_results(str(repository), results)
+    store_symbol_analysis_results(str(repository), results)
+
+    conn = sqlite3.connect("data/test/call_analysis.db")
+    relations = conn.execute("""
+        SELECT caller.file_name, called.name FROM symbol_relations r
+        JOIN files caller ON caller.id = r.caller_file_id
+        JOIN symbols called ON called.id = r.called_symbol_id
+        """).fetchall()
+    conn.close()
+    assert relations == [("app/main.py", "parse_config")]
+
+    matched = match_symbols(str(repository), ["./helpers.py"], "parse config")
+    assert [symbol["name"] for symbol in matched] == ["parse_config"]
+    assert "app/main.py" in expand_symbol_references(str(repository), [matched[0]["id"]])
@@ -0,0 +1,71 @@
+import sqlite3
+
+import pytest
+
+from utils import (connect_summaries_db, filter_analysis_results, get_content_hash, get_store_dir_from_repository,
+                   iter_summaries, join_file_lists, load_summary_hashes, store_summaries)
+
+
+def test_store_of_unknown_project_is_not_guessed(tmp_path):
+    with pytest.raises(RuntimeError, match="use_project_store"):
+        get_store_dir_from_repository(str(tmp_path))
+
+
+def test_analysis_results_are_filtered_by_the_project_globs():
+    results = [
+        {"file": "./main.py", "calls": ["vendor/lib.py", "app.py"], "called_by": [],
+         "references": [{"file": "vendor/lib.py", "symbol": "load", "from_symbol": None, "line": 1}]},
+        {"file": "vendor/lib.py", "calls": [], "called_by": ["./main.py"]},
+    ]
+    filtered = filter_analysis_results(results, exclude=["vendor/*"])
+    assert filtered == [{"file": "./main.py", "calls": ["app.py"], "called_by": [], "references": []}]
+    # the analyzer results are not changed
+    assert results[0]["calls"] == ["vendor/lib.py", "app.py"]
+
+
+def test_join_file_lists_drops_excluded_analyzer_files():
+    analysed = [{"file": "./main.py", "calls": ["vendor/lib.py"], "called_by": []},
+                {"file": "vendor/lib.py", "calls": [], "called_by": ["./main.py"]}]
+    discovered = [{"file": "./main.py", "hash": "a"}]
+    joined = list(join_file_lists(analysed, discovered, exclude=["vendor/*"]))
+    assert joined == [{"file": "./main.py", "hash": "a", "calls": [], "called_by": []}]
+
+
+def test_legacy_summaries_are_migrated(repository):
+    conn = sqlite3.connect(f"{get_store_dir_from_repository(str(repository))}/summaries.db")
+    conn.execute("""
+    CREATE TABLE summaries (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        file TEXT UNIQUE NOT NULL,
+        content TEXT NOT NULL,
+        summary TEXT NOT NULL
+    )
+    """)
+    conn.executemany("INSERT INTO summaries (file, content, summary) VALUES (?, ?, ?)",
+                     [("./main.py", "print('main')\n", "Prints main."), ("app/util.py", "x = 1\n", "Sets x.")])
+    conn.commit()
+    conn.close()
+
+    assert list(iter_summaries(str(repository))) == [
+        {"file": "./main.py", "content": "print('main')\n", "summaries": ["Prints main."]},
+        {"file": "app/util.py", "content": "x = 1\n", "summaries": ["Sets x."]},
+    ]
+    assert load_summary_hashes(str(repository)) == {"./main.py": get_content_hash("print('main')\n"),
+                                                    "app/util.py": get_content_hash("x = 1\n")}
+    conn = connect_summaries_db(str(repository))
+    tables = {name for name, in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    columns = {name for name, in conn.execute("SELECT name FROM pragma_table_info('summaries')")}
+    conn.close()
+    assert "summaries_legacy" not in tables
+    assert columns == {"file_id", "chunk_index", "summary"}
+
+
+def test_stored_summaries_replace_all_chunks_of_a_file(repository):
+    store_summaries([{"file": "app/big.py", "content": "a\nb\nc\n", "summaries": ["A", "B", "C"]},
+                     {"file": "app/other.py", "content": "d\n", "summaries": ["D"]}], str(repository))
+    store_summaries([{"file": "app/big.py", "content": "a\n", "summaries": ["A only"]}], str(repository))
+
+    assert list(iter_summaries(str(repository))) == [
+        {"file": "app/big.py", "content": "a\n", "summaries": ["A only"]},
+        {"file": "app/other.py", "content": "d\n", "summaries": ["D"]},
+    ]
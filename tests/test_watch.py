@@ -0,0 +1,53 @@
+import os
+import sqlite3
+
+import pytest
+
+import analyzer_py
+from conftest import write_files
+from watch_project import update_files
+
+pytest.importorskip("langchain_chroma")
+
+
+def stored_relations():
+    conn = sqlite3.connect("data/test/call_analysis.db")
+    relations = set(conn.execute("""
+        SELECT caller.file_name, called.file_name FROM file_relations
+        JOIN files caller ON caller.id = file_relations.caller_id
+        JOIN files called ON called.id = file_relations.called_id
+        """))
+    conn.close()
+    return relations
+
+
+def test_update_analyses_only_the_changed_files(indexed_repository):
+    analysed = []
+
+    def recording_analyze_directory(directory, paths=None):
+        analysed.append(sorted(paths))
+        return analyzer_py.analyze_directory(directory, paths)
+
+    write_files(indexed_repository, {"config/loader.py": "def load_config(path):\n    return open(path).read()\n"})
+    update_files(str(indexed_repository), recording_analyze_directory, {"config/loader.py"}, {})
+
+    assert analysed == [["config/loader.py"]]
+    # main.py did not change, its import of the changed file is kept
+    assert ("./main.py", "config/loader.py") in stored_relations()
+
+
+def test_removed_files_leave_the_graph_without_analysis(indexed_repository):
+    os.remove(indexed_repository / "config/loader.py")
+    update_files(str(indexed_repository), None, {"config/loader.py"}, {})
+
+    assert not any("config/loader.py" in relation for relation in stored_relations())
+
+
+def test_importers_of_a_removed_file_are_analysed_again(indexed_repository):
+    # the module becomes a package, main.py itself does not change
+    os.remove(indexed_repository / "config/loader.py")
+    write_files(indexed_repository, {"config/loader/__init__.py": "def load_config(path):\n    return path\n"})
+    update_files(str(indexed_repository), analyzer_py.analyze_directory,
+                 {"config/loader.py", "config/loader/__init__.py"}, {})
+
+    assert ("./main.py", "config/loader/__init__.py") in stored_relations()
@@ -1,16 +1,30 @@
-import mimetypes
+import contextvars
+import fnmatch
+import hashlib
+import json
 import os
+import queue
 import re
 import sqlite3
+import threading
 import time
+import zlib
 
-import ollama
-from dotenv import dotenv_values
-from langchain_ollama import OllamaEmbeddings
-from langchain_openai import OpenAIEmbeddings
-from openai import OpenAI, RateLimitError as OpenAIRateLimitError
+from tenacity import retry, stop_after_attempt, retry_if_exception, retry_if_exception_type
 
-from tenacity import retry, stop_after_attempt, retry_if_exception_type
+from file_manifest import TEXT, classify_file, iter_manifest
+from storage import get_cached_summaries, invalidate_cached_summaries, iter_batches
+
+SUMMARY_CONTENT_COMPRESSION_LEVEL = 6
+
+BLACKLIST = ['node_modules', r'\.(.*)$', '__pycache__', r'(.*)\.lock', 'package-lock.json']
+BLACKLIST_PATTERN = re.compile('|'.join(BLACKLIST))
+
+# the vector stores with a document per file, keyed by the "file" metadata
+VECTOR_STORES = ("summary_store", "contents_store")
+
+_prepared_summary_stores = set()
+_project_store = contextvars.ContextVar("project_store", default=(None, None))
 
 total_input_tokens = 0
 total_output_tokens = 0
@@ -39,7 +53,9 @@ def set_embedding_tokens(value):
 
 def is_binary_file(filename):
     """
-    Checks if a given filename corresponds to a file with binary content.
+    Checks if a given filename corresponds to a file that should not be treated as text.
+
+    Besides binary content this covers files above the size limit and minified bundles.
 
     Parameters:
         filename (str): The path to the file to check.
@@ -47,79 +63,100 @@ def is_binary_file(filename):
     Returns:
         bool: True if the file is binary, False otherwise.
     """
-    if filename.endswith('.ts'):
-        return False
-
     # Check if file exists
     if not os.path.isfile(filename):
         raise FileNotFoundError(f"The file '{filename}' does not exist.")
 
-    # Guess the file type using mimetypes
-    mime_type, encoding = mimetypes.guess_type(filename)
-    if mime_type is not None:
-        # Check if the MIME type suggests binary content
-        if any(mime_type.startswith(prefix) for prefix in ['image/', 'video/', 'audio/', 'application/']) and mime_type != 'application/json':
-            return True
+    return classify_file(filename) != TEXT
 
-    # Read the file to look for binary content
-    try:
-        with open(filename, 'rb') as file:
-            # Read a small portion of the file
-            sample = file.read(1024)
-            # Check if the sample contains non-text bytes
-            if b'\0' in sample:
-                return True
-    except Exception as e:
-        print(f"An error occurred while reading the file: {e}")
+def iter_initial_files(directory, include=None, exclude=None, readonly=False):
+    """
+    Walk the directory and yield a lightweight record for every text file.
+
+    Every file is classified and hashed in one read, the verdicts are cached in the project's manifest.db
+    and unchanged files are not opened again on the next run. With ``readonly`` the cached verdicts are
+    used, but the manifest is left as it is.
+    The content is not kept, it is read lazily with ``read_file_content`` by the stages that need it.
+    ``include`` and ``exclude`` are optional lists of globs for the relative paths.
+
+    Yields:
+        dict: The relative "file" path, its "size" in bytes, the sha256 "hash" of its bytes and the
+            "simhash" fingerprint of its text, None for short files.
+    """
+    def iter_paths():
+        for root, dirs, files in os.walk(directory, topdown=True):
+            # Skip directories that match the blacklist
+            dirs[:] = [d for d in dirs if BLACKLIST_PATTERN.match(d) is None]
+            for file in files:
+                if BLACKLIST_PATTERN.match(file) is None:
+                    relative_path = os.path.join(os.path.relpath(root, directory), file)
+                    if matches_globs(relative_path, include, exclude):
+                        yield relative_path
+
+    for record in iter_manifest(get_store_dir_from_repository(directory), directory, iter_paths(),
+                                readonly=readonly):
+        if record["verdict"] == TEXT:
+            yield {"file": record["file"], "size": record["size"], "hash": record["hash"],
+                   "simhash": record["simhash"]}
+
+def to_pipeline_path(relative_path):
+    """
+    Returns:
+        str: The relative path in the form of discovery and the Python analyzer, e.g. ./main.py and src/app.py.
+    """
+    path = os.path.normpath(relative_path)
+    return os.path.join(os.path.dirname(path) or ".", os.path.basename(path))
+
+def matches_globs(relative_path, include=None, exclude=None):
+    path = os.path.normpath(relative_path)
+    if include and not any(fnmatch.fnmatch(path, pattern) for pattern in include):
         return False
+    return not exclude or not any(fnmatch.fnmatch(path, pattern) for pattern in exclude)
 
-    return False
-
-def get_initial_files(directory):
-    blacklist = ['node_modules', '\.(.*)$', '__pycache__', '(.*)\.lock', 'package-lock.json']
-    file_list = []
-    for root, dirs, files in os.walk(directory, topdown=True):
-        # Skip directories that match the blacklist
-        dirs[:] = [d for d in dirs if re.match('|'.join(blacklist), d) is None]
-        files[:] = [f for f in files if re.match('|'.join(blacklist), f) is None]
-        for file in files:
-            relative_path = os.path.join(os.path.relpath(root, directory), file)
-            full_path = os.path.join(root, file)
-
-            result = {
-                "file": relative_path,
-                "content": "",
-                "calls": [],
-                "called_by": []
-            }
-            with open(full_path, "r") as f:
-                try:
-                    if is_binary_file(full_path):
-                        continue
+def read_file_content(directory, file):
+    try:
+        with open(os.path.join(directory, file), "r") as f:
+            return f.read()
+    except UnicodeDecodeError:
+        return ""
 
-                    result['content'] = f.read()
-                except UnicodeDecodeError:
-                    pass
-            file_list.append(result)
-    return file_list
+def join_file_lists(files1, files2, include=None, exclude=None):
+    """
+    Merge the records of two file lists, preferring the keys of ``files1``.
 
-def join_file_lists(files1, files2):
-    result = []
-    files1_dict = {file['file']: file for file in files1}
-    files2_dict = {file['file']: file for file in files2}
-    for file_name in set(files1_dict.keys()).union(files2_dict.keys()):
-        if file_name in files1_dict:
-            result.append(files1_dict[file_name])
-        else:
-            result.append(files2_dict[file_name])
-    return result
+    ``files2`` may be a generator, it is consumed lazily and only ``files1`` is held in memory.
+    Files of ``files1`` not matching the ``include`` and ``exclude`` globs are left out, ``files2``
+    is expected to be filtered already, like the records of ``iter_initial_files``.
+    """
+    files1_dict = {file['file']: file for file in filter_analysis_results(files1, include, exclude)}
+    for file in files2:
+        yield {"calls": [], "called_by": [], **file, **files1_dict.pop(file['file'], {})}
+    yield from files1_dict.values()
 
 
-def store_call_analysis_results(repo_dir, files):
-    store_dir = get_store_dir_from_repository(repo_dir)
-    conn = sqlite3.connect(f"{store_dir}/call_analysis.db")
-    cursor = conn.cursor()
+def filter_analysis_results(files, include=None, exclude=None):
+    """
+    Drop the files not matching the ``include`` and ``exclude`` globs from analyzer results, together
+    with the imports and symbol references of the other files to them.
+
+    Returns:
+        list: Copies of the records of the matching files.
+    """
+    def matches(file_name):
+        return matches_globs(file_name, include, exclude)
 
+    filtered = []
+    for file in files:
+        if not matches(file['file']):
+            continue
+        file = {**file, "calls": [name for name in file['calls'] if matches(name)],
+                "called_by": [name for name in file['called_by'] if matches(name)]}
+        if 'references' in file:
+            file['references'] = [reference for reference in file['references'] if matches(reference['file'])]
+        filtered.append(file)
+    return filtered
+
+def create_call_analysis_tables(cursor):
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS files (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -136,6 +173,15 @@ def store_call_analysis_results(repo_dir, files):
         FOREIGN KEY (called_id) REFERENCES files(id) ON DELETE CASCADE
     );
     ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_file_relations_caller ON file_relations (caller_id);')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_file_relations_called ON file_relations (called_id);')
+
+def store_call_analysis_results(repo_dir, files):
+    store_dir = get_store_dir_from_repository(repo_dir)
+    conn = sqlite3.connect(f"{store_dir}/call_analysis.db")
+    cursor = conn.cursor()
+
+    create_call_analysis_tables(cursor)
     conn.commit()
 
     for file in files:
@@ -166,6 +212,60 @@ def store_call_analysis_results(repo_dir, files):
 
     conn.commit()
 
+def replace_call_analysis_results(repo_dir, files, removed=()):
+    """
+    Replace the imports of some files, e.g. after they changed, and drop the removed files.
+
+    The imports of the changed files by other files did not change, they are kept from the stored
+    relations, so the files only need to be analysed on their own.
+
+    Args:
+        files (list): Analyzer results of the changed files, with their "calls".
+        removed (list): Files that do not exist anymore, their relations and symbols are dropped too.
+    """
+    store_dir = get_store_dir_from_repository(repo_dir)
+    conn = sqlite3.connect(f"{store_dir}/call_analysis.db")
+    conn.execute("PRAGMA foreign_keys=ON")
+    cursor = conn.cursor()
+    create_call_analysis_tables(cursor)
+
+    # the analyzers store the imported root files without ./, e.g. helpers.py
+    cursor.executemany('DELETE FROM files WHERE file_name = ?;',
+                       [(name,) for file in removed for name in {to_pipeline_path(file), os.path.normpath(file)}])
+    file_names = list({file['file'] for file in files} | {called for file in files for called in file['calls']})
+    cursor.executemany('INSERT OR IGNORE INTO files (file_name) VALUES (?);', [(name,) for name in file_names])
+    file_ids = {}
+    for batch in iter_batches(file_names):
+        cursor.execute(f'SELECT file_name, id FROM files WHERE file_name IN ({",".join("?" * len(batch))});', batch)
+        file_ids.update(cursor.fetchall())
+
+    cursor.executemany('DELETE FROM file_relations WHERE caller_id = ?;', [(file_ids[file['file']],) for file in files])
+    cursor.executemany('INSERT INTO file_relations (caller_id, called_id) VALUES (?, ?);',
+                       [(file_ids[file['file']], file_ids[called]) for file in files for called in file['calls']])
+    conn.commit()
+    conn.close()
+
+def load_importers(repo_dir, files):
+    """
+    Returns:
+        set: The stored names of the files importing any of the given files.
+    """
+    store_dir = get_store_dir_from_repository(repo_dir)
+    if not os.path.isfile(f"{store_dir}/call_analysis.db"):
+        return set()
+    names = list({name for file in files for name in {to_pipeline_path(file), os.path.normpath(file)}})
+    conn = sqlite3.connect(f"{store_dir}/call_analysis.db")
+    importers = set()
+    for batch in iter_batches(names):
+        importers.update(file_name for file_name, in conn.execute(f"""
+            SELECT caller.file_name FROM file_relations
+            JOIN files caller ON caller.id = file_relations.caller_id
+            JOIN files called ON called.id = file_relations.called_id
+            WHERE called.file_name IN ({",".join("?" * len(batch))});
+            """, batch))
+    conn.close()
+    return importers
+
 def load_call_analysis_results(repo_dir):
     store_dir = get_store_dir_from_repository(repo_dir)
     conn = sqlite3.connect(f"{store_dir}/call_analysis.db")
@@ -199,90 +299,375 @@ def load_call_analysis_results(repo_dir):
 
     return result
 
-def store_summaries(files, directory):
+def compress_content(content):
+    return zlib.compress(content.encode("utf-8"), SUMMARY_CONTENT_COMPRESSION_LEVEL)
+
+def decompress_content(blob):
+    return zlib.decompress(blob).decode("utf-8")
+
+def get_content_hash(content):
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+def connect_summaries_db(directory):
     store_dir = get_store_dir_from_repository(directory)
     conn = sqlite3.connect(f"{store_dir}/summaries.db")
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA foreign_keys=ON")
+    create_summaries_tables(conn)
+    return conn
+
+def create_summaries_tables(conn):
     cursor = conn.cursor()
 
+    cursor.execute("SELECT name FROM pragma_table_info('summaries') WHERE name = 'content'")
+    legacy_schema = cursor.fetchone() is not None
+    if legacy_schema:
+        cursor.execute("ALTER TABLE summaries RENAME TO summaries_legacy")
+
     cursor.execute("""
-    CREATE TABLE IF NOT EXISTS summaries (
+    CREATE TABLE IF NOT EXISTS files (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         file TEXT UNIQUE NOT NULL,
-        content TEXT NOT NULL,
-        summary TEXT NOT NULL
+        content BLOB NOT NULL,
+        content_hash TEXT NOT NULL
     )
     """)
 
-    conn.commit()
-    
-    for result in files:
-        for summary in result['summaries']:
-            try:
-                cursor.execute(
-                    "INSERT OR IGNORE INTO summaries (file, content, summary) VALUES (?, ?, ?)",
-                    (result["file"], result["content"], summary)
-                )
-            except sqlite3.Error as e:
-                print(f"Error inserting {result['file']}: {e}")
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS summaries (
+        file_id INTEGER NOT NULL,
+        chunk_index INTEGER NOT NULL,
+        summary TEXT NOT NULL,
+        PRIMARY KEY (file_id, chunk_index),
+        FOREIGN KEY (file_id) REFERENCES files(id) ON DELETE CASCADE
+    ) WITHOUT ROWID
+    """)
+
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS summary_errors (
+        file TEXT PRIMARY KEY,
+        error TEXT NOT NULL,
+        attempts INTEGER NOT NULL,
+        last_attempt REAL NOT NULL
+    )
+    """)
+
+    # duplicate files are not summarised, they share the summary of the file representing their cluster
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS duplicates (
+        file TEXT PRIMARY KEY,
+        representative TEXT NOT NULL
+    )
+    """)
+
+    # the cost of every init run, shipped with exported snapshots
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS builds (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        started REAL NOT NULL,
+        duration REAL NOT NULL,
+        stages TEXT NOT NULL,
+        input_tokens INTEGER NOT NULL,
+        output_tokens INTEGER NOT NULL,
+        embedding_tokens INTEGER NOT NULL
+    )
+    """)
+
+    if legacy_schema:
+        # the old table stored the content once per chunk, only the first chunk of a file survived
+        cursor.execute("SELECT file, content, summary FROM summaries_legacy ORDER BY id")
+        legacy = {}
+        for file, content, summary in cursor.fetchall():
+            legacy.setdefault(file, {"file": file, "content": content, "summaries": []})["summaries"].append(summary)
+        insert_summaries(cursor, legacy.values())
+        cursor.execute("DROP TABLE summaries_legacy")
 
     conn.commit()
 
-def load_summaries(directory):
-    store_dir = get_store_dir_from_repository(directory)
-    conn = sqlite3.connect(f"{store_dir}/summaries.db")
+def insert_summaries(cursor, files):
+    files = [file for file in files if file['summaries']]
+    cursor.executemany(
+        """
+        INSERT INTO files (file, content, content_hash) VALUES (?, ?, ?)
+        ON CONFLICT(file) DO UPDATE SET content = excluded.content, content_hash = excluded.content_hash
+        """,
+        [(file["file"], compress_content(file["content"]), get_content_hash(file["content"])) for file in files]
+    )
+
+    file_ids = {}
+    for batch in iter_batches([file["file"] for file in files]):
+        cursor.execute(f"SELECT file, id FROM files WHERE file IN ({','.join('?' * len(batch))})", batch)
+        file_ids.update(cursor.fetchall())
+
+    # replace all chunks, a file may have fewer chunks than before
+    cursor.executemany("DELETE FROM summaries WHERE file_id = ?", [(file_ids[file["file"]],) for file in files])
+    cursor.executemany(
+        "INSERT INTO summaries (file_id, chunk_index, summary) VALUES (?, ?, ?)",
+        [(file_ids[file["file"]], chunk_index, summary)
+         for file in files for chunk_index, summary in enumerate(file["summaries"])]
+    )
+
+def store_summaries(files, directory):
+    conn = connect_summaries_db(directory)
     cursor = conn.cursor()
 
-    cursor.execute("SELECT file, content, summary FROM summaries")
-    
-    summaries = cursor.fetchall()
-
-    result = {}
-    for file, content, summary in summaries:
-        if file in result:
-            result[file]["summaries"].append(summary)
-        else:
-            result[file] = {
-                "file": file,
-                "content": content,
-                "summaries": [summary]
-            }
-    return list(result.values())
+    try:
+        insert_summaries(cursor, files)
+        conn.commit()
+    except sqlite3.Error as e:
+        conn.rollback()
+        print(f"Error storing summaries: {e}")
+    conn.close()
+    invalidate_cached_summaries(get_store_dir_from_repository(directory), [file["file"] for file in files])
+
+def record_summary_errors(cursor, errors):
+    cursor.executemany(
+        """
+        INSERT INTO summary_errors (file, error, attempts, last_attempt) VALUES (?, ?, 1, ?)
+        ON CONFLICT(file) DO UPDATE SET error = excluded.error, attempts = attempts + 1,
+            last_attempt = excluded.last_attempt
+        """,
+        [(file, error, time.time()) for file, error in errors]
+    )
 
-def get_file_summaries_dict(directory, files):
-    store_dir = get_store_dir_from_repository(directory)
-    conn = sqlite3.connect(f"{store_dir}/summaries.db")
+def load_summary_hashes(directory):
+    """
+    Returns:
+        dict: The content hash of every summarised file.
+    """
+    conn = connect_summaries_db(directory)
+    hashes = dict(conn.execute("SELECT file, content_hash FROM files"))
+    conn.close()
+    return hashes
+
+def load_summary_errors(directory):
+    """
+    Returns:
+        list: (file, error, attempts) of the files whose summarisation failed, most attempts first.
+    """
+    conn = connect_summaries_db(directory)
+    errors = conn.execute("SELECT file, error, attempts FROM summary_errors ORDER BY attempts DESC, file").fetchall()
+    conn.close()
+    return errors
+
+def record_build(directory, started, stages, input_tokens, output_tokens, embedding_tokens):
+    conn = connect_summaries_db(directory)
+    with conn:
+        conn.execute("""
+            INSERT INTO builds (started, duration, stages, input_tokens, output_tokens, embedding_tokens)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """, (started, time.time() - started, json.dumps(stages), input_tokens, output_tokens, embedding_tokens))
+    conn.close()
+
+def load_last_build(directory):
+    """
+    Returns:
+        dict: The start, duration, stages and tokens of the last init run, or None.
+    """
+    conn = connect_summaries_db(directory)
+    row = conn.execute("""
+        SELECT started, duration, stages, input_tokens, output_tokens, embedding_tokens FROM builds
+        ORDER BY id DESC LIMIT 1
+        """).fetchone()
+    conn.close()
+    if row is None:
+        return None
+    return {"started": row[0], "duration": row[1], "stages": json.loads(row[2]), "input_tokens": row[3],
+            "output_tokens": row[4], "embedding_tokens": row[5]}
+
+def store_duplicates(directory, duplicates):
+    """
+    Link the duplicate files to the files representing their clusters, replacing the previous links.
+
+    Summaries stored for files that are duplicates now are dropped together with their chunks.
+
+    Args:
+        duplicates (dict): Mapping of duplicate file to representative file.
+    """
+    conn = connect_summaries_db(directory)
+    with conn:
+        conn.execute("DELETE FROM duplicates")
+        conn.executemany("INSERT INTO duplicates (file, representative) VALUES (?, ?)", duplicates.items())
+        conn.executemany("DELETE FROM files WHERE file = ?", [(file,) for file in duplicates])
+    conn.close()
+    invalidate_cached_summaries(get_store_dir_from_repository(directory), list(duplicates))
+
+def delete_summaries(directory, files):
+    conn = connect_summaries_db(directory)
+    with conn:
+        conn.executemany("DELETE FROM files WHERE file = ?", [(file,) for file in files])
+    conn.close()
+    invalidate_cached_summaries(get_store_dir_from_repository(directory), list(files))
+
+def unlink_duplicates(directory, files):
+    """
+    Dissolve the links of the given files to their clusters, and of the copies of the files they represent.
+    """
+    conn = connect_summaries_db(directory)
+    with conn:
+        conn.executemany("DELETE FROM duplicates WHERE file = ? OR representative = ?",
+                         [(file, file) for file in files])
+    conn.close()
+
+def get_duplicate_members(directory, files):
+    """
+    Returns:
+        dict: The other members of the clusters represented by any of the given files.
+    """
+    files = set(files)
+    conn = connect_summaries_db(directory)
+    members = {}
+    for file, representative in conn.execute("SELECT file, representative FROM duplicates ORDER BY file"):
+        if representative in files:
+            members.setdefault(representative, []).append(file)
+    conn.close()
+    return members
+
+class SummaryWriter:
+    """
+    Single writer thread that commits the results of the summary workers to summaries.db as they arrive.
+
+    Results are committed in batches of up to ``flush_size``, and immediately whenever the queue runs
+    empty, so an interrupted run loses at most the summaries that are still being generated.
+    With a ``shared_key``, the summaries are also added to the shared store of all projects.
+    """
+
+    def __init__(self, directory, flush_size=50, shared_key=None):
+        self.directory = directory
+        self.flush_size = flush_size
+        self.shared_key = shared_key
+        self.queue = queue.Queue()
+        self.stored = 0
+        self.failed = 0
+        # the thread writes to the store of the project in the current context
+        self.thread = threading.Thread(target=contextvars.copy_context().run, args=(self._run,),
+                                       name="summary-writer", daemon=True)
+        self.thread.start()
+
+    def put_result(self, result):
+        self.queue.put(("result", result))
+
+    def put_error(self, file, error):
+        self.queue.put(("error", (file, error)))
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+    def _run(self):
+        # shared_store imports this module
+        from shared_store import connect_shared_store, insert_shared_summaries
+
+        conn = connect_summaries_db(self.directory)
+        shared_conn = connect_shared_store() if self.shared_key else None
+        store_dir = get_store_dir_from_repository(self.directory)
+        closed = False
+        while not closed:
+            batch = [self.queue.get()]
+            while len(batch) < self.flush_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            closed = None in batch
+            results = [item for kind, item in filter(None, batch) if kind == "result"]
+            errors = [item for kind, item in filter(None, batch) if kind == "error"]
+            try:
+                cursor = conn.cursor()
+                insert_summaries(cursor, results)
+                record_summary_errors(cursor, errors)
+                cursor.executemany("DELETE FROM summary_errors WHERE file = ?",
+                                   [(result["file"],) for result in results if result["summaries"]])
+                conn.commit()
+                self.stored += len(results)
+                self.failed += len(errors)
+            except sqlite3.Error as e:
+                conn.rollback()
+                print(f"Error storing summaries: {e}")
+            invalidate_cached_summaries(store_dir, [result["file"] for result in results])
+            if shared_conn is not None and results:
+                try:
+                    with shared_conn:
+                        insert_shared_summaries(shared_conn, results, self.shared_key)
+                except sqlite3.Error as e:
+                    print(f"Error storing shared summaries: {e}")
+        conn.close()
+        if shared_conn is not None:
+            shared_conn.close()
+
+def iter_summaries(directory, files=None):
+    conn = connect_summaries_db(directory)
     cursor = conn.cursor()
 
-    summaries = {}
-    for file in files:
-        cursor.execute("SELECT summary FROM summaries WHERE file=?", (file,))
-        summary_list = cursor.fetchall()
-        if not summary_list:
+    if files is None:
+        cursor.execute("""
+        SELECT f.file, f.content, s.summary FROM summaries s
+        JOIN files f ON f.id = s.file_id
+        ORDER BY s.file_id, s.chunk_index
+        """)
+    else:
+        cursor.execute("""
+        SELECT f.file, f.content, s.summary FROM summaries s
+        JOIN files f ON f.id = s.file_id
+        WHERE f.file IN (SELECT value FROM json_each(?))
+        ORDER BY s.file_id, s.chunk_index
+        """, (json.dumps(list(files)),))
+
+    # rows arrive grouped by file, so only the current file is held in memory
+    current = None
+    for file, content, summary in cursor:
+        if current is not None and current["file"] == file:
+            current["summaries"].append(summary)
             continue
-        summary_list = [summary[0] for summary in summary_list]
-        summaries[file] = summary_list
-
-    cursor.close()
+        if current is not None:
+            yield current
+        current = {
+            "file": file,
+            "content": decompress_content(content),
+            "summaries": [summary]
+        }
+    if current is not None:
+        yield current
     conn.close()
 
-    return summaries
+def load_summaries(directory):
+    return list(iter_summaries(directory))
+
+def get_file_summaries_dict(directory, files):
+    store_dir = get_store_dir_from_repository(directory)
+    if store_dir not in _prepared_summary_stores:
+        # migrate or create the schema once, all lookups after that go through the read-only pool
+        connect_summaries_db(directory).close()
+        _prepared_summary_stores.add(store_dir)
+
+    return get_cached_summaries(store_dir, files)
+
+# The provider SDKs take seconds to import, they are only imported once a client is needed
 
 def get_openai_client():
+    from dotenv import dotenv_values
+    from openai import OpenAI
+
     client = OpenAI(
         api_key=dotenv_values(".env")["OPENAI_API_KEY"]
     )
     return client
 
 def get_deepseek_client():
+    from dotenv import dotenv_values
+    from openai import OpenAI
+
     client = OpenAI(
         base_url="https://openrouter.ai/api/v1",
         api_key=dotenv_values(".env")["DEEPSEEK_API_KEY"]
     )
     return client
 
-def get_llm_query_result(query):
-    return get_openai_query_result(query)
+def is_openai_rate_limit_error(exception):
+    # openai is already imported whenever one of its exceptions is raised
+    from openai import RateLimitError
 
+    return isinstance(exception, RateLimitError)
 
 def openai_rate_limit_handler(retry_state):
     exception = retry_state.outcome.exception()
@@ -305,14 +690,14 @@ def deepseek_rate_limit_handler(retry_state):
     
 # Retry logic for API calls, independent per thread
 @retry(
-    retry=retry_if_exception_type(OpenAIRateLimitError),  # Retry only on RateLimitError
+    retry=retry_if_exception(is_openai_rate_limit_error),  # Retry only on RateLimitError
     stop=stop_after_attempt(5),  # Retry up to 5 times
     before_sleep=openai_rate_limit_handler
 )
-def get_openai_query_result(query):
+def get_openai_query_result(query, model="gpt-4o-mini"):
     client = get_openai_client()
     response = client.chat.completions.create(
-        model="gpt-4o-mini",
+        model=model,
         messages=[
             {
                 "role": "user",
@@ -326,15 +711,53 @@ def get_openai_query_result(query):
 
     return response.choices[0].message.content
 
+@retry(
+    retry=retry_if_exception(is_openai_rate_limit_error),
+    stop=stop_after_attempt(5),
+    before_sleep=openai_rate_limit_handler
+)
+def create_openai_stream(client, query, model, **kwargs):
+    # rate limits are raised when the request is sent, before the first chunk arrives
+    return client.chat.completions.create(
+        model=model,
+        messages=[
+            {
+                "role": "user",
+                "content": query,
+            }
+        ],
+        stream=True,
+        stream_options={"include_usage": True},
+        **kwargs
+    )
+
+def iter_openai_stream(stream):
+    for chunk in stream:
+        if chunk.usage is not None:
+            # the last chunk carries the usage of the whole completion
+            set_input_tokens(get_input_tokens() + chunk.usage.prompt_tokens)
+            set_output_tokens(get_output_tokens() + chunk.usage.completion_tokens)
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+def stream_openai_query_result(query, model="gpt-4o-mini"):
+    """
+    Like ``get_openai_query_result``, but yields the text of the completion as it is generated.
+    """
+    yield from iter_openai_stream(create_openai_stream(get_openai_client(), query, model, temperature=0.1))
+
+def stream_deepseek_query_result(query, model="deepseek/deepseek-r1:free"):
+    yield from iter_openai_stream(create_openai_stream(get_deepseek_client(), query, model))
+
 @retry(
     retry=retry_if_exception_type(DeepSeekTimeout),  # Retry only on RateLimitError
     stop=stop_after_attempt(5),  # Retry up to 5 times
     before_sleep=deepseek_rate_limit_handler
 )
-def get_deepseek_query_result(query):
+def get_deepseek_query_result(query, model="deepseek/deepseek-r1:free"):
     client = get_deepseek_client()
     response = client.chat.completions.create(
-        model="deepseek/deepseek-r1:free",
+        model=model,
         messages=[
             {
                 "role": "user",
@@ -350,9 +773,11 @@ def get_deepseek_query_result(query):
 def get_local_model():
     return "llama3.1:8B"
 
-def get_local_llm_query_result(query):
+def get_local_llm_query_result(query, model=None):
+    import ollama
+
     response = ollama.chat(
-        model=get_local_model(),
+        model=model or get_local_model(),
         messages=[
             {
                 "role": "user",
@@ -362,25 +787,66 @@ def get_local_llm_query_result(query):
     )
     return response["message"]["content"]
 
+def stream_local_llm_query_result(query, model=None):
+    import ollama
+
+    for chunk in ollama.chat(
+        model=model or get_local_model(),
+        messages=[
+            {
+                "role": "user",
+                "content": query,
+            }
+        ],
+        stream=True
+    ):
+        yield chunk["message"]["content"]
+
 def get_model_encoding_string():
     return "cl100k_base"
 
-def get_embeddings():
-    return get_openai_embeddings()
+def get_ollama_embeddings(model=None):
+    from langchain_ollama import OllamaEmbeddings
 
-def get_ollama_embeddings():
-    embeddings = OllamaEmbeddings(model=get_local_model())
+    embeddings = OllamaEmbeddings(model=model or get_local_model())
     return embeddings
 
-def get_openai_embeddings():
+def get_openai_embeddings(model="text-embedding-3-small"):
+    from dotenv import dotenv_values
+    from langchain_openai import OpenAIEmbeddings
+
     embeddings = OpenAIEmbeddings(
-        model="text-embedding-3-small",
+        model=model,
         openai_api_key=dotenv_values(".env")["OPENAI_API_KEY"]
     )
     return embeddings
 
+def use_project_store(repository_path, project_id):
+    """
+    Key the store of the repository by the project id instead of the directory name, for the current context.
+    """
+    _project_store.set((os.path.abspath(repository_path), project_id))
+
+def bump_index_version(directory):
+    """
+    Mark the project's index as changed, results computed from an older index are stale.
+    """
+    with open(os.path.join(get_store_dir_from_repository(directory), "index_version"), "w") as f:
+        f.write(str(time.time_ns()))
+
+def get_index_version(directory):
+    try:
+        with open(os.path.join(get_store_dir_from_repository(directory), "index_version"), "r") as f:
+            return f.read()
+    except FileNotFoundError:
+        return "0"
+
 def get_store_dir_from_repository(repository_path):
-    store_dir = os.path.join("./data", os.path.split(repository_path)[1])
+    project_path, project_id = _project_store.get()
+    if project_id is None or project_path != os.path.abspath(repository_path):
+        # guessing the store from the directory name would mix the stores of two checkouts
+        raise RuntimeError(f"No project store for {repository_path}, call use_project_store first.")
+    store_dir = os.path.join("./data", project_id)
     os.makedirs(store_dir, exist_ok=True)
     
     return store_dir
@@ -0,0 +1,228 @@
+import os
+import queue
+import threading
+import time
+
+from directory_summaries import build_directory_summaries, initialize_directory_vector_db
+from file_manifest import TEXT, iter_manifest, remove_from_manifest
+from graph_expansion import compute_file_centrality
+from profiling import profile_stage
+from quantized_index import rebuild_quantized_indexes
+from setup_repository import add_file_contents, initialize_summary_vector_db, initialize_content_vector_db, \
+    delete_vector_documents, SUMMARY_CHUNK_SIZE, SUMMARY_CHUNK_OVERLAP
+from symbol_graph import store_symbol_analysis_results
+from utils import BLACKLIST_PATTERN, get_store_dir_from_repository, matches_globs, iter_summaries, \
+    load_summary_hashes, delete_summaries, get_duplicate_members, unlink_duplicates, replace_call_analysis_results, \
+    bump_index_version, to_pipeline_path, filter_analysis_results, load_importers
+
+# seconds without changes before a burst of changes is processed
+WATCH_DEBOUNCE_SECONDS = 1.0
+# a burst is processed after this many seconds even while files keep changing
+WATCH_MAX_DELAY_SECONDS = 10.0
+WATCH_POLL_INTERVAL = 1.0
+
+
+def to_relative_path(directory, path):
+    return to_pipeline_path(os.path.relpath(path, directory))
+
+
+def is_watched(relative_path, project):
+    parts = os.path.normpath(relative_path).split(os.sep)
+    if parts[0] == os.pardir or any(BLACKLIST_PATTERN.match(part) for part in parts):
+        return False
+    return matches_globs(relative_path, project.get("include"), project.get("exclude"))
+
+
+def start_watchdog_observer(directory, changes):
+    """
+    Report changed paths with the filesystem events of watchdog (inotify on Linux).
+
+    Returns:
+        The started observer, or None if watchdog is not installed.
+    """
+    try:
+        from watchdog.events import FileSystemEventHandler
+        from watchdog.observers import Observer
+    except ImportError:
+        return None
+
+    class ChangeHandler(FileSystemEventHandler):
+        def on_any_event(self, event):
+            if event.is_directory or event.event_type in ("opened", "closed_no_write"):
+                return
+            changes.put(event.src_path)
+            if getattr(event, "dest_path", None):
+                changes.put(event.dest_path)
+
+    observer = Observer()
+    observer.schedule(ChangeHandler(), directory, recursive=True)
+    observer.daemon = True
+    observer.start()
+    return observer
+
+
+def snapshot_directory(directory):
+    snapshot = {}
+    for root, dirs, files in os.walk(directory, topdown=True):
+        dirs[:] = [d for d in dirs if BLACKLIST_PATTERN.match(d) is None]
+        for file in files:
+            path = os.path.join(root, file)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            snapshot[path] = (stat.st_size, stat.st_mtime_ns)
+    return snapshot
+
+
+def start_polling(directory, changes, stop, interval=WATCH_POLL_INTERVAL):
+    """
+    Report changed paths by comparing the size and modification time of all files, without watchdog.
+    """
+    def poll():
+        previous = snapshot_directory(directory)
+        while not stop.wait(interval):
+            current = snapshot_directory(directory)
+            for path in current.keys() | previous.keys():
+                if current.get(path) != previous.get(path):
+                    changes.put(path)
+            previous = current
+
+    thread = threading.Thread(target=poll, daemon=True)
+    thread.start()
+    return thread
+
+
+def iter_text_records(store_dir, directory, paths):
+    # the same records as join_file_lists yields for init, the relations are not needed for the summaries
+    for record in iter_manifest(store_dir, directory, paths, prune=False):
+        if record["verdict"] == TEXT:
+            yield {"calls": [], "called_by": [], **record}
+
+
+def update_files(directory, analyze_fn, paths, project):
+    """
+    Bring the index up to date for the changed files only.
+
+    The changed files are analysed, summarised and embedded again, removed files are dropped from all
+    stores. Unchanged files keep their summaries and vectors. The files that imported a removed file are
+    analysed again too, e.g. for a module that was renamed or turned into a package. Unchanged files
+    are not searched for imports of a created file: an import that did not resolve before, because the
+    module was missing, gets its edge with the next ``init --analyse``.
+
+    Args:
+        paths (set): Relative paths of the files that were created, modified or removed.
+
+    Returns:
+        int: The number of files whose summaries were generated again.
+    """
+    store_dir = get_store_dir_from_repository(directory)
+    existing = [path for path in paths if os.path.isfile(os.path.join(directory, path))]
+    records = list(iter_text_records(store_dir, directory, existing))
+    deleted = paths - set(existing)
+    # files that were deleted or are not indexed anymore, e.g. because they became binary
+    removed = paths - {record["file"] for record in records}
+    remove_from_manifest(store_dir, deleted)
+
+    analyse = analyze_fn is not None and not project.get("import_graphs")
+    importers = load_importers(directory, deleted) if analyse else set()
+    if deleted:
+        # also without analysis, e.g. for imported graphs, the removed files must not be expanded to
+        replace_call_analysis_results(directory, [], deleted)
+    if analyse:
+        # only the changed files and the importers of removed files are parsed, the imports of the changed
+        # files by other files are kept in the store
+        analysed = set(existing) | {file for file in importers if os.path.isfile(os.path.join(directory, file))}
+        results = filter_analysis_results(analyze_fn(directory, analysed), project.get("include"),
+                                          project.get("exclude"))
+        replace_call_analysis_results(directory, results)
+        store_symbol_analysis_results(directory, results)
+    if analyse or deleted:
+        compute_file_centrality(directory)
+
+    # the copies of changed files shared their summary, all of them are summarised on their own again
+    copies = {copy for members in get_duplicate_members(directory, paths).values() for copy in members} - paths
+    unlink_duplicates(directory, paths)
+    records += iter_text_records(store_dir, directory, sorted(copies))
+    delete_summaries(directory, removed)
+
+    stored_hashes = load_summary_hashes(directory)
+    add_file_contents(records, directory,
+                      chunk_size=project.get("chunk_size") or SUMMARY_CHUNK_SIZE,
+                      chunk_overlap=project.get("chunk_overlap") or SUMMARY_CHUNK_OVERLAP,
+                      workers=project.get("concurrency"), resume=True, share=project.get("share"))
+    updated_hashes = load_summary_hashes(directory)
+    summarised = [file for file, content_hash in updated_hashes.items() if stored_hashes.get(file) != content_hash]
+
+    delete_vector_documents(directory, removed | set(summarised))
+    if summarised and os.path.isdir(f"{store_dir}/summary_store"):
+        initialize_summary_vector_db(iter_summaries(directory, summarised), directory,
+                                     share=project.get("share"))
+    if summarised and os.path.isdir(f"{store_dir}/contents_store"):
+        initialize_content_vector_db(iter_summaries(directory, summarised), directory,
+                                     share=project.get("share"))
+    if summarised or removed:
+        rebuild_quantized_indexes(directory)
+    if summarised or removed:
+        build_directory_summaries(directory, workers=project.get("concurrency"))
+        initialize_directory_vector_db(directory)
+
+    bump_index_version(directory)
+    return len(summarised)
+
+
+def watch_project(directory, analyze_fn, args, project):
+    """
+    Keep the index of the project up to date while its files change, until interrupted with Ctrl-C.
+
+    Changes are collected until no file changed for ``args.debounce`` seconds (WATCH_DEBOUNCE_SECONDS
+    by default), so a checkout or a save of many files is processed at once. The index is expected to
+    be initialized with ``init`` before.
+    """
+    debounce = args.debounce or WATCH_DEBOUNCE_SECONDS
+    store_dir = os.path.abspath(get_store_dir_from_repository(directory))
+    changes = queue.Queue()
+    stop = threading.Event()
+    observer = None if args.poll else start_watchdog_observer(directory, changes)
+    if observer is None:
+        start_polling(directory, changes, stop)
+        print(f"Watching {directory} for changes, polling every {WATCH_POLL_INTERVAL} seconds...")
+    else:
+        print(f"Watching {directory} for changes...")
+
+    pending = set()
+    first_change = last_change = None
+    try:
+        while True:
+            try:
+                path = changes.get(timeout=debounce if pending else WATCH_POLL_INTERVAL)
+                relative_path = to_relative_path(directory, path)
+                # the stores change with every update, they may lie inside the watched directory
+                if not os.path.abspath(path).startswith(store_dir + os.sep) and \
+                        is_watched(relative_path, project):
+                    pending.add(relative_path)
+                    last_change = time.monotonic()
+                    first_change = first_change or last_change
+                if not pending or (time.monotonic() - last_change < debounce and
+                                   time.monotonic() - first_change < WATCH_MAX_DELAY_SECONDS):
+                    continue
+            except queue.Empty:
+                if not pending:
+                    continue
+
+            batch, pending = pending, set()
+            first_change = last_change = None
+            print(f"Updating {len(batch)} changed files...")
+            try:
+                with profile_stage(directory, "watch_update"):
+                    summarised = update_files(directory, analyze_fn, batch, project)
+                print(f"Updating {len(batch)} changed files done, {summarised} summarised again.")
+            except Exception as e:
+                print(f"Updating changed files failed: {e}")
+    except KeyboardInterrupt:
+        print("Watching stopped.")
+    finally:
+        stop.set()
+        if observer is not None:
+            observer.stop()
+            observer.join()